@@ -7,18 +7,23 @@ Base simulation entities
    :parts: 2
 """
 
+import contextvars
+import inspect
 import logging
+import re
+import threading
 import typing
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pprint import pformat
 
 import attr
 from dateutil.parser import parse
-from rdflib.graph import BNode, Graph
 
-from entity_management import nexus, typecheck
+from entity_management import identity, nexus, nexus_async, typecheck
 from entity_management.context import expand, get_resolved_context
 from entity_management.settings import (
+    COMPILED_SERIALIZER,
     DASH,
     JSLD_CTX,
     JSLD_ID,
@@ -26,8 +31,6 @@ from entity_management.settings import (
     JSLD_LINK_TAG,
     JSLD_TYPE,
     NSG,
-    NXV,
-    RDF,
     SCHEMA_UNCONSTRAINED,
     TYPE_TO_SCHEMA_MAPPING,
 )
@@ -36,6 +39,20 @@ from entity_management.util import AttrOf, NotInstantiated, _clean_up_dict, quot
 
 L = logging.getLogger(__name__)
 
+_SPARQL_LIMIT_RE = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+_SPARQL_ORDER_BY_RE = re.compile(r"\bORDER\s+BY\b", re.IGNORECASE)
+
+# deserializers by data type and deserialization plans by attrs class, built on first use
+_DESERIALIZERS = {}
+_DESERIALIZATION_PLANS = {}
+
+# serializers by value type and attrs field names by class, built on first use
+_SERIALIZERS = {}
+_FIELD_NAMES = {}
+
+_PREFETCH_EXECUTOR = None
+_PREFETCH_EXECUTOR_LOCK = threading.Lock()
+
 SYS_ATTRS = {
     "_id",
     "_type",
@@ -86,9 +103,29 @@ def attributes(attr_dict=None, repr=True):  # pylint: disable=redefined-builtin
     return lambda cls: attr.attrs(cls, these={k: v() for k, v in attr_dict.items()}, repr=repr)
 
 
+def _decode_listing(listing, cls):
+    """Get total number of results and ids of the ``cls`` instances from nexus listing json.
+
+    Types of the results can be either expanded or compacted with the neuroshapes prefix.
+    """
+    type_names = {str(cls._nsg_type), f"nsg:{cls.__name__}", cls.__name__}
+    ids = []
+    for result in listing["_results"]:
+        types = result.get(JSLD_TYPE, [])
+        if isinstance(types, str):
+            types = [types]
+        if not type_names.isdisjoint(types):
+            ids.append(result[JSLD_ID])
+    return listing["_total"], ids
+
+
 @attr.s
 class _NexusBySchemaIterator:
-    """Nexus paginated list iterator."""
+    """Nexus paginated list iterator.
+
+    If ``prefetch`` is True the next page is fetched in the background while the current one is
+    consumed.
+    """
 
     cls = attr.ib()
     total_items = attr.ib(type=int, default=None)
@@ -99,44 +136,80 @@ class _NexusBySchemaIterator:
     org = attr.ib(default=None)
     proj = attr.ib(default=None)
     use_auth = attr.ib(default=None)
+    prefetch = attr.ib(type=bool, default=False)
     _item_index = attr.ib(type=int, default=0)
     _page = attr.ib(default=None)
+    _next_page = attr.ib(default=None)
 
     def __iter__(self):
         return self
 
+    def _fetch_page(self, page_from):
+        listing = nexus.load_by_url(
+            self.cls.get_constrained_url(base=self.base, org=self.org, proj=self.proj),
+            params={
+                "from": page_from,
+                "size": self.page_size,
+                "deprecated": self.deprecated,
+            },
+            token=self.use_auth,
+        )
+        return _decode_listing(listing, self.cls)
+
     def __next__(self):
         """Return next entity from the paginated result set, fetch next page if required"""
         # fetch next page if needed
-        if self.total_items is None or self.page_from + self.page_size == self._item_index:
-            self.page_from = self._item_index
-            data = nexus.load_by_url(
-                self.cls.get_constrained_url(base=self.base, org=self.org, proj=self.proj),
-                stream=True,
-                params={
-                    "from": self.page_from,
-                    "size": self.page_size,
-                    "deprecated": self.deprecated,
-                },
-                token=self.use_auth,
-            )
-            graph = Graph().parse(data=data, format="json-ld")
-            self.total_items = [
-                o for s, o in graph.subject_objects(NXV.total) if isinstance(s, BNode)
-            ][0].value
-            self._page = [str(subj) for subj in graph.subjects(RDF.type, self.cls._nsg_type)]
+        while self._page is None or self._item_index >= len(self._page):
+            if self.total_items is None:
+                page_from = self.page_from
+            elif self.page_from + self.page_size < self.total_items:
+                page_from = self.page_from + self.page_size
+            else:
+                raise StopIteration()
 
-        if self._item_index >= self.total_items:
-            raise StopIteration()
+            if self._next_page is not None:
+                self.total_items, self._page = self._next_page.result()
+                self._next_page = None
+            else:
+                self.total_items, self._page = self._fetch_page(page_from)
+            self.page_from = page_from
+            self._item_index = 0
+
+            if self.prefetch and self.page_from + self.page_size < self.total_items:
+                self._next_page = _get_prefetch_executor().submit(
+                    contextvars.copy_context().run,
+                    self._fetch_page,
+                    self.page_from + self.page_size,
+                )
 
-        id_url = self._page[self._item_index - self.page_from]
+        id_url = self._page[self._item_index]
         self._item_index += 1
         return self.cls._lazy_init(id_url, base=self.base, org=self.org, proj=self.proj)
 
 
+def _get_prefetch_executor():
+    """Get the executor fetching the next pages of the iterators in the background."""
+    global _PREFETCH_EXECUTOR  # pylint: disable=global-statement
+    with _PREFETCH_EXECUTOR_LOCK:
+        if _PREFETCH_EXECUTOR is None:
+            _PREFETCH_EXECUTOR = ThreadPoolExecutor(thread_name_prefix="nexus-prefetch")
+    return _PREFETCH_EXECUTOR
+
+
 @attr.s
 class _NexusBySparqlIterator:
-    """Nexus paginated list iterator."""
+    """Nexus paginated list iterator.
+
+    Pages of ``page_size`` results are requested by appending LIMIT/OFFSET to the query, ordered
+    by ``?entity`` if the query has no ORDER BY. Queries with their own LIMIT are fetched in one
+    request. If ``prefetch`` is True the next page is fetched in the background while the current
+    one is consumed.
+
+    If ``eager`` is True the payloads of all the entities of a page are loaded with one
+    Elasticsearch query, so that reading their attributes does not need a request per entity.
+    Entities not found in the index are still lazily loaded. Their contexts are resolved if
+    ``resolve_context`` is True.
+    """
 
     cls = attr.ib()
     query = attr.ib(type=str)
@@ -144,27 +217,100 @@ class _NexusBySparqlIterator:
     org = attr.ib(type=str, default=None)
     proj = attr.ib(type=str, default=None)
     use_auth = attr.ib(type=str, default=None)
+    page_size = attr.ib(type=int, default=1000)
+    prefetch = attr.ib(type=bool, default=False)
+    eager = attr.ib(type=bool, default=False)
+    resolve_context = attr.ib(type=bool, default=False)
     _item_index = attr.ib(type=int, default=0)
     _page = attr.ib(default=None)
+    _page_from = attr.ib(type=int, default=0)
+    _next_page = attr.ib(default=None)
 
     def __iter__(self):
         return self
 
+    def _is_paginated(self):
+        return self.page_size is not None and not _SPARQL_LIMIT_RE.search(self.query)
+
+    def _page_query(self, page_from):
+        """Get the query for the page starting at ``page_from``."""
+        if not self._is_paginated():
+            return self.query
+        order = "" if _SPARQL_ORDER_BY_RE.search(self.query) else "ORDER BY ?entity\n"
+        return f"{self.query}\n{order}LIMIT {self.page_size}\nOFFSET {page_from}"
+
+    def _fetch_page(self, page_from):
+        json = nexus.sparql_query(
+            self._page_query(page_from),
+            base=self.base,
+            org=self.org,
+            proj=self.proj,
+            token=self.use_auth,
+        )
+        ids = [i["entity"]["value"] for i in json["results"]["bindings"]]
+        if self.eager and ids:
+            return self._load_page(ids)
+        return ids
+
+    def _load_page(self, ids):
+        """Build the entities of the page from their payloads, keep the ids not found."""
+        payloads = nexus.es_load_by_ids(
+            ids, base=self.base, org=self.org, proj=self.proj, token=self.use_auth
+        )
+        return [
+            (
+                self.cls._from_json_ld(
+                    payloads[id_],
+                    id_,
+                    on_no_result=None,
+                    resolve_context=self.resolve_context,
+                    base=self.base,
+                    org=self.org,
+                    proj=self.proj,
+                    use_auth=self.use_auth,
+                )
+                if id_ in payloads
+                else id_
+            )
+            for id_ in ids
+        ]
+
+    def _has_next_page(self):
+        return self._is_paginated() and len(self._page) == self.page_size
+
     def __next__(self):
         """Return next entity from the paginated result set, fetch next page if required"""
-        # fetch next page if needed
+        # fetch first page
         if self._page is None:
-            json = nexus.sparql_query(
-                self.query, base=self.base, org=self.org, proj=self.proj, token=self.use_auth
-            )
-            self._page = [i["entity"]["value"] for i in json["results"]["bindings"]]
+            self._page = self._fetch_page(0)
+            self._prefetch_next_page()
 
-        if self._item_index >= len(self._page):
-            raise StopIteration()
+        # fetch next page if needed
+        if self._item_index - self._page_from >= len(self._page):
+            if not self._has_next_page():
+                raise StopIteration()
+            self._page_from += len(self._page)
+            if self._next_page is not None:
+                self._page = self._next_page.result()
+                self._next_page = None
+            else:
+                self._page = self._fetch_page(self._page_from)
+            self._prefetch_next_page()
 
-        id_url = self._page[self._item_index]
+            if not self._page:
+                raise StopIteration()
+
+        item = self._page[self._item_index - self._page_from]
         self._item_index += 1
-        return self.cls._lazy_init(id_url, base=self.base, org=self.org, proj=self.proj)
+        if isinstance(item, str):
+            return self.cls._lazy_init(item, base=self.base, org=self.org, proj=self.proj)
+        return item
+
+    def _prefetch_next_page(self):
+        if self.prefetch and self._has_next_page():
+            self._next_page = _get_prefetch_executor().submit(
+                contextvars.copy_context().run, self._fetch_page, self._page_from + len(self._page)
+            )
 
 
 @attr.s(frozen=True)
@@ -227,39 +373,101 @@ class BlankNode(Frozen, metaclass=_RegistryMeta):
 
 def _serialize_obj(value, include_rev=False):
     """Serialize object"""
+    if COMPILED_SERIALIZER:
+        return _get_serializer(type(value))(value, include_rev)
+    return _serialize_obj_generic(value, include_rev)
+
+
+def _serialize_obj_generic(value, include_rev=False):
+    """Serialize object inspecting its type."""
     if isinstance(value, OntologyTerm):
-        return {JSLD_ID: value.url, "label": value.label}
+        return _serialize_ontology_term(value, include_rev)
 
     if isinstance(value, Identifiable):
-        if include_rev:
-            return {JSLD_ID: value._id, JSLD_TYPE: value._type, JSLD_LINK_REV: value._rev}
-        else:
-            return {JSLD_ID: value._id, JSLD_TYPE: value._type}
+        return _serialize_link(value, include_rev)
 
     if isinstance(value, datetime):
-        return value.isoformat()
+        return _serialize_datetime(value, include_rev)
 
     if attr.has(type(value)):
-        rv = {}
-        for attribute in attr.fields(type(value)):
-            attr_name = attribute.name
-            attr_value = getattr(value, attr_name)
-            if attr_value is not None:  # ignore empty values
-                if isinstance(attr_value, (tuple, list, set)):
-                    rv[attr_name] = [_serialize_obj(i, include_rev) for i in attr_value]
-                elif isinstance(attr_value, dict):
-                    rv[attr_name] = {
-                        kk: _serialize_obj(vv, include_rev) for kk, vv in attr_value.items()
-                    }
-                else:
-                    rv[attr_name] = _serialize_obj(attr_value, include_rev)
-        if hasattr(value, "_type"):  # BlankNode have types
-            rv[JSLD_TYPE] = value._type
-        return rv
+        return _serialize_attrs(value, include_rev, [a.name for a in attr.fields(type(value))])
 
     return value
 
 
+def _get_serializer(value_type):
+    """Get the serializer of the values of value_type, the type dispatch is done once per type."""
+    try:
+        return _SERIALIZERS[value_type]
+    except KeyError:
+        serializer = _SERIALIZERS[value_type] = _make_serializer(value_type)
+        return serializer
+
+
+def _make_serializer(value_type):
+    """Find the function serializing the values of value_type."""
+    if issubclass(value_type, OntologyTerm):
+        return _serialize_ontology_term
+
+    if issubclass(value_type, Identifiable):
+        return _serialize_link
+
+    if issubclass(value_type, datetime):
+        return _serialize_datetime
+
+    if attr.has(value_type):
+        field_names = _get_field_names(value_type)
+        return lambda value, include_rev: _serialize_attrs(value, include_rev, field_names)
+
+    return _serialize_as_is
+
+
+def _get_field_names(cls):
+    """Get the names of the fields of the attrs class."""
+    try:
+        return _FIELD_NAMES[cls]
+    except KeyError:
+        field_names = _FIELD_NAMES[cls] = tuple(field.name for field in attr.fields(cls))
+        return field_names
+
+
+def _serialize_as_is(value, _include_rev):
+    return value
+
+
+def _serialize_ontology_term(value, _include_rev):
+    return {JSLD_ID: value.url, "label": value.label}
+
+
+def _serialize_link(value, include_rev):
+    if include_rev:
+        return {JSLD_ID: value._id, JSLD_TYPE: value._type, JSLD_LINK_REV: value._rev}
+    return {JSLD_ID: value._id, JSLD_TYPE: value._type}
+
+
+def _serialize_datetime(value, _include_rev):
+    return value.isoformat()
+
+
+def _serialize_attrs(value, include_rev, field_names):
+    """Serialize the fields of an attrs class instance."""
+    rv = {}
+    for attr_name in field_names:
+        attr_value = getattr(value, attr_name)
+        if attr_value is not None:  # ignore empty values
+            if isinstance(attr_value, (tuple, list, set)):
+                rv[attr_name] = [_serialize_obj(i, include_rev) for i in attr_value]
+            elif isinstance(attr_value, dict):
+                rv[attr_name] = {
+                    kk: _serialize_obj(vv, include_rev) for kk, vv in attr_value.items()
+                }
+            else:
+                rv[attr_name] = _serialize_obj(attr_value, include_rev)
+    if hasattr(value, "_type"):  # BlankNode have types
+        rv[JSLD_TYPE] = value._type
+    return rv
+
+
 def _deserialize_list(data_type, data_raw, *, context, base, org, proj, token):
     """Deserialize list of json elements"""
     # Enforce a list of a single element if data_raw is not a sequence
@@ -329,56 +537,111 @@ def _deserialize_json_to_datatype(
     data_type, data_raw, *, context=None, base=None, org=None, proj=None, token=None
 ):
     """Deserialize raw data json to data_type"""
-    # pylint: disable=too-many-return-statements
+    return _deserialize_with(
+        _get_deserializer(data_type),
+        data_type,
+        data_raw,
+        context=context,
+        base=base,
+        org=org,
+        proj=proj,
+        token=token,
+    )
+
+
+def _deserialize_with(deserializer, data_type, data_raw, *, context, base, org, proj, token):
+    """Deserialize raw data json to data_type with the deserializer of the data_type."""
     if data_raw is None:
         return None
 
     try:
-        if data_type in {str, int, float, bool}:
-            return data_type(data_raw)
+        return deserializer(
+            data_type, data_raw, context=context, base=base, org=org, proj=proj, token=token
+        )
+    except Exception:
+        L.error("Error deserializing type: %s for raw data:\n%s", data_type, pformat(data_raw))
+        raise
 
-        type_class = _type_class(data_type)
 
-        if typecheck.is_type_sequence(type_class):
-            return _deserialize_list(
-                data_type, data_raw, context=context, base=base, org=org, proj=proj, token=token
-            )
+def _get_deserializer(data_type):
+    """Get the deserializer of the data_type, the type dispatch is done once per type."""
+    try:
+        return _DESERIALIZERS[data_type]
+    except KeyError:
+        deserializer = _DESERIALIZERS[data_type] = _make_deserializer(data_type)
+        return deserializer
+    except TypeError:  # unhashable type
+        return _make_deserializer(data_type)
 
-        if typecheck.is_type_mapping(type_class):
-            return _deserialize_dict(
-                data_type, data_raw, context=context, base=base, org=org, proj=proj, token=token
-            )
 
-        if typecheck.is_type_union(type_class):
-            return _deserialize_union(
-                data_type, data_raw, context=context, base=base, org=org, proj=proj, token=token
-            )
+def _make_deserializer(data_type):
+    """Find the function deserializing raw data json to data_type."""
+    # pylint: disable=too-many-return-statements
+    if data_type in {str, int, float, bool}:
+        return _deserialize_builtin
+
+    type_class = _type_class(data_type)
+
+    if typecheck.is_type_sequence(type_class):
+        return _deserialize_list
 
+    if typecheck.is_type_mapping(type_class):
+        return _deserialize_dict
+
+    if typecheck.is_type_union(type_class):
+        return _deserialize_union
+
+    if inspect.isclass(type_class):
         if issubclass(type_class, Identifiable):
-            return _deserialize_identifiable(
-                data_type, data_raw, base=base, org=org, proj=proj, token=token
-            )
+            return _deserialize_identifiable
 
         if issubclass(type_class, OntologyTerm):
-            return data_type(url=expand(context, data_raw[JSLD_ID]), label=data_raw["label"])
+            return _deserialize_ontology_term
 
         if issubclass(type_class, Frozen):
-            return _deserialize_frozen(
-                data_type, data_raw, context=context, base=base, org=org, proj=proj, token=token
-            )
+            return _deserialize_frozen
 
         if type_class == datetime:
-            return _deserialize_datetime(data_raw)
+            return _deserialize_datetime
 
-        # attr classes that are not subclasses of Identifiable or Frozen
-        return data_type(**_clean_up_dict(data_raw))
+    # attr classes that are not subclasses of Identifiable or Frozen
+    return _deserialize_attrs
 
-    except Exception:
-        L.error("Error deserializing type: %s for raw data:\n%s", data_type, pformat(data_raw))
-        raise
 
+def _get_deserialization_plan(cls):
+    """Get the deserialization plan of the attrs class.
+
+    The plan maps the name of each field to a tuple with the field type, its deserializer and
+    whether the field is an init argument.
+    """
+    try:
+        return _DESERIALIZATION_PLANS[cls]
+    except KeyError:
+        plan = _DESERIALIZATION_PLANS[cls] = _make_deserialization_plan(cls)
+        return plan
 
-def _deserialize_datetime(data_raw):
+
+def _make_deserialization_plan(cls):
+    """Build the deserialization plan of the attrs class."""
+    return {
+        field.name: (field.type, _get_deserializer(field.type), field.init)
+        for field in attr.fields(cls)
+    }
+
+
+def _deserialize_builtin(data_type, data_raw, **_):
+    return data_type(data_raw)
+
+
+def _deserialize_ontology_term(data_type, data_raw, *, context, **_):
+    return data_type(url=expand(context, data_raw[JSLD_ID]), label=data_raw["label"])
+
+
+def _deserialize_attrs(data_type, data_raw, **_):
+    return data_type(**_clean_up_dict(data_raw))
+
+
+def _deserialize_datetime(_data_type, data_raw, **_):
     if typecheck.is_data_mapping(data_raw):
         return parse(data_raw["@value"])
     return parse(data_raw)
@@ -427,7 +690,7 @@ def _deserialize_union(data_type, data_raw, *, context, base, org, proj, token):
     )
 
 
-def _deserialize_identifiable(data_type, data_raw, *, base, org, proj, token):
+def _deserialize_identifiable(data_type, data_raw, *, base, org, proj, token, **_):
     """Deserialize an Identifiable class."""
     resource_id = data_raw[JSLD_ID]
     type_ = data_raw[JSLD_TYPE]
@@ -450,7 +713,7 @@ def _deserialize_identifiable(data_type, data_raw, *, base, org, proj, token):
 
 def _deserialize_frozen(data_type, data_raw, context, base, org, proj, token):
 
-    attr_fields = attr.fields_dict(data_type)
+    plan = _get_deserialization_plan(data_type)
 
     # Blank node is represented as an Identifiable.
     # Get the payload from the id to use as raw data.
@@ -460,11 +723,11 @@ def _deserialize_frozen(data_type, data_raw, context, base, org, proj, token):
         )
 
     field_values = {
-        k: _deserialize_json_to_datatype(
-            attr_fields[k].type, v, context=context, base=base, org=org, proj=proj, token=token
+        k: _deserialize_with(
+            plan[k][1], plan[k][0], v, context=context, base=base, org=org, proj=proj, token=token
         )
         for k, v in data_raw.items()
-        if k in attr_fields
+        if k in plan
     }
     data = data_type(**field_values)
 
@@ -498,12 +761,18 @@ def _deserialize_resource(
 
         # prepare all entity init args
         init_args = {}
-        for field in attr.fields(cls):
-            raw = json_ld.get(field.name)
-            if field.init and raw is not None:
-                type_ = field.type
-                init_args[field.name] = _deserialize_json_to_datatype(
-                    type_, raw, context=context, base=base, org=org, proj=proj, token=token
+        for name, (type_, deserializer, init) in _get_deserialization_plan(cls).items():
+            raw = json_ld.get(name)
+            if init and raw is not None:
+                init_args[name] = _deserialize_with(
+                    deserializer,
+                    type_,
+                    raw,
+                    context=context,
+                    base=base,
+                    org=org,
+                    proj=proj,
+                    token=token,
                 )
         instance = cls(**init_args)
 
@@ -565,17 +834,35 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
         org=None,
         proj=None,
     ):
-        """Instantiate an object and put all its attributes to NotInstantiated."""
-        # Running the validator has the side effect of instantiating
-        # the object, which we do not want
-        attr.set_run_validators(False)
-        obj = cls(**{arg.name: NotInstantiated for arg in attr.fields(cls)})
-        obj._force_attr("_id", resource_id)
-        obj._force_attr("_type", type_)
-        obj._force_attr("_rev", rev)
-        obj._force_attr("_tag", tag)
-        obj._force_attr("_lazy_meta_", (base, org, proj))
-        attr.set_run_validators(True)
+        """Instantiate an object and put all its attributes to NotInstantiated.
+
+        If an identity map is active, the instance already registered for the same revision or
+        tag of the resource is returned instead.
+        """
+        entities = identity.get_identity_map()
+        key = None
+        if entities is not None:
+            key = identity.identity_key(resource_id, rev, tag)
+            entity = entities.get(key)
+            if isinstance(entity, cls):
+                return entity
+            if entity is not None:  # registered with another type, do not share it
+                entities = None
+
+        # The object is allocated without running __init__, because running the validators has
+        # the side effect of instantiating the object, which we do not want. Disabling the
+        # validators is not an option, it is a global attrs setting shared by all the threads.
+        obj = object.__new__(cls)
+        for name in _get_field_names(cls):
+            object.__setattr__(obj, name, NotInstantiated)
+        object.__setattr__(obj, "_id", resource_id)
+        object.__setattr__(obj, "_type", type_)
+        object.__setattr__(obj, "_rev", rev)
+        object.__setattr__(obj, "_tag", tag)
+        object.__setattr__(obj, "_lazy_meta_", (base, org, proj))
+
+        if entities is not None:
+            return entities.setdefault(key, obj)
         return obj
 
     @classmethod
@@ -613,6 +900,10 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
             use_auth (str): OAuth token in case access is restricted.
                 Token should be in the format for the authorization header: Bearer VALUE.
         """
+        entity = identity.get_loaded(resource_id, cls)
+        if entity is not None:
+            return entity
+
         json_ld = nexus.load_by_id(
             resource_id=resource_id,
             cross_bucket=cross_bucket,
@@ -622,15 +913,174 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
             token=use_auth,
         )
 
-        if json_ld is not None:
-            return _deserialize_resource(
+        return cls._from_json_ld(
+            json_ld,
+            resource_id,
+            on_no_result=on_no_result,
+            resolve_context=resolve_context,
+            base=base,
+            org=org,
+            proj=proj,
+            use_auth=use_auth,
+            **kwargs,
+        )
+
+    @classmethod
+    def from_ids(
+        cls,
+        resource_ids,
+        *,
+        max_concurrency=None,
+        on_no_result=None,
+        cross_bucket=False,
+        resolve_context=False,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+        **kwargs,
+    ):
+        """
+        Load entities from resource ids concurrently.
+
+        Entities are built as soon as their resources arrive.
+
+        Args:
+            resource_ids (list): ids of the entities to load.
+            max_concurrency (int): Maximum number of concurrent requests. Default is
+                ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+            on_no_result (Callable): A function to be called for each id not found. It will receive
+                `resource_id` as a first argument.
+            cross_bucket (bool):
+                Use the resolvers instead of the resources endpoint. Default False.
+            resolve_context (bool):
+                Resolve ontological term curies using the resource's context. Default False.
+            kwargs: Keyword arguments which will be forwarded to ``on_no_result`` function.
+            use_auth (str): OAuth token in case access is restricted.
+                Token should be in the format for the authorization header: Bearer VALUE.
+
+        Returns:
+            List of entities in the order of ``resource_ids``. Ids not found are logged and their
+            entry is None or the result of ``on_no_result``.
+        """
+        resource_ids = list(resource_ids)
+        entities = [identity.get_loaded(resource_id, cls) for resource_id in resource_ids]
+        to_load = [index for index, entity in enumerate(entities) if entity is None]
+        missing = []
+        for i, json_ld in nexus.iter_load_by_ids(
+            [resource_ids[index] for index in to_load],
+            max_concurrency=max_concurrency,
+            cross_bucket=cross_bucket,
+            base=base,
+            org=org,
+            proj=proj,
+            token=use_auth,
+        ):
+            index = to_load[i]
+            if json_ld is None:
+                missing.append(resource_ids[index])
+            entities[index] = cls._from_json_ld(
                 json_ld,
-                cls,
+                resource_ids[index],
+                on_no_result=on_no_result,
                 resolve_context=resolve_context,
                 base=base,
                 org=org,
                 proj=proj,
-                token=use_auth,
+                use_auth=use_auth,
+                **kwargs,
+            )
+
+        if missing:
+            L.warning("%d resources not found: %s", len(missing), missing)
+
+        return entities
+
+    @classmethod
+    async def afrom_id(
+        cls,
+        resource_id,
+        *,
+        on_no_result=None,
+        cross_bucket=False,
+        resolve_context=False,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+        **kwargs,
+    ):
+        """
+        Load entity from resource id without blocking the event loop.
+
+        Awaitable counterpart of :meth:`from_id`, ``on_no_result`` can be a coroutine function.
+        Note that resolving the context is done synchronously.
+
+        Args:
+            resource_id (str): id of the entity to load.
+            on_no_result (Callable): A function to be called when no result found. It will receive
+                `resource_id` as a first argument.
+            cross_bucket (bool):
+                Use the resolvers instead of the resources endpoint. Default False.
+            resolve_context (bool):
+                Resolve ontological term curies using the resource's context. Default False.
+            kwargs: Keyword arguments which will be forwarded to ``on_no_result`` function.
+            use_auth (str): OAuth token in case access is restricted.
+                Token should be in the format for the authorization header: Bearer VALUE.
+        """
+        entity = identity.get_loaded(resource_id, cls)
+        if entity is not None:
+            return entity
+
+        json_ld = await nexus_async.load_by_id(
+            resource_id=resource_id,
+            cross_bucket=cross_bucket,
+            base=base,
+            org=org,
+            proj=proj,
+            token=use_auth,
+        )
+
+        result = cls._from_json_ld(
+            json_ld,
+            resource_id,
+            on_no_result=on_no_result,
+            resolve_context=resolve_context,
+            base=base,
+            org=org,
+            proj=proj,
+            use_auth=use_auth,
+            **kwargs,
+        )
+        return await result if inspect.isawaitable(result) else result
+
+    @classmethod
+    def _from_json_ld(
+        cls,
+        json_ld,
+        resource_id,
+        *,
+        on_no_result,
+        resolve_context,
+        base,
+        org,
+        proj,
+        use_auth,
+        **kwargs,
+    ):
+        """Build entity from the loaded json-ld or call ``on_no_result`` if it was not found."""
+        if json_ld is not None:
+            return identity.register(
+                resource_id,
+                _deserialize_resource(
+                    json_ld,
+                    cls,
+                    resolve_context=resolve_context,
+                    base=base,
+                    org=org,
+                    proj=proj,
+                    token=use_auth,
+                ),
             )
         elif on_no_result is not None:
             return on_no_result(
@@ -671,10 +1121,10 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
         """List all instances belonging to the schema this type defines.
 
         Args:
-            changes: Keyword changes in the new copy, should be a subset of class
-                constructor(__init__) keyword arguments.
+            kwargs: Options of the iterator, like ``page_size``, ``deprecated`` or ``prefetch``
+                to fetch the next page in the background.
         Returns:
-            New instance of the same class with changes applied.
+            Iterator through the found resources.
         """
         return _NexusBySchemaIterator(cls, **kwargs)
 
@@ -702,10 +1152,9 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
             return self.json  # pylint: disable=no-member
 
         json_ld = {}
-        for attribute in attr.fields(type(self)):
-            attr_value = getattr(self, attribute.name)
+        for attr_name in _get_field_names(type(self)):
+            attr_value = getattr(self, attr_name)
             if attr_value is not None:  # ignore empty values
-                attr_name = attribute.name
                 if typecheck.is_data_sequence(attr_value):
                     json_ld[attr_name] = [_serialize_obj(i, include_rev) for i in attr_value]
                 elif typecheck.is_data_mapping(attr_value):
@@ -763,23 +1212,75 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
                 token=use_auth,
             )
         else:
+            json_ld = nexus.create(
+                self._get_create_url(base, org, proj),
+                payload,
+                resource_id,
+                sync_index=sync_index,
+                token=use_auth,
+            )
 
-            # Maintain backwards compatibility by registering entities that are not constrained by
-            # a schema as unconstrained, i.e. without specifying a schema in the request.
-            if self._constrainedBy in {NotInstantiated, SCHEMA_UNCONSTRAINED}:
-                schema_id = None
-                L.warning("No schema found for %s. It will be registered as unconstrained.", self)
-            else:
-                schema_id = quote(self._constrainedBy)
+        self._process_publish_response(json_ld, payload)
+        return self
 
-            json_ld = nexus.create(
-                get_base_url(base, org, proj, schema_id=schema_id),
+    async def apublish(
+        self,
+        *,
+        resource_id=None,
+        sync_index=False,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+        include_rev=False,
+    ):
+        """Create or update entity in nexus without blocking the event loop.
+
+        Awaitable counterpart of :meth:`publish`.
+
+        Args:
+            resource_id (str): Resource identifier. If not provided nexus will generate one.
+            use_auth (str): OAuth token in case access is restricted.
+                Token should be in the format for the authorization header: Bearer VALUE.
+            include_rev (bool): Whether to include _rev in the linked entities or not.
+        Returns:
+            New instance of the same class with revision updated.
+        """
+        payload = self.as_json_ld(include_rev)
+
+        if self._id:
+            json_ld = await nexus_async.update(
+                self._self,
+                self._rev,
+                payload,
+                sync_index=sync_index,
+                token=use_auth,
+            )
+        else:
+            json_ld = await nexus_async.create(
+                self._get_create_url(base, org, proj),
                 payload,
                 resource_id,
                 sync_index=sync_index,
                 token=use_auth,
             )
 
+        self._process_publish_response(json_ld, payload)
+        return self
+
+    def _get_create_url(self, base, org, proj):
+        """Get url where to create the entity."""
+        # Maintain backwards compatibility by registering entities that are not constrained by
+        # a schema as unconstrained, i.e. without specifying a schema in the request.
+        if self._constrainedBy in {NotInstantiated, SCHEMA_UNCONSTRAINED}:
+            schema_id = None
+            L.warning("No schema found for %s. It will be registered as unconstrained.", self)
+        else:
+            schema_id = quote(self._constrainedBy)
+
+        return get_base_url(base, org, proj, schema_id=schema_id)
+
+    def _process_publish_response(self, json_ld, payload):
         # Nexus truncates the contexts and expands the bmo types. For example:
         #
         # '@type': [
@@ -800,7 +1301,6 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
             json_ld[JSLD_TYPE] = payload[JSLD_TYPE]
 
         self._process_response(json_ld)
-        return self
 
     def _process_response(self, json_ld):
         for sys_attr in SYS_ATTRS:
@@ -833,9 +1333,16 @@ class Identifiable(Frozen, metaclass=_IdentifiableMeta):
             resource_id, base=base, org=org, proj=proj, cross_bucket=True
         )
 
-        for attribute in attr.fields(type(self)):
-            self._force_attr(attribute.name, getattr(fetched_instance, attribute.name))
-        _copy_sys_meta(fetched_instance, self)
+        # the identity map may have filled this instance already
+        if fetched_instance is not self:
+            self._fill_from(fetched_instance)
+
+    def _fill_from(self, instance):
+        """Fill the lazy entity with the attributes and system metadata of the loaded instance."""
+        for attr_name in _get_field_names(type(self)):
+            self._force_attr(attr_name, getattr(instance, attr_name))
+        _copy_sys_meta(instance, self)
+        self.__dict__.pop("_lazy_meta_", None)
 
     def deprecate(self, sync_index=False, use_auth=None):
         """Mark entity as deprecated.
@@ -0,0 +1,833 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Caches of the nexus resources.
+
+A revision of a resource never changes, so the responses of the requests pinned with ``rev`` or
+``tag`` are kept on disk and reused across runs and processes. The resource cache is disabled by
+default, enable it with the ``NEXUS_RESOURCE_CACHE`` environment variable or::
+
+    from entity_management import cache
+    cache.configure_resource_cache(enabled=True, path="/tmp/nexus-cache.sqlite")
+
+Note that tags can be moved to another revision in nexus, clear the cache if it happens.
+
+The latest revision of the resources loaded without ``rev`` or ``tag`` is kept in memory with
+its ``ETag`` and ``Last-Modified`` validators, and revalidated with conditional requests, so
+that unchanged resources are not transferred again. The revalidating cache is disabled by
+default, enable it with the ``NEXUS_REVALIDATING_CACHE`` environment variable or::
+
+    cache.configure_revalidating_cache(enabled=True)
+
+The downloaded files with a digest are kept on disk by digest and shared by the processes using
+the same directory, so that a file requested by many tasks is fetched once. The distribution
+cache is disabled by default, enable it with the ``NEXUS_DISTRIBUTION_CACHE`` environment
+variable or::
+
+    cache.configure_distribution_cache(enabled=True, path="/gpfs/.../distribution-cache")
+
+The metadata of the files pinned with a tag or a revision, giving their location or name, is kept
+in memory so that it is requested once for all the helpers of :mod:`entity_management.nexus`
+reading it. The metadata of the latest revision of a file can be updated by other processes, it
+is only cached if the ``NEXUS_FILE_METADATA_CACHE_TTL`` environment variable sets the seconds
+after which it expires, 0 by default, or with::
+
+    cache.configure_file_metadata_cache(ttl=60)
+
+The file metadata cache is enabled by default, disable it with the ``NEXUS_FILE_METADATA_CACHE``
+environment variable or::
+
+    cache.configure_file_metadata_cache(enabled=False)
+"""
+
+import copy
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager, suppress
+from pathlib import Path
+from urllib.parse import urlencode
+
+import httpx
+import jwt
+
+from entity_management.settings import (
+    DISTRIBUTION_CACHE,
+    DISTRIBUTION_CACHE_MAX_SIZE,
+    DISTRIBUTION_CACHE_PATH,
+    FILE_METADATA_CACHE,
+    FILE_METADATA_CACHE_MAX_ENTRIES,
+    FILE_METADATA_CACHE_TTL,
+    RESOURCE_CACHE,
+    RESOURCE_CACHE_MAX_SIZE,
+    RESOURCE_CACHE_PATH,
+    REVALIDATING_CACHE,
+    REVALIDATING_CACHE_MAX_SIZE,
+)
+from entity_management.state import get_session, get_token_info
+
+L = logging.getLogger(__name__)
+
+_PINNING_PARAMS = {"rev", "tag"}
+
+_RESOURCE_CACHE = None
+_RESOURCE_CACHE_OPTIONS = {
+    "enabled": RESOURCE_CACHE,
+    "path": RESOURCE_CACHE_PATH,
+    "max_size": RESOURCE_CACHE_MAX_SIZE,
+}
+_RESOURCE_CACHE_LOCK = threading.Lock()
+
+_REVALIDATING_CACHE = None
+_REVALIDATING_CACHE_OPTIONS = {
+    "enabled": REVALIDATING_CACHE,
+    "max_size": REVALIDATING_CACHE_MAX_SIZE,
+}
+_REVALIDATING_CACHE_LOCK = threading.Lock()
+
+_DISTRIBUTION_CACHE = None
+_DISTRIBUTION_CACHE_OPTIONS = {
+    "enabled": DISTRIBUTION_CACHE,
+    "path": DISTRIBUTION_CACHE_PATH,
+    "max_size": DISTRIBUTION_CACHE_MAX_SIZE,
+}
+_DISTRIBUTION_CACHE_LOCK = threading.Lock()
+
+_FILE_METADATA_CACHE = None
+_FILE_METADATA_CACHE_OPTIONS = {
+    "enabled": FILE_METADATA_CACHE,
+    "max_entries": FILE_METADATA_CACHE_MAX_ENTRIES,
+    "ttl": FILE_METADATA_CACHE_TTL,
+}
+_FILE_METADATA_CACHE_LOCK = threading.Lock()
+
+# algorithms of which the digest of a file can be verified while it is downloaded
+_DIGEST_ALGORITHMS = hashlib.algorithms_guaranteed - {"shake_128", "shake_256"}
+_HEX_DIGEST = re.compile(r"[0-9a-f]+")
+# ioctl cloning a file on linux, supported by btrfs and xfs among others
+_FICLONE = 0x40049409
+
+
+class ResourceCache:
+    """Content of the responses by request stored in a SQLite database.
+
+    When the total size of the contents exceeds ``max_size`` bytes, the least recently used
+    entries are evicted.
+
+    The database is in WAL mode with a busy timeout so that the processes of a node can share it.
+    It should be stored on a local file system, SQLite locking is unreliable on network file
+    systems.
+
+    Errors of the database are logged and the cache then behaves as if it was empty.
+
+    The contents are cached by identity, the issuer and the subject of the token of the request,
+    so that they are never returned to another user and are kept when the token is refreshed.
+    Only a digest of the identity is stored, never the token.
+
+    Args:
+        path (str|Path): Path of the database file, created if it doesn't exist.
+        max_size (int): Maximum total size of the cached contents in bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = Path(path)
+        self.max_size = max_size
+        self._local = threading.local()
+
+    def _connect(self):
+        """Get the connection of the current thread, connections are not shared between threads."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS resources "
+                "(key TEXT PRIMARY KEY, content BLOB, size INTEGER, accessed REAL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS resources_accessed ON resources (accessed)"
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key, token=None):
+        """Get the content cached for the key and the identity of the token, None if not cached."""
+        key = _get_identity_key(key, token)
+        try:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT content FROM resources WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                "UPDATE resources SET accessed = ? WHERE key = ?", (time.time(), key)
+            )
+        except sqlite3.Error as e:
+            L.warning("Could not read resource cache %s: %s", self.path, e)
+            return None
+        return row[0]
+
+    def put(self, key, content, token=None):
+        """Cache the content for the key and the identity of the token.
+
+        The least recently used entries are evicted if needed.
+        """
+        if len(content) > self.max_size:
+            return
+        key = _get_identity_key(key, token)
+        try:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute(
+                    "INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?)",
+                    (key, content, len(content), time.time()),
+                )
+                self._evict(connection)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            L.warning("Could not write resource cache %s: %s", self.path, e)
+
+    def _evict(self, connection):
+        """Delete the least recently used entries until the cache fits in ``max_size``."""
+        (total,) = connection.execute("SELECT COALESCE(SUM(size), 0) FROM resources").fetchone()
+        if total <= self.max_size:
+            return
+        for key, size in connection.execute(
+            "SELECT key, size FROM resources ORDER BY accessed"
+        ).fetchall():
+            connection.execute("DELETE FROM resources WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_size:
+                break
+
+    def size(self):
+        """Get the total size in bytes of the cached contents."""
+        return self._connect().execute("SELECT COALESCE(SUM(size), 0) FROM resources").fetchone()[0]
+
+    def clear(self):
+        """Delete all the entries."""
+        self._connect().execute("DELETE FROM resources")
+
+
+class RevalidatingCache:
+    """Content of the responses by request kept in memory with their validators.
+
+    When the total size of the contents exceeds ``max_size`` bytes, the least recently used
+    entries are evicted. Only the responses with an ``ETag`` or ``Last-Modified`` header are kept.
+
+    The outcome of the requests is counted in ``stats``:
+
+    * ``hit``: the cached content was still valid, the server answered 304 Not Modified.
+    * ``revalidate``: the cached content was stale and was replaced by the new one.
+    * ``miss``: no content was cached for the request.
+
+    Args:
+        max_size (int): Maximum total size of the cached contents in bytes.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.stats = {"hit": 0, "revalidate": 0, "miss": 0}
+        self._entries = OrderedDict()  # key -> (content, validation headers)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get_validation_headers(self, key):
+        """Get the headers making the request for the key conditional, empty if not cached."""
+        with self._lock:
+            entry = self._entries.get(key)
+        return dict(entry[1]) if entry is not None else {}
+
+    def get_content(self, key, response):
+        """Get the content of the response to the request for the key.
+
+        The content is the cached one if the response is 304 Not Modified, otherwise the content
+        of the response, which is cached if it has validators.
+
+        Returns:
+            The content, None if the response is 304 Not Modified but the cached content was
+            evicted since the request was sent. The request must then be sent again without the
+            validation headers.
+
+        Raises:
+            httpx.HTTPStatusError: if the response is an error.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if response.status_code == 304:
+                if entry is None:
+                    return None
+                self._entries.move_to_end(key)
+                self.stats["hit"] += 1
+                return entry[0]
+
+        response.raise_for_status()
+        content = response.content
+        validation_headers = {}
+        if "etag" in response.headers:
+            validation_headers["if-none-match"] = response.headers["etag"]
+        if "last-modified" in response.headers:
+            validation_headers["if-modified-since"] = response.headers["last-modified"]
+
+        with self._lock:
+            self.stats["revalidate" if entry is not None else "miss"] += 1
+            self._remove(key)
+            if validation_headers and len(content) <= self.max_size:
+                self._entries[key] = (content, validation_headers)
+                self._size += len(content)
+                while self._size > self.max_size:
+                    self._remove(next(iter(self._entries)))
+        return content
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    def size(self):
+        """Get the total size in bytes of the cached contents."""
+        return self._size
+
+    def clear(self):
+        """Delete all the entries and reset the stats."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.stats = dict.fromkeys(self.stats, 0)
+
+
+class DistributionCache:
+    """Downloaded files stored by digest in a directory shared by processes.
+
+    Each file is stored once as ``<path>/files/<algorithm>/<digest>/<file name>``, and is
+    materialized where it is requested as a reflink (copy on write clone) if the file system
+    supports it, otherwise as a hardlink, or as a copy if the directory is on another file system.
+    The cached files are read only, and so are their hardlinks, which must not be modified.
+
+    A file is downloaded under a lock of its digest: the processes requesting a file being
+    downloaded wait for it and then use the cached file. Interrupted downloads are resumed by the
+    next process requesting the file.
+
+    When the total size of the files exceeds ``max_size`` bytes, the least recently used files
+    are evicted, except the ones being used by another process.
+
+    The locks are ``flock`` locks, the directory must be on a file system supporting them between
+    all the processes sharing it, such as a local file system or GPFS.
+
+    Args:
+        path (str|Path): Path of the directory, created if it doesn't exist.
+        max_size (int): Maximum total size of the cached files in bytes.
+    """
+
+    def __init__(self, path, max_size):
+        self.path = Path(path)
+        self.max_size = max_size
+
+    @staticmethod
+    def get_key(digest):
+        """Get the key of the file with the digest, None if it can't be cached.
+
+        Args:
+            digest (dict): Digest of the file, with ``algorithm`` and ``value`` keys as in
+                ``DataDownload.digest``.
+        """
+        if not digest or not digest.get("value"):
+            return None
+        algorithm = digest.get("algorithm", "SHA-256").lower().replace("-", "")
+        value = digest["value"].lower()
+        if algorithm not in _DIGEST_ALGORITHMS or not _HEX_DIGEST.fullmatch(value):
+            return None
+        return f"{algorithm}/{value}"
+
+    @contextmanager
+    def _lock(self, name, blocking=True):
+        """Hold the lock of the name between the processes, yield False if it is not acquired."""
+        lock_path = self.path / "locks" / f"{name.replace('/', '-')}.lock"
+        lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(lock_path, "ab") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _get(self, key):
+        """Get the path of the cached file, None if it is not cached."""
+        directory = self.path / "files" / key
+        try:
+            (name,) = os.listdir(directory)
+        except (FileNotFoundError, ValueError):
+            return None
+        # the modification time of the directory is the last access time of the file
+        os.utime(directory)
+        return directory / name
+
+    def _put(self, key, download):
+        """Download the file in a temporary directory and move it to the cache."""
+        tmp_directory = self.path / "tmp" / key.replace("/", "-")
+        tmp_directory.mkdir(parents=True, exist_ok=True)
+        downloaded = Path(download(str(tmp_directory)))
+        for name in os.listdir(tmp_directory):
+            if name != downloaded.name:
+                # leftover of a download interrupted with another file name
+                os.remove(tmp_directory / name)
+        os.chmod(downloaded, 0o444)
+        directory = self.path / "files" / key
+        directory.parent.mkdir(parents=True, exist_ok=True)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.rename(tmp_directory, directory)
+        return directory / downloaded.name
+
+    @contextmanager
+    def _fetch(self, digest, download):
+        """Hold the lock of the file with the digest and yield its path in the cache."""
+        key = self.get_key(digest)
+        if key is None:
+            raise ValueError(f"File with digest {digest} can't be cached")
+        with self._lock(key):
+            cached = self._get(key)
+            downloaded = cached is None
+            if downloaded:
+                L.debug("Distribution cache miss for %s", key)
+                cached = self._put(key, download)
+            yield cached
+        if downloaded:
+            self.evict()
+
+    def materialize(self, digest, path, download, file_name=None):
+        """Get the file with the digest in the directory ``path``.
+
+        Args:
+            digest (dict): Digest of the file, with ``algorithm`` and ``value`` keys.
+            path (str): Path of the directory where to materialize the file.
+            download (callable): Function downloading the file in the directory given as
+                argument if it is not cached, verifying its digest and returning its path.
+            file_name (str): Name of the materialized file, the name of the downloaded file by
+                default.
+
+        Returns:
+            str: Path of the materialized file.
+        """
+        with self._fetch(digest, download) as cached:
+            file_name = file_name or cached.name
+            _link(cached, os.path.join(path, file_name))
+        return os.path.join(os.path.realpath(path), file_name)
+
+    def open(self, digest, download):
+        """Open the file with the digest for reading, downloaded first if it is not cached.
+
+        Args:
+            digest (dict): Digest of the file, with ``algorithm`` and ``value`` keys.
+            download (callable): Function downloading the file in the directory given as
+                argument if it is not cached, verifying its digest and returning its path.
+        """
+        with self._fetch(digest, download) as cached:
+            # the file stays readable if it is evicted once open
+            return open(cached, "rb")  # pylint: disable=consider-using-with
+
+    def evict(self):
+        """Delete the least recently used files until the cache fits in ``max_size``."""
+        with self._lock("evict", blocking=False) as locked:
+            if not locked:
+                # another process is evicting
+                return
+            entries = []
+            for directory in (self.path / "files").glob("*/*"):
+                try:
+                    accessed = directory.stat().st_mtime
+                    size = sum(f.stat().st_size for f in directory.iterdir())
+                except FileNotFoundError:
+                    continue
+                entries.append((accessed, size, directory))
+            total = sum(size for _, size, _ in entries)
+            for _, size, directory in sorted(entries):
+                if total <= self.max_size:
+                    break
+                with self._lock(f"{directory.parent.name}/{directory.name}", False) as unused:
+                    if unused:
+                        shutil.rmtree(directory, ignore_errors=True)
+                        total -= size
+
+    def size(self):
+        """Get the total size in bytes of the cached files."""
+        return sum(f.stat().st_size for f in (self.path / "files").glob("*/*/*"))
+
+    def clear(self):
+        """Delete all the files."""
+        shutil.rmtree(self.path / "files", ignore_errors=True)
+
+
+class SingleFlight:
+    """Share the result of a call between the concurrent calls with the same key.
+
+    The first caller of a key makes the call, the callers arriving while it runs wait for its
+    result or exception instead of making the same call.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def call(self, key, func, *args):
+        """Call ``func(*args)`` or wait for the result of the running call with the same key."""
+        with self._lock:
+            future = self._calls.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = self._calls[key] = Future()
+
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = func(*args)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class FileMetadataCache:
+    """Metadata of the files by request kept in memory.
+
+    The metadata of the files pinned with ``tag`` or ``rev`` is kept until it is evicted, the
+    metadata of the latest revision of a file expires after ``ttl`` seconds, so that the updates
+    of the file are seen, and is not cached if ``ttl`` is 0. When more than ``max_entries`` are
+    cached, the least recently used entries are evicted. The concurrent requests of the same
+    metadata share one request.
+
+    The metadata is cached by request and token, so that it is never returned to a caller with
+    another identity. The metadata of the latest revision of a file updated by this process is
+    deleted with :meth:`invalidate`.
+
+    The outcome of the requests is counted in ``stats``:
+
+    * ``hit``: the metadata was cached.
+    * ``miss``: the metadata was not cached or expired, it was requested.
+
+    Args:
+        max_entries (int): Maximum number of cached metadata.
+        ttl (float): Time in seconds after which the metadata of the latest revisions expires.
+    """
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {"hit": 0, "miss": 0}
+        # (request key, token) -> (metadata, expiry time or None if pinned)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = SingleFlight()
+        self._generation = 0  # incremented by each invalidation
+
+    def get(self, key, load, token=None):
+        """Get the metadata of the request for the key, requested with ``load()`` if not cached.
+
+        Args:
+            key (str): Key of the request, see :func:`get_request_key`.
+            load (callable): Function requesting the metadata.
+            token (str): Token of the request.
+
+        Returns:
+            A copy of the metadata, which can be modified by the caller.
+        """
+        key = (key, token)
+        metadata = self._get(key)
+        if metadata is None:
+            metadata = self._loads.call(key, self._load, key, load)
+        return copy.deepcopy(metadata)
+
+    def _get(self, key):
+        """Get the cached metadata if it has not expired, None otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (entry[1] is not None and entry[1] <= time.monotonic()):
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hit"] += 1
+            return entry[0]
+
+    def _load(self, key, load):
+        # the metadata may have been cached by a call which ended since the first lookup
+        metadata = self._get(key)
+        if metadata is not None:
+            return metadata
+        generation = self._generation
+        metadata = load()
+        expiry = None if get_pinned_key(key[0]) is not None else time.monotonic() + self.ttl
+        with self._lock:
+            self.stats["miss"] += 1
+            self._entries.pop(key, None)
+            # the file may have been updated while its metadata was loaded
+            stale = expiry is not None and generation != self._generation
+            if not stale and (expiry is None or self.ttl > 0):
+                self._entries[key] = (metadata, expiry)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return metadata
+
+    def invalidate(self, url):
+        """Delete the metadata of the latest revision of the file for all the tokens.
+
+        The metadata pinned with ``tag`` or ``rev`` is kept.
+
+        Args:
+            url (str): Nexus url of the file.
+        """
+        key = get_request_key(url)
+        with self._lock:
+            self._generation += 1
+            for entry_key in [k for k in self._entries if k[0] == key]:
+                del self._entries[entry_key]
+
+    def size(self):
+        """Get the number of cached metadata."""
+        return len(self._entries)
+
+    def clear(self):
+        """Delete all the entries and reset the stats."""
+        with self._lock:
+            self._entries.clear()
+            self.stats = dict.fromkeys(self.stats, 0)
+
+
+def _reflink(source, target):
+    """Clone the source file to the target, False if the file system doesn't support it."""
+    if sys.platform != "linux":
+        return False
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+            return True
+        except OSError:
+            pass
+    os.remove(target)
+    return False
+
+
+def _link(source, target):
+    """Create or replace the target with the content of the source, sharing its storage."""
+    tmp_target = f"{target}.{os.getpid()}-{threading.get_ident()}.tmp"
+    try:
+        if not _reflink(source, tmp_target):
+            try:
+                os.link(source, tmp_target)
+            except OSError:
+                shutil.copyfile(source, tmp_target)
+        os.replace(tmp_target, target)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_target)
+        raise
+
+
+def get_request_key(url, params=None):
+    """Get the cache key of a request.
+
+    Args:
+        url (str): Url of the request, it may contain a query.
+        params (dict): Query params of the request.
+
+    Returns:
+        The url of the request with its non empty query params sorted.
+    """
+    url = httpx.URL(url)
+    if params:
+        url = url.copy_merge_params({k: v for k, v in params.items() if v is not None})
+    query = sorted((k, v) for k, v in url.params.multi_items() if v)
+    if not query:
+        return str(url.copy_with(query=None))
+    return f"{url.copy_with(query=None)}?{urlencode(query)}"
+
+
+def _get_identity_key(key, token):
+    """Get the key of the request for the identity of the token, issuer and subject if known."""
+    if token is None:
+        identity = ""
+    else:
+        try:
+            info = get_token_info(token)
+            identity = f"{info['iss']} {info['sub']}"
+        except (jwt.DecodeError, KeyError):
+            identity = token
+    return f"{hashlib.sha256(identity.encode()).hexdigest()} {key}"
+
+
+def get_pinned_key(url, params=None):
+    """Get the cache key of a request pinned to a revision or a tag.
+
+    Returns:
+        The key of the request as returned by :func:`get_request_key`, None if the request is not
+        pinned.
+    """
+    key = get_request_key(url, params)
+    query = httpx.URL(key).params
+    if _PINNING_PARAMS.isdisjoint(query):
+        return None
+    return key
+
+
+def get_resource_cache():
+    """Get the cache of the pinned resources, None if it is disabled.
+
+    The cache of the active :class:`entity_management.state.NexusSession`, if it has one, is
+    returned instead.
+    """
+    global _RESOURCE_CACHE  # pylint: disable=global-statement
+    session = get_session()
+    if session is not None and session.resource_cache is not None:
+        return session.resource_cache
+    if not _RESOURCE_CACHE_OPTIONS["enabled"]:
+        return None
+    if _RESOURCE_CACHE is None:
+        with _RESOURCE_CACHE_LOCK:
+            if _RESOURCE_CACHE is None:
+                _RESOURCE_CACHE = ResourceCache(
+                    _RESOURCE_CACHE_OPTIONS["path"], _RESOURCE_CACHE_OPTIONS["max_size"]
+                )
+    return _RESOURCE_CACHE
+
+
+def configure_resource_cache(*, enabled=None, path=None, max_size=None):
+    """Configure the cache of the pinned resources.
+
+    Args:
+        enabled (bool): Enable or disable the cache.
+        path (str): Path of the database file.
+        max_size (int): Maximum total size of the cached contents in bytes.
+    """
+    global _RESOURCE_CACHE  # pylint: disable=global-statement
+    options = {"enabled": enabled, "path": path, "max_size": max_size}
+    with _RESOURCE_CACHE_LOCK:
+        _RESOURCE_CACHE_OPTIONS.update({k: v for k, v in options.items() if v is not None})
+        _RESOURCE_CACHE = None
+
+
+def get_revalidating_cache():
+    """Get the cache of the unpinned resources, None if it is disabled.
+
+    The cache of the active :class:`entity_management.state.NexusSession`, if it has one, is
+    returned instead.
+    """
+    global _REVALIDATING_CACHE  # pylint: disable=global-statement
+    session = get_session()
+    if session is not None and session.revalidating_cache is not None:
+        return session.revalidating_cache
+    if not _REVALIDATING_CACHE_OPTIONS["enabled"]:
+        return None
+    if _REVALIDATING_CACHE is None:
+        with _REVALIDATING_CACHE_LOCK:
+            if _REVALIDATING_CACHE is None:
+                _REVALIDATING_CACHE = RevalidatingCache(_REVALIDATING_CACHE_OPTIONS["max_size"])
+    return _REVALIDATING_CACHE
+
+
+def configure_revalidating_cache(*, enabled=None, max_size=None):
+    """Configure the cache of the unpinned resources.
+
+    Args:
+        enabled (bool): Enable or disable the cache.
+        max_size (int): Maximum total size of the cached contents in bytes.
+    """
+    global _REVALIDATING_CACHE  # pylint: disable=global-statement
+    options = {"enabled": enabled, "max_size": max_size}
+    with _REVALIDATING_CACHE_LOCK:
+        _REVALIDATING_CACHE_OPTIONS.update({k: v for k, v in options.items() if v is not None})
+        _REVALIDATING_CACHE = None
+
+
+def get_distribution_cache():
+    """Get the cache of the downloaded files, None if it is disabled.
+
+    The cache of the active :class:`entity_management.state.NexusSession`, if it has one, is
+    returned instead.
+    """
+    global _DISTRIBUTION_CACHE  # pylint: disable=global-statement
+    session = get_session()
+    if session is not None and session.distribution_cache is not None:
+        return session.distribution_cache
+    if not _DISTRIBUTION_CACHE_OPTIONS["enabled"]:
+        return None
+    if _DISTRIBUTION_CACHE is None:
+        with _DISTRIBUTION_CACHE_LOCK:
+            if _DISTRIBUTION_CACHE is None:
+                _DISTRIBUTION_CACHE = DistributionCache(
+                    _DISTRIBUTION_CACHE_OPTIONS["path"], _DISTRIBUTION_CACHE_OPTIONS["max_size"]
+                )
+    return _DISTRIBUTION_CACHE
+
+
+def configure_distribution_cache(*, enabled=None, path=None, max_size=None):
+    """Configure the cache of the downloaded files.
+
+    Args:
+        enabled (bool): Enable or disable the cache.
+        path (str): Path of the directory of the cache.
+        max_size (int): Maximum total size of the cached files in bytes.
+    """
+    global _DISTRIBUTION_CACHE  # pylint: disable=global-statement
+    options = {"enabled": enabled, "path": path, "max_size": max_size}
+    with _DISTRIBUTION_CACHE_LOCK:
+        _DISTRIBUTION_CACHE_OPTIONS.update({k: v for k, v in options.items() if v is not None})
+        _DISTRIBUTION_CACHE = None
+
+
+def get_file_metadata_cache():
+    """Get the cache of the metadata of the files, None if it is disabled.
+
+    The cache of the active :class:`entity_management.state.NexusSession`, if it has one, is
+    returned instead.
+    """
+    global _FILE_METADATA_CACHE  # pylint: disable=global-statement
+    session = get_session()
+    if session is not None and session.file_metadata_cache is not None:
+        return session.file_metadata_cache
+    if not _FILE_METADATA_CACHE_OPTIONS["enabled"]:
+        return None
+    if _FILE_METADATA_CACHE is None:
+        with _FILE_METADATA_CACHE_LOCK:
+            if _FILE_METADATA_CACHE is None:
+                _FILE_METADATA_CACHE = FileMetadataCache(
+                    _FILE_METADATA_CACHE_OPTIONS["max_entries"], _FILE_METADATA_CACHE_OPTIONS["ttl"]
+                )
+    return _FILE_METADATA_CACHE
+
+
+def configure_file_metadata_cache(*, enabled=None, max_entries=None, ttl=None):
+    """Configure the cache of the metadata of the files.
+
+    Args:
+        enabled (bool): Enable or disable the cache.
+        max_entries (int): Maximum number of cached metadata.
+        ttl (float): Time in seconds after which the metadata of the latest revisions expires, 0
+            to cache only the metadata pinned with a tag or a revision.
+    """
+    global _FILE_METADATA_CACHE  # pylint: disable=global-statement
+    options = {"enabled": enabled, "max_entries": max_entries, "ttl": ttl}
+    with _FILE_METADATA_CACHE_LOCK:
+        _FILE_METADATA_CACHE_OPTIONS.update({k: v for k, v in options.items() if v is not None})
+        _FILE_METADATA_CACHE = None
@@ -133,10 +133,11 @@ def download_and_get_ids_from_distribution(entity, path, mapping):
         if url:
             filename = _get_distribution_filename(entity, d_item)
             print(f"    {filename}")
-            download_file(url, path, file_name=filename)
+            digest = d_item.get("digest")
+            download_file(url, path, file_name=filename, digest=digest)
             mapping[url] = filename
             if d_item.get("encodingFormat", "") == "application/json":
-                content = file_as_dict(url)
+                content = file_as_dict(url, digest=digest)
                 ids.update(_get_ids_from_dict(content))
 
     return ids
@@ -9,24 +9,29 @@ Provenance entities
    :parts: 1
 """
 
+import logging
+import mmap
 import os
 import uuid
 from datetime import datetime
-from io import IOBase, StringIO
+from io import BytesIO, IOBase
 from pathlib import Path
 from typing import List
 
+import httpx
 from attr.validators import in_
 
-from entity_management import nexus
+from entity_management import jsonstream, nexus, transfer
 
 # Subject used to be in this module. It is imported for backward compatibility
 from entity_management.base import Subject  # noqa pylint: disable=unused-import
 from entity_management.base import BlankNode, Identifiable, _NexusBySparqlIterator, attributes
-from entity_management.settings import WORKFLOW
+from entity_management.settings import LOCAL_FILES, WORKFLOW
 from entity_management.typing import MaybeList
 from entity_management.util import AttrOf, NotInstantiated, unquote_uri_path
 
+L = logging.getLogger(__name__)
+
 
 @attributes(
     {
@@ -37,6 +42,7 @@ from entity_management.util import AttrOf, NotInstantiated, unquote_uri_path
         "contentSize": AttrOf(dict, default=None),
         "digest": AttrOf(dict, default=None),
         "encodingFormat": AttrOf(str, default=None),
+        "atLocation": AttrOf(dict, default=None),
     }
 )
 class DataDownload(BlankNode):
@@ -51,6 +57,7 @@ class DataDownload(BlankNode):
         contentSize (int): If known in advance size of the resource.
         digest (int): Hash/Checksum of the resource.
         encodingFormat (str): Type of the resource accessible by the contentUrl.
+        atLocation (dict): Location of the file on its storage, with its uri in ``location``.
 
     either `downloadURL` for files or `accessURL` for folders must be provided"""
 
@@ -61,6 +68,19 @@ class DataDownload(BlankNode):
         if not self.contentUrl and not self.url:  # pylint: disable=no-member
             raise ValueError('"contentUrl" or "url" must be provided!')
 
+    @classmethod
+    def _from_file_metadata(cls, resp):
+        """Create DataDownload object from the nexus metadata of a file."""
+        data = cls(
+            name=resp["_filename"],
+            contentSize={"unitCode": "bytes", "value": resp["_bytes"]},
+            digest={"algorithm": resp["_digest"]["_algorithm"], "value": resp["_digest"]["_value"]},
+            encodingFormat=resp["_mediaType"],
+            contentUrl=resp["_self"],
+        )
+        data._force_attr("_id", resp["@id"])
+        return data
+
     @classmethod
     def from_file(
         cls,
@@ -118,15 +138,57 @@ class DataDownload(BlankNode):
                 proj=proj,
                 token=use_auth,
             )
-        data = DataDownload(
-            name=resp["_filename"],
-            contentSize={"unitCode": "bytes", "value": resp["_bytes"]},
-            digest={"algorithm": resp["_digest"]["_algorithm"], "value": resp["_digest"]["_value"]},
-            encodingFormat=resp["_mediaType"],
-            contentUrl=resp["_self"],
+        return cls._from_file_metadata(resp)
+
+    @classmethod
+    def from_files(
+        cls,
+        files,
+        storage_id=None,
+        content_type="application/octet-stream",
+        skip_existing=False,
+        max_concurrency=None,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+    ):
+        """Create DataDownload objects from many files uploaded concurrently.
+
+        The files are streamed, and their SHA-256 digest is computed while they are uploaded,
+        see :func:`entity_management.nexus.upload_files`.
+
+        Args:
+            files (iterable): Paths of the files, or tuples of the name, the content and
+                optionally the content type of the files. The content is the path of a file, a
+                binary file like object, or an iterable of chunks of bytes.
+            storage_id (str): Optional identifier of the storage backend where the files will
+                be stored. If not provided, the project's default storage is used.
+            content_type (str): Content type of the files without one. Default value:
+                `application/octet-stream`.
+            skip_existing (bool): Do not upload the files identical to a file of the project, the
+                DataDownload of the existing file is returned instead.
+            max_concurrency (int): Maximum number of files uploaded at the same time.
+            use_auth (str): Optional OAuth token.
+
+        Returns:
+            list: DataDownload objects in the order of ``files``.
+        """
+        files = [
+            (Path(file).name, file) if isinstance(file, (str, Path)) else file for file in files
+        ]
+        resps = nexus.upload_files(
+            files,
+            content_type,
+            storage_id=storage_id,
+            skip_existing=skip_existing,
+            max_concurrency=max_concurrency,
+            base=base,
+            org=org,
+            proj=proj,
+            token=use_auth,
         )
-        data._force_attr("_id", resp["@id"])
-        return data
+        return [cls._from_file_metadata(resp) for resp in resps]
 
     @classmethod
     def link_file(
@@ -166,15 +228,56 @@ class DataDownload(BlankNode):
             proj=proj,
             token=use_auth,
         )
-        data = DataDownload(
-            name=resp["_filename"],
-            contentSize={"unitCode": "bytes", "value": resp["_bytes"]},
-            digest={"algorithm": resp["_digest"]["_algorithm"], "value": resp["_digest"]["_value"]},
-            encodingFormat=resp["_mediaType"],
-            contentUrl=resp["_self"],
+        return cls._from_file_metadata(resp)
+
+    @classmethod
+    def link_files(
+        cls,
+        files,
+        storage_id=None,
+        content_type=None,
+        max_concurrency=None,
+        journal=None,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+    ):
+        """Move many files to nexus managed folder in gpfs project concurrently.
+
+        The files are linked with retries of the transient errors, see
+        :func:`entity_management.nexus.link_files`.
+
+        Args:
+            files (iterable): Paths of the files, or tuples of the name, the path and optionally
+                the content type of the files.
+            storage_id (str): Optional identifier of the storage backend where the files will
+                be stored. If not provided, the project's default storage is used.
+            content_type (str): Content type of the files without one.
+            max_concurrency (int): Maximum number of files linked at the same time.
+            journal (str): Optional path of a journal of the linked files, from which an
+                interrupted call is resumed when it is repeated.
+            use_auth (str): Optional OAuth token.
+
+        Returns:
+            list: DataDownload objects in the order of ``files``.
+        """
+        files = [
+            (os.path.basename(file), str(file)) if isinstance(file, (str, Path)) else file
+            for file in files
+        ]
+        resps = nexus.link_files(
+            files,
+            content_type,
+            storage_id=storage_id,
+            max_concurrency=max_concurrency,
+            journal=journal,
+            base=base,
+            org=org,
+            proj=proj,
+            token=use_auth,
         )
-        data._force_attr("_id", resp["@id"])
-        return data
+        return [cls._from_file_metadata(resp) for resp in resps]
 
     @classmethod
     def from_json_str(
@@ -190,7 +293,7 @@ class DataDownload(BlankNode):
                 a uuid will be generated.
             use_auth (str): Optional OAuth token.
         """
-        buff = StringIO(json_str)
+        buff = BytesIO(json_str.encode("utf-8"))
         file_name = name or str(uuid.uuid4())
         resp = nexus.upload_file(
             file_name,
@@ -220,13 +323,72 @@ class DataDownload(BlankNode):
             file_name (str): Optional file name.  If not provided, file name will be taken from
                 the name stored in Nexus.
             use_auth (str): Optional OAuth token.
+
+        Raises:
+            DigestMismatchError: if the downloaded file differs from the ``digest``.
         """
         # pylint: disable=no-member
         assert self.contentUrl is not None, "No contentUrl!"
 
         if path is None:
             path = os.getcwd()
-        return nexus.download_file(self.contentUrl, path, file_name, token=use_auth)
+        return nexus.download_file(
+            self.contentUrl, path, file_name, token=use_auth, digest=self.digest
+        )
+
+    @classmethod
+    def download_all(
+        cls,
+        items,
+        path=None,
+        *,
+        max_concurrency=None,
+        max_per_host=None,
+        progress=None,
+        use_auth=None,
+    ):
+        """Download the ``contentUrl`` of many distributions concurrently.
+
+        See :func:`entity_management.nexus.download_files`.
+
+        Args:
+            items (iterable): DataDownload objects, or entities of which the distributions are
+                downloaded, such as the entities listed by ``list_by_schema``.
+            path (str): Optional path where to save the files. If not provided current folder will
+                be used.
+            max_concurrency (int): Maximum number of files downloaded at the same time.
+            max_per_host (int): Maximum number of files downloaded at the same time from one host.
+            progress (callable): Function called with the number of files downloaded and the
+                total number of files to download each time a file is downloaded.
+            use_auth (str): Optional OAuth token.
+
+        Returns:
+            dict: Path of the downloaded file by ``contentUrl``.
+
+        Raises:
+            DigestMismatchError: if a downloaded file differs from its ``digest``.
+        """
+        files = []
+        for item in items:
+            distributions = item if isinstance(item, cls) else getattr(item, "distribution", None)
+            if not isinstance(distributions, list):
+                distributions = [distributions]
+            files.extend(
+                (distribution.contentUrl, distribution.digest)
+                for distribution in distributions
+                if distribution is not None and distribution.contentUrl is not None
+            )
+
+        if path is None:
+            path = os.getcwd()
+        return nexus.download_files(
+            files,
+            path,
+            max_concurrency=max_concurrency,
+            max_per_host=max_per_host,
+            progress=progress,
+            token=use_auth,
+        )
 
     def get_location(self, use_auth=None):
         """Get file location when applicable.
@@ -259,11 +421,113 @@ class DataDownload(BlankNode):
         assert self.url.startswith("file://"), f"URL '{self.url}' is not a file URI."
         return unquote_uri_path(self.url)
 
+    def _get_local_path(self, use_auth=None):
+        """Get the path of ``contentUrl`` if it is readable from the local file system.
+
+        The files of the gpfs storages have a ``file://`` location, they are read locally unless
+        the ``NEXUS_LOCAL_FILES`` environment variable is false. The location of ``atLocation`` is
+        used if it is known, otherwise it is requested with the metadata of the file. If it can't
+        be requested, the file is downloaded.
+        """
+        # pylint: disable=no-member
+        if not LOCAL_FILES:
+            return None
+        location = (self.atLocation or {}).get("location")
+        if location is None:
+            try:
+                location = nexus.get_file_location(self.contentUrl, token=use_auth)
+            except httpx.HTTPError as error:
+                L.warning("Location of %s not found, it is downloaded: %r", self.contentUrl, error)
+                return None
+        size = (self.contentSize or {}).get("value")
+        return transfer.get_local_path(location, size)
+
+    def open(self, mode="rb", use_auth=None):
+        """Open ``contentUrl`` for reading.
+
+        The file is read from the local file system if it is on a gpfs storage mounted locally,
+        otherwise only the parts of the file which are read are requested, by range requests
+        cached by blocks and read ahead, see :class:`entity_management.transfer.RangeReader`.
+        Reading the header of a large NRRD or HDF5 file transfers a few blocks.
+
+        Args:
+            mode (str): Only ``"rb"`` is supported.
+            use_auth (str): Optional OAuth token.
+
+        Returns:
+            Seekable binary file object.
+        """
+        # pylint: disable=no-member
+        assert self.contentUrl is not None, "No contentUrl!"
+        if mode != "rb":
+            raise ValueError(f"Unsupported mode {mode!r}, only 'rb' is supported")
+
+        path = self._get_local_path(use_auth)
+        if path is not None:
+            return open(path, "rb")  # pylint: disable=consider-using-with
+        return nexus.open_file(self.contentUrl, token=use_auth, seekable=True)
+
+    def read(self, use_auth=None):
+        """Read the content of ``contentUrl``.
+
+        The file is read from the local file system if it is on a gpfs storage mounted locally,
+        otherwise it is downloaded.
+
+        Args:
+            use_auth (str): Optional OAuth token.
+
+        Returns:
+            The content as bytes, or as a read only ``mmap.mmap`` for the local files larger than
+            the ``NEXUS_MMAP_THRESHOLD`` environment variable or 64 MiB. The memory map is bytes
+            like, its pages are read when they are accessed and shared with the other processes
+            reading the file.
+        """
+        # pylint: disable=no-member
+        assert self.contentUrl is not None, "No contentUrl!"
+
+        path = self._get_local_path(use_auth)
+        if path is not None:
+            return transfer.read_local_file(path)
+        with nexus.open_file(self.contentUrl, token=use_auth) as f:
+            return f.read()
+
     def as_dict(self, use_auth=None):
         """Get ``contentUrl`` as dict.
 
+        The file is read from the local file system if it is on a gpfs storage mounted locally.
+
+        Args:
+            use_auth (str): Optional OAuth token.
+        """
+        # pylint: disable=no-member
+        assert self.contentUrl is not None, "No contentUrl!"
+        assert self.encodingFormat == "application/json", (
+            "Wrong encodingFormat, " "expecting application/json!"
+        )
+
+        path = self._get_local_path(use_auth)
+        if path is not None:
+            content = transfer.read_local_file(path)
+            if isinstance(content, mmap.mmap):
+                with content, memoryview(content) as view:
+                    return jsonstream.loads(view)
+            return jsonstream.loads(content)
+        return nexus.file_as_dict(self.contentUrl, token=use_auth, digest=self.digest)
+
+    def iter_items(self, pointer="", use_auth=None):
+        """Decode the items of the json ``contentUrl`` while it is downloaded.
+
+        Unlike :meth:`as_dict`, only one item is kept in memory at a time, which is suited to the
+        large distributions.
+
         Args:
+            pointer (str): Json pointer of the object or array of which the items are decoded, the
+                root of the document by default.
             use_auth (str): Optional OAuth token.
+
+        Yields:
+            Tuples of the key and the decoded value of each member if the value at ``pointer`` is
+            an object, the decoded elements if it is an array.
         """
         # pylint: disable=no-member
         assert self.contentUrl is not None, "No contentUrl!"
@@ -271,7 +535,7 @@ class DataDownload(BlankNode):
             "Wrong encodingFormat, " "expecting application/json!"
         )
 
-        return nexus.file_as_dict(self.contentUrl, token=use_auth)
+        return nexus.iter_file_items(self.contentUrl, pointer, token=use_auth)
 
     def get_id(self):
         """Retrieve _id property."""
@@ -384,9 +648,7 @@ class Activity(Identifiable):
         Returns:
             New instance of the same class with revision updated.
         """
-        if activity is not None and self.wasInformedBy is None:  # pylint: disable=no-member
-            assert isinstance(activity, Activity)
-            self = self.evolve(wasInformedBy=activity)  # pylint: disable=self-cls-assignment
+        self = self._with_informed_by(activity)  # pylint: disable=self-cls-assignment
 
         if self.wasInfluencedBy is None and WORKFLOW is not None:  # pylint: disable=no-member
             # in case running in the context of workflow execution activity
@@ -405,6 +667,57 @@ class Activity(Identifiable):
             include_rev=include_rev,
         )
 
+    async def apublish(
+        self,
+        *,
+        resource_id=None,
+        sync_index=False,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+        include_rev=False,
+        activity=None,
+    ):
+        """Create or update activity resource in nexus without blocking the event loop.
+
+        Awaitable counterpart of :meth:`publish`.
+
+        Args:
+            resource_id (str): Resource identifier.
+            include_rev (bool): Whether to include _rev in the linked entities or not.
+            activity (Activity): Optional activity which provided information to the current
+                activity.
+
+        Returns:
+            New instance of the same class with revision updated.
+        """
+        self = self._with_informed_by(activity)  # pylint: disable=self-cls-assignment
+
+        if self.wasInfluencedBy is None and WORKFLOW is not None:  # pylint: disable=no-member
+            # in case running in the context of workflow execution activity
+            workflow = await WorkflowExecution.afrom_id(
+                WORKFLOW, base=base, org=org, proj=proj, use_auth=use_auth
+            )
+            self = self.evolve(wasInfluencedBy=workflow)  # pylint: disable=self-cls-assignment
+
+        return await super().apublish(
+            resource_id=resource_id,
+            sync_index=sync_index,
+            base=base,
+            org=org,
+            proj=proj,
+            use_auth=use_auth,
+            include_rev=include_rev,
+        )
+
+    def _with_informed_by(self, activity):
+        """Get activity informed by the provided activity if not already informed by another one."""
+        if activity is not None and self.wasInformedBy is None:  # pylint: disable=no-member
+            assert isinstance(activity, Activity)
+            return self.evolve(wasInformedBy=activity)
+        return self
+
 
 @attributes(
     {
@@ -527,21 +840,59 @@ class Entity(Identifiable):
                 WORKFLOW, base=base, org=org, proj=proj, use_auth=use_auth
             )
 
-        if activity is not None:
-            assert isinstance(activity, Activity)
-            self = self.evolve(wasGeneratedBy=activity)  # pylint: disable=self-cls-assignment
+        # pylint: disable=self-cls-assignment
+        self = self._with_provenance(activity, was_attributed_to)
 
-        if was_attributed_to is not None:
-            # pylint: disable=self-cls-assignment
-            self = self.evolve(
-                wasAttributedTo=(
-                    self.wasAttributedTo + [was_attributed_to]
-                    if self.wasAttributedTo
-                    else [was_attributed_to]
-                )
+        return super().publish(
+            resource_id=resource_id,
+            sync_index=sync_index,
+            base=base,
+            org=org,
+            proj=proj,
+            use_auth=use_auth,
+            include_rev=include_rev,
+        )
+
+    async def apublish(
+        self,
+        *,
+        resource_id=None,
+        sync_index=False,
+        base=None,
+        org=None,
+        proj=None,
+        use_auth=None,
+        activity=None,
+        was_attributed_to=None,
+        include_rev=False,
+    ):
+        """Create or update resource in nexus without blocking the event loop.
+
+        Awaitable counterpart of :meth:`publish`.
+
+        Args:
+            resource_id (str): Resource identifier.
+            activity (Activity): Optionally provide activity which generated this resource.
+            was_attributed_to (Person): Provide person argument in order to add the Person to the
+                set of attribution parameter ``self.wasAttributedTo``.
+            use_auth (str): OAuth token in case access is restricted.
+                Token should be in the format for the authorization header: Bearer VALUE.
+            include_rev (bool): Whether to include _rev in the linked entities or not.
+
+        Returns:
+            New instance of the same class with revision updated.
+        """
+        # pylint: disable=no-member
+        if self.wasGeneratedBy is None and activity is None and WORKFLOW is not None:
+            # in case running in the context of workflow execution activity
+            activity = await WorkflowExecution.afrom_id(
+                WORKFLOW, base=base, org=org, proj=proj, use_auth=use_auth
             )
 
-        return super().publish(
+        # pylint: disable=self-cls-assignment
+        self = self._with_provenance(activity, was_attributed_to)
+
+        return await super().apublish(
             resource_id=resource_id,
             sync_index=sync_index,
             base=base,
@@ -551,6 +902,26 @@ class Entity(Identifiable):
             include_rev=include_rev,
         )
 
+    def _with_provenance(self, activity, was_attributed_to):
+        """Get entity generated by ``activity`` and attributed to ``was_attributed_to``."""
+        # pylint: disable=no-member
+        entity = self
+
+        if activity is not None:
+            assert isinstance(activity, Activity)
+            entity = entity.evolve(wasGeneratedBy=activity)
+
+        if was_attributed_to is not None:
+            entity = entity.evolve(
+                wasAttributedTo=(
+                    entity.wasAttributedTo + [was_attributed_to]
+                    if entity.wasAttributedTo
+                    else [was_attributed_to]
+                )
+            )
+
+        return entity
+
 
 @attributes(
     {
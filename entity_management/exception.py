@@ -17,3 +17,7 @@ class EntityNotInstantiatedError(EntityManagementError):
 
 class SchemaValidationError(EntityManagementError):
     """Schema validation exception class."""
+
+
+class DigestMismatchError(EntityManagementError):
+    """Error related to transferred files differing from their expected digest."""
@@ -0,0 +1,103 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Identity map sharing one instance per resource revision between the loaded entities."""
+
+import contextvars
+from contextlib import contextmanager
+from urllib.parse import parse_qs
+
+from entity_management.util import NotInstantiated
+
+# entities by (id, rev, tag) of the active identity map
+_IDENTITY_MAP = contextvars.ContextVar("identity_map", default=None)
+
+
+@contextmanager
+def identity_map():
+    """Share one instance per resource revision between all the entities loaded in the context.
+
+    Within the context, the references to the same resource ``(id, rev/tag)`` found while
+    deserializing entities, and the entities loaded with ``from_id``, resolve to one shared
+    instance, which is fetched once. References without revision or tag share the instance of
+    the latest revision loaded in the context.
+
+    Nested contexts share the map of the outermost one.
+
+    Example:
+        with identity_map():
+            circuits = DetailedCircuit.from_ids(ids)
+            # the atlas release referenced by all the circuits is fetched only once
+            atlases = {circuit.atlasRelease.name for circuit in circuits}
+
+    Returns:
+        Context manager yielding the dict of the entities by ``(id, rev, tag)``.
+    """
+    entities = _IDENTITY_MAP.get()
+    if entities is not None:
+        yield entities
+        return
+
+    token = _IDENTITY_MAP.set({})
+    try:
+        yield _IDENTITY_MAP.get()
+    finally:
+        _IDENTITY_MAP.reset(token)
+
+
+def get_identity_map():
+    """Get the dict of the entities of the active identity map, None if there is none."""
+    return _IDENTITY_MAP.get()
+
+
+def identity_key(resource_id, rev=NotInstantiated, tag=NotInstantiated):
+    """Get the key of the resource in the identity map.
+
+    The revision or tag can be given as arguments or in the query of the ``resource_id``.
+    """
+    if "?" in resource_id:
+        resource_id, query = resource_id.split("?", 1)
+        params = parse_qs(query)
+        rev = params.get("rev", [rev])[0]
+        tag = params.get("tag", [tag])[0]
+    return (
+        resource_id,
+        None if rev is NotInstantiated else str(rev),
+        None if tag is NotInstantiated else tag,
+    )
+
+
+def register(resource_id, entity):
+    """Register the entity loaded from ``resource_id`` in the active identity map.
+
+    Returns:
+        The entity already registered with this key and filled with the content of ``entity`` if
+        it was lazy, otherwise ``entity``.
+    """
+    entities = _IDENTITY_MAP.get()
+    if entities is None or resource_id is None:
+        return entity
+
+    registered = entities.setdefault(identity_key(resource_id), entity)
+    if registered is entity or not isinstance(registered, type(entity)):
+        return entity
+
+    if is_lazy(registered):
+        registered._fill_from(entity)
+    return registered
+
+
+def get_loaded(resource_id, cls):
+    """Get the loaded entity of ``cls`` registered for ``resource_id`` in the identity map."""
+    entities = _IDENTITY_MAP.get()
+    if entities is None or resource_id is None:
+        return None
+
+    entity = entities.get(identity_key(resource_id))
+    if isinstance(entity, cls) and not is_lazy(entity):
+        return entity
+    return None
+
+
+def is_lazy(entity):
+    """Return True if the entity is a stub which was not instantiated yet."""
+    return "_lazy_meta_" in entity.__dict__
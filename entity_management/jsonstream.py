@@ -0,0 +1,249 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Decoding of json documents, streamed or not.
+
+The documents are decoded with ``orjson`` when it is installed, which is several times faster
+than the standard library, see the ``json`` extra of the package.
+
+Large documents can be decoded item by item from a stream of chunks, so that only one item is
+held in memory at a time. The items are the members of the object or the elements of the array
+at a `JSON pointer <https://datatracker.ietf.org/doc/html/rfc6901>`_ of the document::
+
+    for mtype, etypes in iter_items(response.iter_bytes(), "/hasPart"):
+        ...
+"""
+
+import json
+import re
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_WHITESPACE = b" \t\n\r"
+_STRUCTURE = re.compile(rb'["{}\[\]]')
+_STRING_TAIL = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+_SCALAR_END = re.compile(rb"[ \t\n\r,\]}]")
+
+
+def loads(data):
+    """Decode a json document.
+
+    Args:
+        data (bytes|str|memoryview): Json document.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # not supported by orjson, such as NaN or Infinity
+            pass
+    return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+
+class _Reader:
+    """Reader of the json values of a stream of chunks.
+
+    Only the chunks of the value being read are kept in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = bytearray()
+        self._pos = 0
+
+    def _fill(self, keep_from):
+        """Append the next chunk to the buffer, the bytes before ``keep_from`` are discarded.
+
+        Returns:
+            The number of bytes discarded, None at the end of the stream.
+        """
+        for chunk in self._chunks:
+            if chunk:
+                break
+        else:
+            return None
+        del self._buffer[:keep_from]
+        self._pos -= keep_from
+        self._buffer += chunk
+        return keep_from
+
+    def _error(self, message):
+        return ValueError(f"{message} in json stream")
+
+    def next_char(self, expected):
+        """Consume the next non whitespace character, which must be one of ``expected``."""
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buffer):
+                break
+            if self._fill(self._pos) is None:
+                raise self._error("Unexpected end")
+        char = self._buffer[self._pos]
+        if char not in expected:
+            raise self._error(f"Unexpected character {chr(char)!r}")
+        self._pos += 1
+        return char
+
+    def peek_char(self):
+        """Get the next non whitespace character without consuming it."""
+        char = self.next_char(b'{}[]",:-0123456789tfn')
+        self._pos -= 1
+        return char
+
+    def read_value(self, keep=True):
+        """Consume the next value.
+
+        Args:
+            keep (bool): If False, the value is skipped without keeping it in memory.
+
+        Returns:
+            The raw bytes of the value if ``keep``, otherwise None.
+        """
+        # the value starts at self._pos until it is consumed, the scans return its end
+        first = self.peek_char()
+        if first == ord('"'):
+            end = self._find_string_end(self._pos + 1)
+        elif first in b"{[":
+            end = self._find_container_end(self._pos, keep)
+        else:
+            end = self._find_scalar_end(self._pos)
+        start = self._pos
+        value = bytes(self._buffer[start:end]) if keep else None
+        self._pos = end
+        return value
+
+    def _find_string_end(self, scan):
+        while True:
+            match = _STRING_TAIL.match(self._buffer, scan)
+            if match is not None:
+                return match.end()
+            shift = self._fill(self._pos)
+            if shift is None:
+                raise self._error("Unterminated string")
+            scan -= shift
+
+    def _find_container_end(self, scan, keep):
+        depth = 0
+        while True:
+            match = _STRUCTURE.search(self._buffer, scan)
+            if match is not None:
+                char = self._buffer[match.start()]
+                if char == ord('"'):
+                    string = _STRING_TAIL.match(self._buffer, match.end())
+                    if string is not None:
+                        scan = string.end()
+                        continue
+                    scan = match.start()
+                else:
+                    scan = match.end()
+                    depth += 1 if char in b"{[" else -1
+                    if depth == 0:
+                        return scan
+                    continue
+            else:
+                scan = len(self._buffer)
+            # the bytes scanned so far are not needed to skip the value
+            shift = self._fill(self._pos if keep else scan)
+            if shift is None:
+                raise self._error("Unexpected end")
+            scan -= shift
+
+    def _find_scalar_end(self, scan):
+        while True:
+            match = _SCALAR_END.search(self._buffer, scan)
+            if match is not None:
+                return match.start()
+            scan = len(self._buffer)
+            shift = self._fill(self._pos)
+            if shift is None:
+                return len(self._buffer)
+            scan -= shift
+
+    def iter_members(self):
+        """Iterate over the members of the next object or the elements of the next array.
+
+        Yields:
+            The key of each member of an object, or the index of each element of an array. The
+            value must be consumed by the caller before resuming the iteration.
+        """
+        opening = self.next_char(b"{[")
+        closing = ord("}") if opening == ord("{") else ord("]")
+        if self.peek_char() == closing:
+            self._pos += 1
+            return
+        index = 0
+        while True:
+            if opening == ord("{"):
+                key = loads(self.read_value())
+                if not isinstance(key, str):
+                    raise self._error("Expected a key")
+                self.next_char(b":")
+                yield key
+            else:
+                yield index
+            index += 1
+            if self.next_char(bytes([ord(","), closing])) == closing:
+                return
+
+
+def _parse_pointer(pointer):
+    """Get the reference tokens of a json pointer."""
+    if not pointer:
+        return []
+    if not pointer.startswith("/"):
+        raise ValueError(f"Invalid json pointer: {pointer!r}")
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _seek(reader, pointer):
+    """Consume the stream until the value at the json pointer."""
+    for token in _parse_pointer(pointer):
+        for key in reader.iter_members():
+            if str(key) == token:
+                break
+            reader.read_value(keep=False)
+        else:
+            raise KeyError(f"Json pointer {pointer!r} not found")
+
+
+def iter_items(chunks, pointer=""):
+    """Decode the items of a json document streamed by chunks.
+
+    Args:
+        chunks (iterable): Chunks of bytes of the json document.
+        pointer (str): Json pointer of the object or array of which the items are decoded, the
+            root of the document by default.
+
+    Yields:
+        Tuples of the key and the decoded value of each member if the value at ``pointer`` is an
+        object, the decoded elements if it is an array.
+
+    Raises:
+        KeyError: if there is no value at ``pointer``.
+        ValueError: if the json is invalid or the value is neither an object nor an array.
+    """
+    reader = _Reader(chunks)
+    _seek(reader, pointer)
+    for key in reader.iter_members():
+        value = loads(reader.read_value())
+        yield (key, value) if isinstance(key, str) else value
+
+
+def load(chunks, pointer=""):
+    """Decode the value at the json pointer of a json document streamed by chunks.
+
+    Only the chunks up to the end of the value are read, and only the value is kept in memory.
+
+    Args:
+        chunks (iterable): Chunks of bytes of the json document.
+        pointer (str): Json pointer of the value, the root of the document by default.
+
+    Raises:
+        KeyError: if there is no value at ``pointer``.
+    """
+    reader = _Reader(chunks)
+    _seek(reader, pointer)
+    return loads(reader.read_value())
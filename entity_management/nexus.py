@@ -1,37 +1,82 @@
 # SPDX-License-Identifier: Apache-2.0
 
-"""New nexus access layer"""
+"""New nexus access layer
 
+The HTTP client is managed by :mod:`entity_management.nexus_client`, the files are accessed
+by :mod:`entity_management.nexus_files` and :mod:`entity_management.nexus_batch`, and the views
+are queried by :mod:`entity_management.nexus_query`. Their public functions are available from
+this module.
+"""
+
+import contextvars
 import json as js
 import logging
-import os
-import re
-import sys
-from email.header import decode_header
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import httpx
-from SPARQLWrapper import JSON, POST, POSTDIRECTLY, SPARQLWrapper
 
+from entity_management.cache import (
+    SingleFlight,
+    get_pinned_key,
+    get_request_key,
+    get_resource_cache,
+    get_revalidating_cache,
+)
 from entity_management.debug import PP
-from entity_management.settings import DASH, JSLD_TYPE, NSG, SCHEMA_UNCONSTRAINED, USERINFO
-from entity_management.state import (
-    get_base_files,
-    get_base_url,
-    get_es_url,
-    get_org,
-    get_proj,
-    get_sparql_url,
-    get_token,
-    has_offline_token,
-    refresh_token,
+from entity_management.nexus_batch import (  # noqa pylint: disable=unused-import
+    download_files,
+    get_files_metadata,
+    link_files,
+    upload_files,
+)
+from entity_management.nexus_client import (  # noqa pylint: disable=unused-import
+    TIMEOUTS,
+    _get_headers,
+    _nexus_wrapper,
+    _to_json,
+    close_http_client,
+    configure_http_client,
+    get_http_client,
+    set_http_client,
+)
+from entity_management.nexus_files import (  # noqa pylint: disable=unused-import
+    _get_file_metadata,
+    download_file,
+    file_as_dict,
+    get_file_location,
+    get_file_metadata,
+    get_file_name,
+    get_file_rev,
+    get_unquoted_uri_path,
+    iter_file_items,
+    link_file,
+    open_file,
+    upload_file,
 )
-from entity_management.util import quote, split_url_params, unquote_uri_path
+from entity_management.nexus_query import (  # noqa pylint: disable=unused-import
+    es_load_by_ids,
+    es_query,
+    find_file_by_digest,
+    sparql_query,
+)
+from entity_management.settings import (
+    DASH,
+    JSLD_TYPE,
+    MAX_CONCURRENCY,
+    NSG,
+    SCHEMA_UNCONSTRAINED,
+    USERINFO,
+)
+from entity_management.state import get_base_url
+from entity_management.util import quote, split_url_params
 
 L = logging.getLogger(__name__)
 
 _HINT_TO_CLS_MAP = {}
 
+# concurrent loads of the same url
+_LOADS = SingleFlight()
+
 
 def register_type(key, cls):
     """Store type corresponding type hint.
@@ -55,102 +100,6 @@ def _find_type(types):
         return filtered_types[0] if filtered_types else types[0]
 
 
-def _get_headers(token=None, accept="application/ld+json"):
-    """Get headers with additional authorization header if token is not None"""
-    headers = {}
-    if token is not None:
-        headers["authorization"] = "Bearer " + token
-    if accept is not None:
-        headers["accept"] = accept
-    return headers
-
-
-def _print_violation_summary(data):
-    """Add colors, remove hashes and other superfluous things from error message"""
-    print("\nNEXUS ERROR SUMMARY:\n", file=sys.stderr)
-
-    for error in data["violations"]:
-        no_hash = re.sub(r",? *(Constraint|Node)(:|\() ?_:\w{32}\)?", "", error)
-        no_hash = re.sub(r"^Error: Violation Error\((.*?)\). ", r"Violation(\g<1>):\n", no_hash)
-        if no_hash.startswith("Violation"):
-            color = "\033[92m"
-            end_color = "\033[0m"
-            color_url = re.sub(r"<(.*?)>", color + r"<\g<1>>" + end_color, no_hash)
-
-            print(color_url + "\n", file=sys.stderr)
-
-
-def _print_nexus_error(http_error):
-    """Helper function to log nexus error response."""
-    request = http_error.response.request
-    response = http_error.response
-    try:
-        request_data = js.loads(request.content) if request.content else None
-    except ValueError:
-        request_data = request.content
-    try:
-        response_data = response.json()
-    except ValueError:
-        response_data = response.text
-    L.error(
-        "Nexus error!\nmethod = %s\nurl = %s\npayload = %s\nstatus = %s\nresponse = %s",
-        PP(request.method),
-        PP(request.url),
-        PP(request_data),
-        PP(response.status_code),
-        PP(response_data),
-    )
-
-
-def _to_json(response, payload=None):
-    """Convert response to json and log if necessary."""
-    json = response.json()
-    L.debug(
-        "Nexus request\nmethod = %s\nurl = %s\npayload = %s\nresponse = %s",
-        PP(response.request.method),
-        PP(response.request.url),
-        PP(payload),
-        PP(json),
-    )
-    return json
-
-
-def _nexus_wrapper(func):
-    """Pretty print nexus error responses, inject token if set in env"""
-
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        """decorator function"""
-
-        if "NEXUS_DRY_RUN" in os.environ and func.__name__ in ["create", "update", "deprecate"]:
-            return None
-
-        token_argument = kwargs.get("token", None)
-        if token_argument is None:
-            kwargs["token"] = get_token()
-
-        try:
-            return func(*args, **kwargs)
-        except httpx.HTTPStatusError as http_error:
-            # retry function call only when got Unauthorized, we have offline token to produce the
-            # new access token and token was not explicitly provided
-            if (
-                http_error.response.status_code == 401
-                and has_offline_token()
-                and token_argument is None
-            ):
-                kwargs["token"] = refresh_token()
-                try:
-                    return func(*args, **kwargs)
-                except httpx.HTTPStatusError as http_error_nested:
-                    _print_nexus_error(http_error_nested)
-                    raise
-            _print_nexus_error(http_error)
-            raise
-
-    return wrapper
-
-
 def get_type_from_name(name):
     """Get type class for type name or return None."""
     return _HINT_TO_CLS_MAP.get(_find_type(name), None)
@@ -161,7 +110,7 @@ def get_type_from_id(resource_id, base=None, org=None, proj=None, token=None, cr
     """Get type which corresponds to the id_url"""
     base_url = get_base_url(base=base, org=org, proj=proj, cross_bucket=cross_bucket)
     url = f"{base_url}/{quote(resource_id)}"
-    response = httpx.get(url, headers=_get_headers(token), timeout=10)
+    response = get_http_client().get(url, headers=_get_headers(token), timeout=TIMEOUTS["metadata"])
     response.raise_for_status()
     response_json = response.json()
     constrained_by = response_json["_constrainedBy"]
@@ -190,12 +139,16 @@ def create(base_url, payload, resource_id=None, sync_index=False, token=None):
         params = {}
     if resource_id:
         url = f"{base_url}/{resource_id}"
-        response = httpx.put(
-            url, headers=_get_headers(token), params=params, json=payload, timeout=10
+        response = get_http_client().put(
+            url, headers=_get_headers(token), params=params, json=payload, timeout=TIMEOUTS["write"]
         )
     else:
-        response = httpx.post(
-            base_url, headers=_get_headers(token), params=params, json=payload, timeout=10
+        response = get_http_client().post(
+            base_url,
+            headers=_get_headers(token),
+            params=params,
+            json=payload,
+            timeout=TIMEOUTS["write"],
         )
     response.raise_for_status()
     return _to_json(response, payload)
@@ -219,8 +172,8 @@ def update(id_url, rev, payload, sync_index=False, token=None):
     params = {"rev": rev}
     if sync_index:
         params.update({"indexing": "sync"})
-    response = httpx.put(
-        id_url, headers=_get_headers(token), params=params, json=payload, timeout=10
+    response = get_http_client().put(
+        id_url, headers=_get_headers(token), params=params, json=payload, timeout=TIMEOUTS["write"]
     )
     response.raise_for_status()
     return _to_json(response, payload)
@@ -234,7 +187,9 @@ def deprecate(id_url, rev, sync_index=False, token=None):
     params = {"rev": rev}
     if sync_index:
         params.update({"indexing": "sync"})
-    response = httpx.delete(id_url, headers=_get_headers(token), params=params, timeout=10)
+    response = get_http_client().delete(
+        id_url, headers=_get_headers(token), params=params, timeout=TIMEOUTS["write"]
+    )
     response.raise_for_status()
     return _to_json(response)
 
@@ -243,6 +198,8 @@ def deprecate(id_url, rev, sync_index=False, token=None):
 def load_by_url(url, params=None, stream=False, token=None):
     """Load json-ld from url
 
+    Concurrent calls loading the same url with the same params and token share one request.
+
     Args:
         url (str): Url of the entity which will be loaded.
         params (dict): Url query params.
@@ -252,17 +209,87 @@ def load_by_url(url, params=None, stream=False, token=None):
     Returns:
         if stream is true then the response content is returned as bytes, otherwise as json.
     """
-    response = httpx.get(url, headers=_get_headers(token), params=params, timeout=10)
+    content = _LOADS.call((get_request_key(url, params), token), _load_content, url, params, token)
+    if content is None or stream:
+        return content
+
+    # every caller decodes the shared content, so that the json can be modified by each of them
+    json = js.loads(content)
+    L.debug("Nexus request\nmethod = %s\nurl = %s\nresponse = %s", "GET", PP(url), PP(json))
+    return json
+
+
+def _load_content(url, params, token):
+    """Load the content of the url from the caches or from nexus, None if not found."""
+    resource_cache = get_resource_cache()
+    cache_key = get_pinned_key(url, params) if resource_cache is not None else None
+    if cache_key is not None:
+        content = resource_cache.get(cache_key, token)
+        if content is not None:
+            return content
+
+    revalidating_cache = get_revalidating_cache() if cache_key is None else None
+    if revalidating_cache is not None:
+        response, content = _get_revalidated(url, params, token, revalidating_cache)
+    else:
+        response = get_http_client().get(
+            url, headers=_get_headers(token), params=params, timeout=TIMEOUTS["metadata"]
+        )
 
     # if not found then return None
     if response.status_code == 404:
         _to_json(response)  # just log the response
         return None
-    response.raise_for_status()
-    if stream:
-        return response.content
-    else:
-        return _to_json(response)
+    if revalidating_cache is None:
+        response.raise_for_status()
+        content = response.content
+    if cache_key is not None:
+        resource_cache.put(cache_key, content, token)
+    return content
+
+
+def _get_revalidated(url, params, token, revalidating_cache):
+    """Get the response to the request of the url revalidating the cached content.
+
+    Returns:
+        tuple: The response and the content, which is the cached one if it was not modified, or
+        None if the url is not found.
+    """
+    request_key = get_request_key(url, params)
+    validation_headers = revalidating_cache.get_validation_headers(request_key)
+    for headers in (validation_headers, {}):
+        response = get_http_client().get(
+            url,
+            headers={**_get_headers(token), **headers},
+            params=params,
+            timeout=TIMEOUTS["metadata"],
+        )
+        if response.status_code == 404:
+            return response, None
+        content = revalidating_cache.get_content(request_key, response)
+        if content is not None:
+            return response, content
+        # the cached content was evicted since the request was sent, which is sent again without
+        # the validation headers
+    raise httpx.HTTPStatusError(
+        f"Not modified response to a request without validation headers: {url}",
+        request=response.request,
+        response=response,
+    )
+
+
+def _get_resource_url(resource_id, cross_bucket, params, base, org, proj):
+    """Get url and query params of the resource, revision or tag in the id are moved to params."""
+    base_url = get_base_url(base=base, org=org, proj=proj, cross_bucket=cross_bucket)
+
+    resource_id, url_params = split_url_params(resource_id)
+
+    if params is None:
+        params = {}
+
+    params.update(url_params)
+
+    return f"{base_url}/{quote(resource_id)}", params
 
 
 def load_by_id(
@@ -291,313 +318,115 @@ def load_by_id(
         if stream is true then response stream content is returned otherwise
         json response.
     """
-    base_url = get_base_url(base=base, org=org, proj=proj, cross_bucket=cross_bucket)
-
-    resource_id, url_params = split_url_params(resource_id)
-
-    if params is None:
-        params = {}
-
-    params.update(url_params)
-
-    url = f"{base_url}/{quote(resource_id)}"
+    url, params = _get_resource_url(resource_id, cross_bucket, params, base, org, proj)
     return load_by_url(url=url, params=params, stream=stream, token=token)
 
 
-@_nexus_wrapper
-def get_current_agent(token=None):
-    """Get user info"""
-    if token is None:
-        return None
-
-    response = httpx.get(
-        USERINFO,
-        headers={"accept": "application/json", "authorization": "Bearer " + token},
-        timeout=10,
-    )
-    response.raise_for_status()
-    return _to_json(response)
-
-
-def _get_files_endpoint():
-    return ""
-
-
-@_nexus_wrapper
-def _get_file_metadata(url, tag=None, token=None):
-    """Helper function"""
-    response = httpx.get(
-        url, headers=_get_headers(token), params={"tag": tag if tag else None}, timeout=10
-    )
-
-    response.raise_for_status()
-    return _to_json(response)
-
-
-def get_file_rev(url, tag=None, token=None):
-    """Get file rev.
-
-    Args:
-        resource_id (str): Nexus ID of the file.
-        tag (str): Provide tag to fetch specific file.
-        token (str): Optional OAuth token.
-
-    Returns:
-        File revision.
-    """
-    return _get_file_metadata(url, tag=tag, token=token)["_rev"]
-
-
-def get_file_location(url, tag=None, token=None):
-    """Get file location.
-
-    Args:
-        resource_id (str): Nexus ID of the file.
-        tag (str): Provide tag to fetch specific file.
-        token (str): Optional OAuth token.
-
-    Returns:
-        File revision.
-    """
-    return _get_file_metadata(url, tag=tag, token=token).get("_location")
-
-
-def get_unquoted_uri_path(url, tag=None, token=None):
-    """Get unquoted uri location path.
-
-    Args:
-        url (str): Nexus URL of the file.
-        tag (str): Provide tag to fetch specific file.
-        token (str): Optional OAuth token.
-    """
-    location = get_file_location(url, tag=tag, token=token)
-    return unquote_uri_path(location)
-
-
-def get_file_name(url, tag=None, token=None):
-    """Get file rev.
-
-    Args:
-        resource_id (str): Nexus ID of the file.
-        tag (str): Provide tag to fetch specific file.
-        token (str): Optional OAuth token.
-
-    Returns:
-        File name.
-    """
-    return _get_file_metadata(url, tag=tag, token=token)["_filename"]
-
-
-@_nexus_wrapper
-def upload_file(
-    name,
-    data,
-    content_type,
-    resource_id=None,
-    storage_id=None,
-    rev=None,
+def iter_load_by_ids(
+    resource_ids,
+    *,
+    max_concurrency=None,
+    cross_bucket=False,
+    params=None,
     base=None,
     org=None,
     proj=None,
     token=None,
 ):
-    """Upload file.
+    """Load json-ld of many ids concurrently.
 
     Args:
-        name (str): File name.
-        data (file): File like data stream.
-        content_type (str): Content type of the data stream.
-        resource_id (str): Optional nexus id of the file.
-        storage_id (str): Optional identifier of the storage backend where the file will be stored.
-            If not provided, the project's default storage is used.
-        rev (int): If you are reuploading file this needs to match current revision of the file.
-        base (str): Nexus instance base url.
-        org (str): Nexus organization.
-        proj (str): Nexus project.
-        token (str): OAuth token.
+        resource_ids (list): Ids of the entities which will be loaded.
+        max_concurrency (int): Maximum number of concurrent requests. Default is
+            ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+        cross_bucket (bool): Wether to search resource in multiple buckets or not.
+        params (dict): Url query params.
+        base (str): The nexus base endpoint.
+        org (str): The nexus organization.
+        proj (str): The nexus project.
+        token (str): Optional OAuth token.
 
-    Returns:
-        Identifier of the uploaded file.
+    Yields:
+        Tuples of the index of the id in ``resource_ids`` and its json response, or None if not
+        found, in the order the responses arrive.
     """
-    if resource_id:
-        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}/{quote(resource_id)}"
-        response = httpx.put(
-            url,
-            headers=_get_headers(token),
-            params={"rev": rev if rev else None, "storage": storage_id if storage_id else None},
-            files={"file": (name, data, content_type)},
-            timeout=10,
-        )
-    else:
-        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}"
-        response = httpx.post(
-            url,
-            headers=_get_headers(token),
-            params={"storage": storage_id if storage_id else None},
-            files={"file": (name, data, content_type)},
-            timeout=10,
-        )
-
-    response.raise_for_status()
-    return _to_json(response)
-
-
-@_nexus_wrapper
-def link_file(
-    name,
-    file_path,
-    content_type,
-    resource_id=None,
-    storage_id=None,
+    with ThreadPoolExecutor(max_workers=max_concurrency or MAX_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run,
+                load_by_id,
+                resource_id,
+                cross_bucket=cross_bucket,
+                params=dict(params) if params else None,
+                base=base,
+                org=org,
+                proj=proj,
+                token=token,
+            ): index
+            for index, resource_id in enumerate(resource_ids)
+        }
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            # do not wait for the remaining requests if the iteration is interrupted
+            for future in futures:
+                future.cancel()
+
+
+def load_by_ids(
+    resource_ids,
+    *,
+    max_concurrency=None,
+    cross_bucket=False,
+    params=None,
     base=None,
     org=None,
     proj=None,
     token=None,
 ):
-    """Link file.
+    """Load json-ld of many ids concurrently.
 
     Args:
-        name (str): File name.
-        file_path (str): File path.
-        content_type (str): Content type of the data stream.
-        resource_id (str): Optional nexus id of the file.
-        storage_id (str): Optional identifier of the storage backend where the file will be stored.
-            If not provided, the project's default storage is used.
-        base (str): Nexus instance base url.
-        org (str): Nexus organization.
-        proj (str): Nexus project.
-        token (str): OAuth token.
-
-    Returns:
-        Identifier of the uploaded file.
-    """
-    params = {"storage": storage_id if storage_id else None}
-    json = {"filename": name, "path": file_path, "mediaType": content_type}
-    if resource_id:
-        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}/{quote(resource_id)}"
-        response = httpx.put(url, headers=_get_headers(token), params=params, json=json, timeout=10)
-    else:
-        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}"
-        response = httpx.post(
-            url, headers=_get_headers(token), params=params, json=json, timeout=10
-        )
-
-    response.raise_for_status()
-    return _to_json(response)
-
-
-@_nexus_wrapper
-def download_file(url, path, file_name=None, tag=None, rev=None, token=None):
-    """Download file.
-
-    Args:
-        url (str): Nexus url of the file.
-        path (str): Path where to save the file.
-        file_name (str): Provide file name to use instead of original name.
-        tag (str): Provide tag to fetch specific file.
-        rev (int): Provide revision number to fetch specific file.
-        token (str): Optional OAuth token.
-
-    Returns:
-        str: Path to the downloaded file.
-    """
-    with httpx.stream(
-        "GET",
-        url,
-        headers=_get_headers(token, accept=None),
-        params={"tag": tag if tag else None, "rev": rev if rev else None},
-        timeout=10,
-    ) as response:
-        response.raise_for_status()
-        L.debug(
-            "Nexus request\nmethod = %s\nurl = %s",
-            PP(response.request.method),
-            PP(response.request.url),
-        )
-        if file_name is None:
-            content_disposition = response.headers.get("content-disposition")
-            match = re.findall('filename="(.+)"', content_disposition)[0]
-            encoded_file_name, encoding = decode_header(match)[0]
-            file_name = encoded_file_name.decode(encoding)
-        file_ = os.path.join(path, file_name)
-        with open(file_, "wb") as f:
-            for chunk in response.iter_bytes(chunk_size=1024):
-                f.write(chunk)
-
-    return os.path.join(os.path.realpath(path), file_name)
-
-
-@_nexus_wrapper
-def file_as_dict(url, tag=None, rev=None, token=None):
-    """Stream file.
-
-    Args:
-        url (str): Nexus url of the file.
-        tag (str): Provide tag to fetch specific file.
-        rev (int): Provide revision number to fetch specific file.
-        token (str): Optional OAuth token.
-
-    Returns:
-        Raw response.
-    """
-    with httpx.stream(
-        "GET",
-        url,
-        headers=_get_headers(token, accept=None),
-        params={"tag": tag if tag else None, "rev": rev if rev else None},
-        timeout=10,
-    ) as response:
-        response.raise_for_status()
-        # TODO: we may want to use a json decoder that can load content from a chunked stream
-        return js.loads(response.read())
-
-
-@_nexus_wrapper
-def sparql_query(query, base=None, org=None, proj=None, token=None):
-    """Execute SPARQL query.
-
-    Args:
-        query (str): SPARQL query.
-        base (str): Nexus instance base url.
-        org (str): Nexus organization.
-        proj (str): Nexus project.
+        resource_ids (list): Ids of the entities which will be loaded.
+        max_concurrency (int): Maximum number of concurrent requests. Default is
+            ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+        cross_bucket (bool): Wether to search resource in multiple buckets or not.
+        params (dict): Url query params.
+        base (str): The nexus base endpoint.
+        org (str): The nexus organization.
+        proj (str): The nexus project.
         token (str): Optional OAuth token.
 
     Returns:
-        Json response.
+        List of json responses in the order of ``resource_ids``, None for the ids not found.
     """
-    endpoint = SPARQLWrapper(get_sparql_url(base, org, proj))
-    endpoint.addCustomHttpHeader("authorization", f"bearer {token}")
-    endpoint.setMethod(POST)
-    endpoint.setReturnFormat(JSON)
-    endpoint.setRequestMethod(POSTDIRECTLY)
-    endpoint.setQuery(query)
-    result = endpoint.query()
-    return result._convertJSON()
+    resource_ids = list(resource_ids)
+    results = [None] * len(resource_ids)
+    for index, json_ld in iter_load_by_ids(
+        resource_ids,
+        max_concurrency=max_concurrency,
+        cross_bucket=cross_bucket,
+        params=params,
+        base=base,
+        org=org,
+        proj=proj,
+        token=token,
+    ):
+        results[index] = json_ld
+    return results
 
 
 @_nexus_wrapper
-def es_query(query, base=None, org=None, proj=None, token=None):
-    """Execute Elasticsearch query.
-
-    Args:
-        query (dict): Elasticsearch dictionary query to serialize to json.
-        base (str): Nexus instance base url.
-        org (str): Nexus organization.
-        proj (str): Nexus project.
-        token (str): Optional OAuth token.
-
-    Returns:
-        Json response.
-    """
-    base_url = get_es_url(base, org, proj)
+def get_current_agent(token=None):
+    """Get user info"""
+    if token is None:
+        return None
 
-    response = httpx.post(
-        url=base_url,
-        headers=_get_headers(token, accept="application/json"),
-        json=query,
-        timeout=10,
+    response = get_http_client().get(
+        USERINFO,
+        headers={"accept": "application/json", "authorization": "Bearer " + token},
+        timeout=TIMEOUTS["metadata"],
     )
-
     response.raise_for_status()
-    return _to_json(response, query)
+    return _to_json(response)
@@ -0,0 +1,533 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Asynchronous nexus access layer.
+
+Awaitable counterparts of the functions in :mod:`entity_management.nexus` built on
+``httpx.AsyncClient``, so that a single event loop can run many nexus operations concurrently::
+
+    results = await asyncio.gather(*(nexus_async.load_by_id(id_) for id_ in ids))
+"""
+
+import asyncio
+import contextvars
+import json as js
+import logging
+import os
+import weakref
+from functools import wraps
+
+import httpx
+
+from entity_management import jsonstream, nexus_client
+from entity_management.cache import (
+    get_pinned_key,
+    get_request_key,
+    get_resource_cache,
+    get_revalidating_cache,
+)
+from entity_management.debug import PP
+from entity_management.nexus import _get_resource_url
+from entity_management.nexus_client import (
+    _NOT_IDEMPOTENT,
+    TIMEOUTS,
+    _file_params,
+    _get_headers,
+    _is_token_refreshable,
+    _print_nexus_error,
+    _to_json,
+)
+from entity_management.retry import get_rate_limiter, get_retry_policy
+from entity_management.state import (
+    get_base_files,
+    get_es_url,
+    get_org,
+    get_proj,
+    get_session,
+    get_sparql_url,
+    get_token,
+    refresh_token,
+)
+from entity_management.transfer import get_content_file_name, get_hasher, verify_digest
+from entity_management.util import quote
+
+L = logging.getLogger(__name__)
+
+# one client per event loop because connections can't be shared between loops
+_HTTP_CLIENTS = weakref.WeakKeyDictionary()
+
+
+def get_http_client():
+    """Get the asynchronous HTTP client shared by all the calls to nexus in the running loop.
+
+    The client is configured with the same options as the synchronous client, see
+    :func:`entity_management.nexus.configure_http_client`.
+
+    The asynchronous client of the active :class:`entity_management.state.NexusSession`, if it
+    has one, is returned instead.
+    """
+    session = get_session()
+    if session is not None and session.async_http_client is not None:
+        return session.async_http_client
+    loop = asyncio.get_running_loop()
+    client = _HTTP_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        options = nexus_client._HTTP_CLIENT_OPTIONS
+        limits = httpx.Limits(
+            max_connections=options["max_connections"],
+            max_keepalive_connections=options["max_keepalive_connections"],
+            keepalive_expiry=options["keepalive_expiry"],
+        )
+        client = httpx.AsyncClient(http2=options["http2"], limits=limits)
+        _HTTP_CLIENTS[loop] = client
+    return client
+
+
+def set_http_client(client):
+    """Set the asynchronous HTTP client shared by all the calls to nexus in the running loop.
+
+    Args:
+        client (httpx.AsyncClient): Client to use. If None, a new client will be created on next
+            call.
+    """
+    loop = asyncio.get_running_loop()
+    if client is None:
+        _HTTP_CLIENTS.pop(loop, None)
+    else:
+        _HTTP_CLIENTS[loop] = client
+
+
+async def close_http_client():
+    """Close the asynchronous HTTP client of the running loop."""
+    client = _HTTP_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+def _nexus_wrapper(func):
+    """Pretty print nexus error responses, inject token if set in env.
+
+    Same as :func:`entity_management.nexus_client._nexus_wrapper` for coroutine functions. Token
+    retrieval and refresh may call keycloak and are therefore run in the default executor.
+    """
+    idempotent = func.__name__ not in _NOT_IDEMPOTENT
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        """decorator function"""
+
+        if "NEXUS_DRY_RUN" in os.environ and func.__name__ in ["create", "update", "deprecate"]:
+            return None
+
+        loop = asyncio.get_running_loop()
+
+        token_argument = kwargs.get("token", None)
+        if token_argument is None:
+            kwargs["token"] = await loop.run_in_executor(
+                None, contextvars.copy_context().run, get_token
+            )
+
+        token_refreshed = False
+        attempt = 0
+        while True:
+            rate_limiter = get_rate_limiter()
+            if rate_limiter is not None:
+                await asyncio.sleep(rate_limiter.reserve())
+            try:
+                return await func(*args, **kwargs)
+            except httpx.HTTPError as error:
+                if (
+                    isinstance(error, httpx.HTTPStatusError)
+                    and not token_refreshed
+                    and _is_token_refreshable(error, token_argument)
+                ):
+                    kwargs["token"] = await loop.run_in_executor(
+                        None, contextvars.copy_context().run, refresh_token, kwargs["token"]
+                    )
+                    token_refreshed = True
+                    continue
+                delay = get_retry_policy().get_retry_delay(error, attempt, idempotent)
+                if delay is None:
+                    if isinstance(error, httpx.HTTPStatusError):
+                        _print_nexus_error(error)
+                    raise
+                attempt += 1
+                L.warning(
+                    "Retrying %s in %.1fs (%d) after error: %r",
+                    func.__name__,
+                    delay,
+                    attempt,
+                    error,
+                )
+                await asyncio.sleep(delay)
+
+    return wrapper
+
+
+@_nexus_wrapper
+async def create(base_url, payload, resource_id=None, sync_index=False, token=None):
+    """Create entity, return json response
+
+    Args:
+        base_url (str): Base url of the entity which will be saved.
+        payload (dict): Json-ld serialization of the entity.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Json response.
+    """
+    params = {"indexing": "sync"} if sync_index else {}
+    if resource_id:
+        response = await get_http_client().put(
+            f"{base_url}/{resource_id}",
+            headers=_get_headers(token),
+            params=params,
+            json=payload,
+            timeout=TIMEOUTS["write"],
+        )
+    else:
+        response = await get_http_client().post(
+            base_url,
+            headers=_get_headers(token),
+            params=params,
+            json=payload,
+            timeout=TIMEOUTS["write"],
+        )
+    response.raise_for_status()
+    return _to_json(response, payload)
+
+
+@_nexus_wrapper
+async def update(id_url, rev, payload, sync_index=False, token=None):
+    """Update entity, return json response
+
+    Args:
+        id_url (str): Url of the entity which will be updated.
+        rev (int): Revision number.
+        payload (dict): Json-ld serialization of the entity.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Json response.
+    """
+    assert id_url is not None
+    assert rev > 0
+    params = {"rev": rev}
+    if sync_index:
+        params.update({"indexing": "sync"})
+    response = await get_http_client().put(
+        id_url, headers=_get_headers(token), params=params, json=payload, timeout=TIMEOUTS["write"]
+    )
+    response.raise_for_status()
+    return _to_json(response, payload)
+
+
+@_nexus_wrapper
+async def deprecate(id_url, rev, sync_index=False, token=None):
+    """Mark entity as deprecated, return json response"""
+    assert id_url is not None
+    assert rev > 0
+    params = {"rev": rev}
+    if sync_index:
+        params.update({"indexing": "sync"})
+    response = await get_http_client().delete(
+        id_url, headers=_get_headers(token), params=params, timeout=TIMEOUTS["write"]
+    )
+    response.raise_for_status()
+    return _to_json(response)
+
+
+@_nexus_wrapper
+async def load_by_url(url, params=None, stream=False, token=None):
+    """Load json-ld from url
+
+    Args:
+        url (str): Url of the entity which will be loaded.
+        params (dict): Url query params.
+        stream (bool): If True then the content is returned as bytes.
+        token (str): Optional OAuth token.
+
+    Returns:
+        if stream is true then the response content is returned as bytes, otherwise as json.
+    """
+    resource_cache = get_resource_cache()
+    cache_key = get_pinned_key(url, params) if resource_cache is not None else None
+    if cache_key is not None:
+        # the sqlite calls are blocking
+        content = await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, resource_cache.get, cache_key, token
+        )
+        if content is not None:
+            return content if stream else js.loads(content)
+
+    revalidating_cache = get_revalidating_cache() if cache_key is None else None
+    if revalidating_cache is not None:
+        response, content = await _get_revalidated(url, params, token, revalidating_cache)
+    else:
+        response = await get_http_client().get(
+            url, headers=_get_headers(token), params=params, timeout=TIMEOUTS["metadata"]
+        )
+
+    # if not found then return None
+    if response.status_code == 404:
+        _to_json(response)  # just log the response
+        return None
+    if revalidating_cache is None:
+        response.raise_for_status()
+        content = response.content
+    if cache_key is not None:
+        await asyncio.get_running_loop().run_in_executor(
+            None, contextvars.copy_context().run, resource_cache.put, cache_key, content, token
+        )
+    if stream:
+        return content
+    elif response.status_code == 304:
+        return js.loads(content)
+    else:
+        return _to_json(response)
+
+
+async def _get_revalidated(url, params, token, revalidating_cache):
+    """Get the response to the request of the url revalidating the cached content.
+
+    Returns:
+        tuple: The response and the content, which is the cached one if it was not modified, or
+        None if the url is not found.
+    """
+    request_key = get_request_key(url, params)
+    validation_headers = revalidating_cache.get_validation_headers(request_key)
+    for headers in (validation_headers, {}):
+        response = await get_http_client().get(
+            url,
+            headers={**_get_headers(token), **headers},
+            params=params,
+            timeout=TIMEOUTS["metadata"],
+        )
+        if response.status_code == 404:
+            return response, None
+        content = revalidating_cache.get_content(request_key, response)
+        if content is not None:
+            return response, content
+        # the cached content was evicted since the request was sent, which is sent again without
+        # the validation headers
+    raise httpx.HTTPStatusError(
+        f"Not modified response to a request without validation headers: {url}",
+        request=response.request,
+        response=response,
+    )
+
+
+async def load_by_id(
+    resource_id,
+    cross_bucket=False,
+    params=None,
+    stream=False,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Load json-ld from id.
+
+    Args:
+        resource_id (str) : Id of the entity which will be loaded.
+        cross_bucket (bool): Wether to search resource in multiple buckets or not.
+        params (dict): Url query params.
+        stream (bool): If True then ``response.content`` stream is returned.
+        base (str): The nexus base endpoint.
+        org (str): The nexus organization.
+        proj (str): The nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        if stream is true then response stream content is returned otherwise
+        json response.
+    """
+    url, params = _get_resource_url(resource_id, cross_bucket, params, base, org, proj)
+    return await load_by_url(url=url, params=params, stream=stream, token=token)
+
+
+@_nexus_wrapper
+async def upload_file(
+    name,
+    data,
+    content_type,
+    resource_id=None,
+    storage_id=None,
+    rev=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Upload file.
+
+    Args:
+        name (str): File name.
+        data (file): File like data stream.
+        content_type (str): Content type of the data stream.
+        resource_id (str): Optional nexus id of the file.
+        storage_id (str): Optional identifier of the storage backend where the file will be stored.
+            If not provided, the project's default storage is used.
+        rev (int): If you are reuploading file this needs to match current revision of the file.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): OAuth token.
+
+    Returns:
+        Identifier of the uploaded file.
+    """
+    url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}"
+    if resource_id:
+        response = await get_http_client().put(
+            f"{url}/{quote(resource_id)}",
+            headers=_get_headers(token),
+            params={"rev": rev if rev else None, "storage": storage_id if storage_id else None},
+            files={"file": (name, data, content_type)},
+            timeout=TIMEOUTS["upload"],
+        )
+    else:
+        response = await get_http_client().post(
+            url,
+            headers=_get_headers(token),
+            params={"storage": storage_id if storage_id else None},
+            files={"file": (name, data, content_type)},
+            timeout=TIMEOUTS["upload"],
+        )
+
+    response.raise_for_status()
+    return _to_json(response)
+
+
+@_nexus_wrapper
+async def download_file(url, path, file_name=None, tag=None, rev=None, token=None, digest=None):
+    """Download file.
+
+    The file is written to a ``.part`` file renamed when the download is complete, the writes are
+    run in the default executor so that they don't block the event loop.
+
+    Args:
+        url (str): Nexus url of the file.
+        path (str): Path where to save the file.
+        file_name (str): Provide file name to use instead of original name.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+        digest (dict): Expected digest of the file, with ``algorithm`` and ``value`` keys as in
+            ``DataDownload.digest``. The digest of the file is computed while it is downloaded.
+
+    Returns:
+        str: Path to the downloaded file.
+
+    Raises:
+        DigestMismatchError: if the digest of the downloaded file differs from ``digest``.
+    """
+    loop = asyncio.get_running_loop()
+    hasher = get_hasher(digest)
+    async with get_http_client().stream(
+        "GET",
+        url,
+        headers=_get_headers(token, accept=None),
+        params=_file_params(tag, rev),
+        timeout=TIMEOUTS["download"],
+    ) as response:
+        response.raise_for_status()
+        L.debug(
+            "Nexus request\nmethod = %s\nurl = %s",
+            PP(response.request.method),
+            PP(response.request.url),
+        )
+        if file_name is None:
+            file_name = get_content_file_name(response)
+        file_ = os.path.join(path, file_name)
+        part_path = f"{file_}.part"
+        f = await loop.run_in_executor(None, open, part_path, "wb")
+        try:
+            async for chunk in response.aiter_bytes():
+                await loop.run_in_executor(None, _write_chunk, f, hasher, chunk)
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    await loop.run_in_executor(None, verify_digest, hasher, digest, part_path)
+    await loop.run_in_executor(None, os.replace, part_path, file_)
+    return os.path.join(os.path.realpath(path), file_name)
+
+
+def _write_chunk(f, hasher, chunk):
+    """Write the chunk to the file and add it to the digest."""
+    f.write(chunk)
+    if hasher is not None:
+        hasher.update(chunk)
+
+
+@_nexus_wrapper
+async def file_as_dict(url, tag=None, rev=None, token=None):
+    """Load json file as dict.
+
+    Args:
+        url (str): Nexus url of the file.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Decoded json content of the file.
+    """
+    response = await get_http_client().get(
+        url,
+        headers=_get_headers(token, accept=None),
+        params=_file_params(tag, rev),
+        timeout=TIMEOUTS["download"],
+    )
+    response.raise_for_status()
+    return jsonstream.loads(response.content)
+
+
+@_nexus_wrapper
+async def sparql_query(query, base=None, org=None, proj=None, token=None):
+    """Execute SPARQL query.
+
+    Args:
+        query (str): SPARQL query.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Json response.
+    """
+    headers = _get_headers(token, accept="application/sparql-results+json")
+    headers["content-type"] = "application/sparql-query"
+    response = await get_http_client().post(
+        get_sparql_url(base, org, proj),
+        headers=headers,
+        content=query.encode(),
+        timeout=TIMEOUTS["query"],
+    )
+    response.raise_for_status()
+    return _to_json(response, query)
+
+
+@_nexus_wrapper
+async def es_query(query, base=None, org=None, proj=None, token=None):
+    """Execute Elasticsearch query.
+
+    Args:
+        query (dict): Elasticsearch dictionary query to serialize to json.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Json response.
+    """
+    response = await get_http_client().post(
+        url=get_es_url(base, org, proj),
+        headers=_get_headers(token, accept="application/json"),
+        json=query,
+        timeout=TIMEOUTS["query"],
+    )
+    response.raise_for_status()
+    return _to_json(response, query)
@@ -0,0 +1,371 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Transfer of many files of nexus at once"""
+
+import contextvars
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import httpx
+
+from entity_management.cache import DistributionCache
+from entity_management.nexus_client import (
+    TIMEOUTS,
+    _get_headers,
+    _nexus_wrapper,
+    _to_json,
+    get_http_client,
+)
+from entity_management.nexus_files import (
+    _link_file,
+    download_file,
+    get_file_metadata,
+    upload_file,
+)
+from entity_management.nexus_query import find_file_by_digest
+from entity_management.settings import DOWNLOAD_CHUNK_SIZE, DOWNLOAD_MAX_PER_HOST, MAX_CONCURRENCY
+from entity_management.state import get_base_files, get_org, get_proj
+from entity_management.transfer import LinkJournal, interleave_by_host
+from entity_management.util import quote, unquote_uri_path
+
+L = logging.getLogger(__name__)
+
+
+def get_files_metadata(urls, tag=None, rev=None, *, max_concurrency=None, token=None):
+    """Get the metadata of many files concurrently, see :func:`get_file_metadata`.
+
+    Args:
+        urls (list): Nexus URLs of the files.
+        max_concurrency (int): Maximum number of concurrent requests. Default is
+            ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+
+    Returns:
+        List of the metadata in the order of ``urls``.
+    """
+    with ThreadPoolExecutor(max_workers=max_concurrency or MAX_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run, get_file_metadata, url, tag, rev, token=token
+            )
+            for url in urls
+        ]
+        try:
+            return [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _upload_or_find_file(name, source, content_type, skip_existing, storage_id, **kwargs):
+    """Upload the file, unless a file with the same digest exists in the project."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _upload_or_find_file(name, f, content_type, skip_existing, storage_id, **kwargs)
+    if skip_existing and hasattr(source, "seekable") and source.seekable():
+        hasher = hashlib.sha256()
+        start = source.tell()
+        for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+        source.seek(start)
+        existing = find_file_by_digest(hasher.hexdigest(), **kwargs)
+        if existing is not None:
+            L.debug("File %s already uploaded as %s", name, existing.get("@id"))
+            return existing
+    return upload_file(name, source, content_type, storage_id=storage_id, **kwargs)
+
+
+def upload_files(
+    files,
+    content_type="application/octet-stream",
+    *,
+    storage_id=None,
+    skip_existing=False,
+    max_concurrency=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Upload many files concurrently.
+
+    The files are streamed from disk or from their iterable of chunks, and their SHA-256 digest
+    is computed while they are sent, see :func:`upload_file`.
+
+    Args:
+        files (iterable): Tuples of the name, the content and optionally the content type of the
+            files. The content is the path of a file, a binary file like object, or an iterable
+            of chunks of bytes.
+        content_type (str): Content type of the files without one.
+        storage_id (str): Optional identifier of the storage backend where the files will be
+            stored. If not provided, the project's default storage is used.
+        skip_existing (bool): Do not upload the files of which the digest is the digest of a file
+            of the project, the existing file is returned instead. The digest of the paths and the
+            seekable file like objects is computed before the upload, the iterables of chunks are
+            always uploaded.
+        max_concurrency (int): Maximum number of files uploaded at the same time. Default is
+            ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): OAuth token.
+
+    Returns:
+        list: Nexus metadata of the uploaded or existing files in the order of ``files``.
+    """
+    files = list(files)
+    results = [None] * len(files)
+    with ThreadPoolExecutor(max_workers=max_concurrency or MAX_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(
+                contextvars.copy_context().run,
+                _upload_or_find_file,
+                name,
+                source,
+                file_content_type[0] if file_content_type else content_type,
+                skip_existing,
+                storage_id,
+                base=base,
+                org=org,
+                proj=proj,
+                token=token,
+            ): index
+            for index, (name, source, *file_content_type) in enumerate(files)
+        }
+        try:
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        finally:
+            # do not wait for the remaining uploads if one failed
+            for future in futures:
+                future.cancel()
+    return results
+
+
+@_nexus_wrapper
+def _link_file_with_id(
+    name,
+    file_path,
+    content_type,
+    resource_id,
+    storage_id=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Link the file with a given id, retried on transient errors.
+
+    The id makes the retries safe: if the file was linked by an attempt whose response was lost,
+    the next attempt gets a conflict and the existing file is returned if it is the file linked.
+    """
+    try:
+        return _link_file(
+            name,
+            file_path,
+            content_type,
+            resource_id=resource_id,
+            storage_id=storage_id,
+            base=base,
+            org=org,
+            proj=proj,
+            token=token,
+        )
+    except httpx.HTTPStatusError as error:
+        if error.response.status_code != 409:
+            raise
+        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}/{quote(resource_id)}"
+        response = get_http_client().get(
+            url, headers=_get_headers(token), timeout=TIMEOUTS["metadata"]
+        )
+        response.raise_for_status()
+        metadata = _to_json(response)
+        location = metadata.get("_location") or ""
+        if metadata.get("_filename") != name or (
+            location.startswith("file://") and unquote_uri_path(location) != file_path
+        ):
+            # another file has the id
+            raise error
+        return metadata
+
+
+def link_files(
+    files,
+    content_type=None,
+    *,
+    storage_id=None,
+    max_concurrency=None,
+    journal=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Link many files concurrently.
+
+    Each file is linked with a generated id, so that it is retried on transient errors without
+    being linked twice.
+
+    Args:
+        files (iterable): Tuples of the name, the path and optionally the content type of the
+            files.
+        content_type (str): Content type of the files without one.
+        storage_id (str): Optional identifier of the storage backend where the files will be
+            stored. If not provided, the project's default storage is used.
+        max_concurrency (int): Maximum number of files linked at the same time. Default is
+            ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+        journal (str): Optional path of a journal of the linked files. If the batch is
+            interrupted, running it again with the same journal links only the files which were
+            not linked yet.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): OAuth token.
+
+    Returns:
+        list: Nexus metadata of the linked files in the order of ``files``.
+    """
+    files = list(files)
+    results = [None] * len(files)
+    link_journal = LinkJournal(journal) if journal is not None else None
+
+    def link(name, file_path, file_content_type):
+        entry = link_journal.get(name, file_path) if link_journal is not None else {}
+        if "metadata" in entry:
+            return entry["metadata"]
+        resource_id = entry.get("id") or str(uuid.uuid4())
+        if link_journal is not None and "id" not in entry:
+            link_journal.record(name=name, path=file_path, id=resource_id)
+        metadata = _link_file_with_id(
+            name,
+            file_path,
+            file_content_type,
+            resource_id,
+            storage_id,
+            base=base,
+            org=org,
+            proj=proj,
+            token=token,
+        )
+        if link_journal is not None:
+            link_journal.record(name=name, path=file_path, id=resource_id, metadata=metadata)
+        return metadata
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_concurrency or MAX_CONCURRENCY) as executor:
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    link,
+                    name,
+                    str(file_path),
+                    file_content_type[0] if file_content_type else content_type,
+                ): index
+                for index, (name, file_path, *file_content_type) in enumerate(files)
+            }
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+            finally:
+                # do not wait for the remaining files if one failed
+                for future in futures:
+                    future.cancel()
+    finally:
+        if link_journal is not None:
+            link_journal.close()
+    return results
+
+
+def download_files(
+    files,
+    path,
+    *,
+    max_concurrency=None,
+    max_per_host=None,
+    progress=None,
+    token=None,
+    max_parallel=1,
+):
+    """Download many files concurrently.
+
+    The files are downloaded once per ``contentUrl`` and per digest: the urls of files with the
+    same digest are mapped to the same downloaded file. The files are saved with their name in
+    nexus, which must be unique among the files. Each file is downloaded in a hidden directory of
+    ``path`` first, kept to resume the download if it is interrupted, so that the different files
+    with the same name are never written to the same file.
+
+    Args:
+        files (iterable): Tuples of the nexus url and the digest of the files, with ``algorithm``
+            and ``value`` keys as in ``DataDownload.digest``, or None.
+        path (str): Path where to save the files.
+        max_concurrency (int): Maximum number of files downloaded at the same time. Default is
+            ``NEXUS_MAX_CONCURRENCY`` environment variable or 16.
+        max_per_host (int): Maximum number of files downloaded at the same time from one host.
+            Default is ``NEXUS_DOWNLOAD_MAX_PER_HOST`` environment variable or
+            ``NEXUS_MAX_CONCURRENCY``.
+        progress (callable): Function called with the number of files downloaded and the total
+            number of files to download each time a file is downloaded.
+        token (str): Optional OAuth token.
+        max_parallel (int): Maximum number of ranges of each file downloaded in parallel, see
+            :func:`download_file`.
+
+    Returns:
+        dict: Path of the downloaded file by url.
+
+    Raises:
+        ValueError: if different files have the same name.
+    """
+    keys = {}
+    unique_files = {}
+    for url, digest in files:
+        if url not in keys:
+            keys[url] = DistributionCache.get_key(digest) or url
+            unique_files.setdefault(keys[url], (url, digest))
+
+    max_per_host = max_per_host or DOWNLOAD_MAX_PER_HOST
+    host_limits = {
+        httpx.URL(url).host: threading.BoundedSemaphore(max_per_host)
+        for url, _ in unique_files.values()
+    }
+
+    names = {}  # url of the file saved with each name
+    names_lock = threading.Lock()
+
+    def download(url, digest):
+        key = hashlib.sha1(keys[url].encode()).hexdigest()[:16]
+        staging = os.path.join(path, f".download-{key}")
+        os.makedirs(staging, exist_ok=True)
+        with host_limits[httpx.URL(url).host]:
+            staged = download_file(
+                url, staging, token=token, digest=digest, max_parallel=max_parallel
+            )
+        file_name = os.path.basename(staged)
+        with names_lock:
+            if names.setdefault(file_name, url) != url:
+                raise ValueError(
+                    f"Files {names[file_name]} and {url} have the same name {file_name}"
+                )
+            os.replace(staged, os.path.join(path, file_name))
+        shutil.rmtree(staging, ignore_errors=True)
+        return os.path.join(os.path.realpath(path), file_name)
+
+    paths = {}
+    with ThreadPoolExecutor(max_workers=max_concurrency or MAX_CONCURRENCY) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, download, url, digest): url
+            for url, digest in interleave_by_host(unique_files.values())
+        }
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                paths[keys[futures[future]]] = future.result()
+                if progress is not None:
+                    progress(done, len(futures))
+        finally:
+            # do not wait for the remaining downloads if one failed
+            for future in futures:
+                future.cancel()
+    return {url: paths[key] for url, key in keys.items()}
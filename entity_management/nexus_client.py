@@ -0,0 +1,271 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""HTTP client and error handling shared by the nexus access layers"""
+
+import atexit
+import json as js
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import urllib.error
+from functools import wraps
+
+import httpx
+
+from entity_management.debug import PP
+from entity_management.retry import get_rate_limiter, get_retry_policy
+from entity_management.settings import (
+    HTTP2,
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    HTTP_TIMEOUT,
+)
+from entity_management.state import get_session, get_token, has_offline_token, refresh_token
+
+L = logging.getLogger(__name__)
+
+# Timeouts in seconds for each kind of operation performed against nexus
+TIMEOUTS = {
+    "metadata": HTTP_TIMEOUT,  # loading resources and files metadata
+    "write": HTTP_TIMEOUT,  # creating, updating, deprecating resources and linking files
+    "query": HTTP_TIMEOUT,  # sparql and elasticsearch queries
+    "upload": HTTP_TIMEOUT,
+    "download": HTTP_TIMEOUT,
+}
+
+_HTTP_CLIENT = None
+_HTTP_CLIENT_PID = None
+_HTTP_CLIENT_OPTIONS = {
+    "http2": HTTP2,
+    "max_connections": HTTP_MAX_CONNECTIONS,
+    "max_keepalive_connections": HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    "keepalive_expiry": HTTP_KEEPALIVE_EXPIRY,
+}
+_HTTP_CLIENT_LOCK = threading.Lock()
+
+
+# calls which could repeat their effect if replayed, retried only if their request was not sent,
+# a replayed update or deprecation of a revision would fail with a conflict
+_NOT_IDEMPOTENT = {"create", "update", "deprecate", "upload_file", "_upload_file", "link_file"}
+
+
+def _make_http_client(http2, max_connections, max_keepalive_connections, keepalive_expiry):
+    """Create the HTTP client keeping connections to nexus alive between the calls."""
+    limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    return httpx.Client(http2=http2, limits=limits, timeout=HTTP_TIMEOUT)
+
+
+def get_http_client():
+    """Get the HTTP client shared by all the calls to nexus.
+
+    The client is created on first use. A new client is created in a forked process so that the
+    connections of the parent process are never shared.
+
+    The client of the active :class:`entity_management.state.NexusSession`, if it has one, is
+    returned instead.
+    """
+    global _HTTP_CLIENT, _HTTP_CLIENT_PID  # pylint: disable=global-statement
+    session = get_session()
+    if session is not None and session.http_client is not None:
+        return session.http_client
+    pid = os.getpid()
+    if _HTTP_CLIENT is None or _HTTP_CLIENT_PID != pid:
+        with _HTTP_CLIENT_LOCK:
+            if _HTTP_CLIENT is None or _HTTP_CLIENT_PID != pid:
+                _HTTP_CLIENT = _make_http_client(**_HTTP_CLIENT_OPTIONS)
+                _HTTP_CLIENT_PID = pid
+    return _HTTP_CLIENT
+
+
+def set_http_client(client):
+    """Set the HTTP client shared by all the calls to nexus.
+
+    Args:
+        client (httpx.Client): Client to use. If None, a new client will be created on next call
+            using the options provided to :func:`configure_http_client`.
+    """
+    global _HTTP_CLIENT, _HTTP_CLIENT_PID  # pylint: disable=global-statement
+    with _HTTP_CLIENT_LOCK:
+        _HTTP_CLIENT = client
+        _HTTP_CLIENT_PID = os.getpid()
+
+
+def configure_http_client(
+    *,
+    http2=None,
+    max_connections=None,
+    max_keepalive_connections=None,
+    keepalive_expiry=None,
+    timeouts=None,
+):
+    """Configure the HTTP client shared by all the calls to nexus.
+
+    The current client is closed and a new one is created on next call with the updated options.
+
+    Args:
+        http2 (bool): Enable HTTP/2, requires ``h2`` package to be installed.
+        max_connections (int): Maximum number of concurrent connections.
+        max_keepalive_connections (int): Maximum number of idle connections kept alive.
+        keepalive_expiry (float): Time in seconds after which idle connections are closed.
+        timeouts (dict): Mapping of operation kind to timeout in seconds. See ``TIMEOUTS``.
+    """
+    options = {
+        "http2": http2,
+        "max_connections": max_connections,
+        "max_keepalive_connections": max_keepalive_connections,
+        "keepalive_expiry": keepalive_expiry,
+    }
+    _HTTP_CLIENT_OPTIONS.update({k: v for k, v in options.items() if v is not None})
+    if timeouts:
+        unknown = set(timeouts) - set(TIMEOUTS)
+        assert not unknown, f"Unknown operations: {unknown}"
+        TIMEOUTS.update(timeouts)
+    close_http_client()
+
+
+def close_http_client():
+    """Close the HTTP client shared by all the calls to nexus."""
+    global _HTTP_CLIENT  # pylint: disable=global-statement
+    with _HTTP_CLIENT_LOCK:
+        if _HTTP_CLIENT is not None and _HTTP_CLIENT_PID == os.getpid():
+            _HTTP_CLIENT.close()
+        _HTTP_CLIENT = None
+
+
+atexit.register(close_http_client)
+
+
+def _get_headers(token=None, accept="application/ld+json"):
+    """Get headers with additional authorization header if token is not None"""
+    headers = {}
+    if token is not None:
+        headers["authorization"] = "Bearer " + token
+    if accept is not None:
+        headers["accept"] = accept
+    return headers
+
+
+def _print_violation_summary(data):
+    """Add colors, remove hashes and other superfluous things from error message"""
+    print("\nNEXUS ERROR SUMMARY:\n", file=sys.stderr)
+
+    for error in data["violations"]:
+        no_hash = re.sub(r",? *(Constraint|Node)(:|\() ?_:\w{32}\)?", "", error)
+        no_hash = re.sub(r"^Error: Violation Error\((.*?)\). ", r"Violation(\g<1>):\n", no_hash)
+        if no_hash.startswith("Violation"):
+            color = "\033[92m"
+            end_color = "\033[0m"
+            color_url = re.sub(r"<(.*?)>", color + r"<\g<1>>" + end_color, no_hash)
+
+            print(color_url + "\n", file=sys.stderr)
+
+
+def _print_nexus_error(http_error):
+    """Helper function to log nexus error response."""
+    request = http_error.response.request
+    response = http_error.response
+    try:
+        request_data = js.loads(request.content) if request.content else None
+    except ValueError:
+        request_data = request.content
+    try:
+        response_data = response.json()
+    except ValueError:
+        response_data = response.text
+    L.error(
+        "Nexus error!\nmethod = %s\nurl = %s\npayload = %s\nstatus = %s\nresponse = %s",
+        PP(request.method),
+        PP(request.url),
+        PP(request_data),
+        PP(response.status_code),
+        PP(response_data),
+    )
+
+
+def _to_json(response, payload=None):
+    """Convert response to json and log if necessary."""
+    json = response.json()
+    L.debug(
+        "Nexus request\nmethod = %s\nurl = %s\npayload = %s\nresponse = %s",
+        PP(response.request.method),
+        PP(response.request.url),
+        PP(payload),
+        PP(json),
+    )
+    return json
+
+
+def _is_token_refreshable(http_error, token_argument):
+    """Check if the call can be retried with a refreshed token.
+
+    Only when got Unauthorized, we have offline token to produce the new access token and token
+    was not explicitly provided.
+    """
+    return http_error.response.status_code == 401 and has_offline_token() and token_argument is None
+
+
+def _file_params(tag=None, rev=None):
+    """Get the query params to fetch a specific version of a file."""
+    return {"tag": tag if tag else None, "rev": rev if rev else None}
+
+
+def _nexus_wrapper(func):
+    """Pretty print nexus error responses, inject token if set in env.
+
+    The calls are rate limited and retried on transient errors according to the policy of
+    :mod:`entity_management.retry`.
+    """
+    idempotent = func.__name__ not in _NOT_IDEMPOTENT
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        """decorator function"""
+
+        if "NEXUS_DRY_RUN" in os.environ and func.__name__ in ["create", "update", "deprecate"]:
+            return None
+
+        token_argument = kwargs.get("token", None)
+        if token_argument is None:
+            kwargs["token"] = get_token()
+
+        token_refreshed = False
+        attempt = 0
+        while True:
+            rate_limiter = get_rate_limiter()
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            try:
+                return func(*args, **kwargs)
+            except (httpx.HTTPError, urllib.error.URLError) as error:
+                if (
+                    isinstance(error, httpx.HTTPStatusError)
+                    and not token_refreshed
+                    and _is_token_refreshable(error, token_argument)
+                ):
+                    kwargs["token"] = refresh_token(kwargs["token"])
+                    token_refreshed = True
+                    continue
+                delay = get_retry_policy().get_retry_delay(error, attempt, idempotent)
+                if delay is None:
+                    if isinstance(error, httpx.HTTPStatusError):
+                        _print_nexus_error(error)
+                    raise
+                attempt += 1
+                L.warning(
+                    "Retrying %s in %.1fs (%d) after error: %r",
+                    func.__name__,
+                    delay,
+                    attempt,
+                    error,
+                )
+                time.sleep(delay)
+
+    return wrapper
@@ -0,0 +1,576 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Access to the files of nexus"""
+
+import io
+import logging
+import os
+from functools import partial
+
+from entity_management import jsonstream
+from entity_management.cache import (
+    get_distribution_cache,
+    get_file_metadata_cache,
+    get_request_key,
+)
+from entity_management.debug import PP
+from entity_management.nexus_client import (
+    TIMEOUTS,
+    _file_params,
+    _get_headers,
+    _nexus_wrapper,
+    _to_json,
+    get_http_client,
+)
+from entity_management.settings import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_MAX_PARALLEL,
+    DOWNLOAD_PART_SIZE,
+)
+from entity_management.state import get_base_files, get_org, get_proj
+from entity_management.transfer import (
+    HashingReader,
+    RangeReader,
+    RangesDownload,
+    ResponseReader,
+    download_stream,
+    get_content_file_name,
+    get_hasher,
+    get_resume_point,
+    get_validator,
+    hash_file,
+    is_parallel_download,
+    save_validator,
+    verify_digest,
+    verify_upload,
+)
+from entity_management.util import quote, unquote_uri_path
+
+L = logging.getLogger(__name__)
+
+
+def _get_files_endpoint():
+    return ""
+
+
+@_nexus_wrapper
+def _get_file_metadata(url, tag=None, rev=None, token=None):
+    """Helper function"""
+    response = get_http_client().get(
+        url,
+        headers=_get_headers(token),
+        params=_file_params(tag, rev),
+        timeout=TIMEOUTS["metadata"],
+    )
+
+    response.raise_for_status()
+    return _to_json(response)
+
+
+def get_file_metadata(url, tag=None, rev=None, token=None):
+    """Get the metadata of a file.
+
+    The metadata is cached by url, tag, rev and token, see
+    :func:`entity_management.cache.get_file_metadata_cache`.
+
+    Args:
+        url (str): Nexus URL of the file.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+    """
+    file_metadata_cache = get_file_metadata_cache()
+    if file_metadata_cache is None:
+        return _get_file_metadata(url, tag=tag, rev=rev, token=token)
+    return file_metadata_cache.get(
+        get_request_key(url, _file_params(tag, rev)),
+        lambda: _get_file_metadata(url, tag=tag, rev=rev, token=token),
+        token=token,
+    )
+
+
+def _invalidate_file_metadata(url, metadata):
+    """Delete the cached metadata of the latest revision of the file updated at the url."""
+    file_metadata_cache = get_file_metadata_cache()
+    if file_metadata_cache is not None:
+        file_metadata_cache.invalidate(url)
+        if metadata.get("_self"):
+            file_metadata_cache.invalidate(metadata["_self"])
+
+
+def get_file_rev(url, tag=None, token=None, rev=None):
+    """Get file rev.
+
+    Args:
+        url (str): Nexus URL of the file.
+        tag (str): Provide tag to fetch specific file.
+        token (str): Optional OAuth token.
+        rev (int): Provide revision number to fetch specific file.
+    """
+    return get_file_metadata(url, tag=tag, rev=rev, token=token)["_rev"]
+
+
+def get_file_location(url, tag=None, token=None, rev=None):
+    """Get file location.
+
+    Args:
+        url (str): Nexus URL of the file.
+        tag (str): Provide tag to fetch specific file.
+        token (str): Optional OAuth token.
+        rev (int): Provide revision number to fetch specific file.
+    """
+    return get_file_metadata(url, tag=tag, rev=rev, token=token).get("_location")
+
+
+def get_unquoted_uri_path(url, tag=None, token=None, rev=None):
+    """Get unquoted uri location path.
+
+    Args:
+        url (str): Nexus URL of the file.
+        tag (str): Provide tag to fetch specific file.
+        token (str): Optional OAuth token.
+        rev (int): Provide revision number to fetch specific file.
+    """
+    location = get_file_location(url, tag=tag, token=token, rev=rev)
+    return unquote_uri_path(location)
+
+
+def get_file_name(url, tag=None, token=None, rev=None):
+    """Get file name.
+
+    Args:
+        url (str): Nexus URL of the file.
+        tag (str): Provide tag to fetch specific file.
+        token (str): Optional OAuth token.
+        rev (int): Provide revision number to fetch specific file.
+    """
+    return get_file_metadata(url, tag=tag, rev=rev, token=token)["_filename"]
+
+
+def upload_file(
+    name,
+    data,
+    content_type,
+    resource_id=None,
+    storage_id=None,
+    rev=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Upload file.
+
+    Args:
+        name (str): File name.
+        data (file): Binary file like data stream, bytes, or iterable of chunks of bytes which
+            is streamed without being held in memory.
+        content_type (str): Content type of the data stream.
+        resource_id (str): Optional nexus id of the file.
+        storage_id (str): Optional identifier of the storage backend where the file will be stored.
+            If not provided, the project's default storage is used.
+        rev (int): If you are reuploading file this needs to match current revision of the file.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): OAuth token.
+
+    Returns:
+        Identifier of the uploaded file.
+
+    Raises:
+        DigestMismatchError: if the SHA-256 digest of the file computed by nexus differs from the
+            digest computed locally while the data was sent.
+        ValueError: if the data is an iterable of chunks and the request has to be sent again,
+            for example after the token was refreshed.
+    """
+    # wrapped once, so that a request sent again reads the data from its start, or raises if the
+    # chunks were consumed, instead of sending what is left of them
+    return _upload_file(
+        name,
+        HashingReader(data),
+        content_type,
+        resource_id=resource_id,
+        storage_id=storage_id,
+        rev=rev,
+        base=base,
+        org=org,
+        proj=proj,
+        token=token,
+    )
+
+
+@_nexus_wrapper
+def _upload_file(
+    name,
+    data,
+    content_type,
+    resource_id=None,
+    storage_id=None,
+    rev=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Helper function"""
+    if resource_id:
+        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}/{quote(resource_id)}"
+        response = get_http_client().put(
+            url,
+            headers=_get_headers(token),
+            params={"rev": rev if rev else None, "storage": storage_id if storage_id else None},
+            files={"file": (name, data, content_type)},
+            timeout=TIMEOUTS["upload"],
+        )
+    else:
+        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}"
+        response = get_http_client().post(
+            url,
+            headers=_get_headers(token),
+            params={"storage": storage_id if storage_id else None},
+            files={"file": (name, data, content_type)},
+            timeout=TIMEOUTS["upload"],
+        )
+
+    response.raise_for_status()
+    metadata = _to_json(response)
+    _invalidate_file_metadata(url, metadata)
+    verify_upload(data, metadata)
+    return metadata
+
+
+@_nexus_wrapper
+def link_file(
+    name,
+    file_path,
+    content_type,
+    resource_id=None,
+    storage_id=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Link file.
+
+    Args:
+        name (str): File name.
+        file_path (str): File path.
+        content_type (str): Content type of the data stream.
+        resource_id (str): Optional nexus id of the file.
+        storage_id (str): Optional identifier of the storage backend where the file will be stored.
+            If not provided, the project's default storage is used.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): OAuth token.
+
+    Returns:
+        Identifier of the uploaded file.
+    """
+    return _link_file(
+        name,
+        file_path,
+        content_type,
+        resource_id=resource_id,
+        storage_id=storage_id,
+        base=base,
+        org=org,
+        proj=proj,
+        token=token,
+    )
+
+
+def _link_file(
+    name,
+    file_path,
+    content_type,
+    resource_id=None,
+    storage_id=None,
+    base=None,
+    org=None,
+    proj=None,
+    token=None,
+):
+    """Send the request linking the file, see :func:`link_file`."""
+    params = {"storage": storage_id if storage_id else None}
+    json = {"filename": name, "path": file_path, "mediaType": content_type}
+    if resource_id:
+        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}/{quote(resource_id)}"
+        response = get_http_client().put(
+            url, headers=_get_headers(token), params=params, json=json, timeout=TIMEOUTS["write"]
+        )
+    else:
+        url = f"{get_base_files(base)}/{get_org(org)}/{get_proj(proj)}"
+        response = get_http_client().post(
+            url, headers=_get_headers(token), params=params, json=json, timeout=TIMEOUTS["write"]
+        )
+
+    response.raise_for_status()
+    metadata = _to_json(response)
+    _invalidate_file_metadata(url, metadata)
+    return metadata
+
+
+def _open_download(url, headers, params, start=0, end=None):
+    """Send the request of the file, or of a range of it, and get the response not read yet."""
+    if start or end is not None:
+        headers = {**headers, "range": f"bytes={start}-{'' if end is None else end - 1}"}
+    client = get_http_client()
+    request = client.build_request(
+        "GET", url, headers=headers, params=params, timeout=TIMEOUTS["download"]
+    )
+    response = client.send(request, stream=True)
+    if response.is_error and response.status_code != 416:
+        # read the content of the error to log it
+        response.read()
+        response.close()
+        response.raise_for_status()
+    return response
+
+
+@_nexus_wrapper
+def download_file(
+    url,
+    path,
+    file_name=None,
+    tag=None,
+    rev=None,
+    token=None,
+    digest=None,
+    chunk_size=None,
+    part_size=None,
+    max_parallel=None,
+):
+    """Download file.
+
+    The file is written to a ``.part`` file renamed when the download is complete. An
+    interrupted download is resumed from the ``.part`` file when the download is retried, with
+    the same ``file_name`` if it is provided. The rest of the file is requested only if it is
+    unchanged, according to its ETag or modification date sent as ``If-Range``, a partial
+    download without them is resumed only if the file is verified by ``digest``.
+
+    Large files are downloaded by ranges in parallel if the server supports range requests.
+
+    If the distribution cache of :mod:`entity_management.cache` is enabled, the file is fetched
+    once into the cache by ``digest`` and then materialized into ``path``.
+
+    Args:
+        url (str): Nexus url of the file.
+        path (str): Path where to save the file.
+        file_name (str): Provide file name to use instead of original name.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+        digest (dict): Expected digest of the file, with ``algorithm`` and ``value`` keys as in
+            ``DataDownload.digest``. The digest of the file is computed while it is downloaded.
+        chunk_size (int): Size in bytes of the chunks written to the file. Default is
+            ``NEXUS_DOWNLOAD_CHUNK_SIZE`` environment variable or 1 MiB.
+        part_size (int): Size in bytes of the ranges downloaded in parallel. Default is
+            ``NEXUS_DOWNLOAD_PART_SIZE`` environment variable or 64 MiB.
+        max_parallel (int): Maximum number of ranges downloaded in parallel, 1 to disable the
+            parallel download. Default is ``NEXUS_DOWNLOAD_MAX_PARALLEL`` environment variable
+            or 4.
+
+    Returns:
+        str: Path to the downloaded file.
+
+    Raises:
+        DigestMismatchError: if the digest of the downloaded file differs from ``digest``.
+    """
+    options = {
+        "tag": tag,
+        "rev": rev,
+        "token": token,
+        "digest": digest,
+        "chunk_size": chunk_size,
+        "part_size": part_size,
+        "max_parallel": max_parallel,
+    }
+    distribution_cache = get_distribution_cache()
+    if distribution_cache is not None and distribution_cache.get_key(digest) is not None:
+        return distribution_cache.materialize(
+            digest,
+            path,
+            lambda directory: _download_file(url, directory, **options),
+            file_name=file_name,
+        )
+    return _download_file(url, path, file_name, **options)
+
+
+def _download_file(
+    url,
+    path,
+    file_name=None,
+    tag=None,
+    rev=None,
+    token=None,
+    digest=None,
+    chunk_size=None,
+    part_size=None,
+    max_parallel=None,
+):
+    """Download the file, see :func:`download_file`."""
+    chunk_size = chunk_size or DOWNLOAD_CHUNK_SIZE
+    part_size = part_size or DOWNLOAD_PART_SIZE
+    max_parallel = max_parallel or DOWNLOAD_MAX_PARALLEL
+    headers = _get_headers(token, accept=None)
+    params = _file_params(tag, rev)
+    hasher = get_hasher(digest)
+
+    offset, validator = get_resume_point(path, file_name, hasher is not None)
+    response = _open_download(url, _if_range(headers, validator), params, offset)
+    try:
+        L.debug(
+            "Nexus request\nmethod = %s\nurl = %s",
+            PP(response.request.method),
+            PP(response.request.url),
+        )
+        if file_name is None:
+            file_name = get_content_file_name(response)
+            offset, validator = get_resume_point(path, file_name, hasher is not None)
+            if offset and response.headers.get("accept-ranges") == "bytes":
+                response.close()
+                response = _open_download(url, _if_range(headers, validator), params, offset)
+        file_ = os.path.join(path, file_name)
+        part_path = f"{file_}.part"
+
+        if response.status_code == 416:
+            # the partial download is larger than the file, restart it
+            response.close()
+            offset = 0
+            response = _open_download(url, headers, params)
+
+        if is_parallel_download(response, part_size, max_parallel):
+            size = int(response.headers["content-length"])
+            validator = get_validator(response)
+            ranges = RangesDownload(
+                lambda start, end: _open_download(
+                    url, _if_range(headers, validator), params, start, end
+                ),
+                part_path,
+                size,
+                part_size,
+                chunk_size,
+                validator=validator,
+                verifiable=hasher is not None,
+            )
+            ranges.run(max_parallel, response)
+            if hasher is not None:
+                hash_file(hasher, part_path, chunk_size=chunk_size)
+        else:
+            if os.path.exists(f"{part_path}.ranges"):
+                # the previous download was parallel but this one can't be
+                os.remove(f"{part_path}.ranges")
+            if response.status_code != 206:
+                # the file is downloaded from the start, also when it changed since the partial
+                # download
+                offset = 0
+                save_validator(part_path, get_validator(response))
+            download_stream(response, part_path, offset, hasher, chunk_size)
+    finally:
+        response.close()
+
+    try:
+        verify_digest(hasher, digest, part_path)
+    finally:
+        save_validator(part_path, None)
+    os.replace(part_path, file_)
+    return os.path.join(os.path.realpath(path), file_name)
+
+
+def _if_range(headers, validator):
+    """Get the headers of a range request of the content with the validator, if it has one."""
+    if validator is None:
+        return headers
+    return {**headers, "if-range": validator}
+
+
+@_nexus_wrapper
+def file_as_dict(url, tag=None, rev=None, token=None, digest=None):
+    """Stream file.
+
+    Args:
+        url (str): Nexus url of the file.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+        digest (dict): Digest of the file, with ``algorithm`` and ``value`` keys. If the
+            distribution cache of :mod:`entity_management.cache` is enabled, the file is read from
+            the cache.
+
+    Returns:
+        Raw response.
+    """
+    distribution_cache = get_distribution_cache()
+    if distribution_cache is not None and distribution_cache.get_key(digest) is not None:
+        with distribution_cache.open(
+            digest,
+            lambda directory: _download_file(
+                url, directory, tag=tag, rev=rev, token=token, digest=digest
+            ),
+        ) as f:
+            return jsonstream.loads(f.read())
+
+    with get_http_client().stream(
+        "GET",
+        url,
+        headers=_get_headers(token, accept=None),
+        params=_file_params(tag, rev),
+        timeout=TIMEOUTS["download"],
+    ) as response:
+        response.raise_for_status()
+        return jsonstream.loads(response.read())
+
+
+@_nexus_wrapper
+def _open_file(url, start=0, end=None, tag=None, rev=None, token=None):
+    """Send the request of the file, or of a range of it, and get the response not read yet."""
+    headers = _get_headers(token, accept=None)
+    return _open_download(url, headers, _file_params(tag, rev), start, end)
+
+
+def open_file(url, tag=None, rev=None, token=None, seekable=False):
+    """Open the file for reading while it is downloaded.
+
+    Args:
+        url (str): Nexus url of the file.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+        seekable (bool): If True, the file is read by range requests of the parts accessed, see
+            :class:`entity_management.transfer.RangeReader`, instead of downloaded sequentially.
+
+    Returns:
+        Binary file object, the download is stopped when it is closed.
+    """
+    if seekable:
+        return RangeReader(partial(_open_file, url, tag=tag, rev=rev, token=token))
+    response = _open_file(url, tag=tag, rev=rev, token=token)
+    return io.BufferedReader(ResponseReader(response), buffer_size=DOWNLOAD_CHUNK_SIZE)
+
+
+def iter_file_items(url, pointer="", tag=None, rev=None, token=None, chunk_size=2**16):
+    """Decode the items of a json file while it is downloaded.
+
+    Only one item is kept in memory at a time, see :func:`entity_management.jsonstream.iter_items`.
+
+    Args:
+        url (str): Nexus url of the file.
+        pointer (str): Json pointer of the object or array of which the items are decoded, the
+            root of the document by default.
+        tag (str): Provide tag to fetch specific file.
+        rev (int): Provide revision number to fetch specific file.
+        token (str): Optional OAuth token.
+        chunk_size (int): Size in bytes of the chunks read from the response.
+
+    Yields:
+        Tuples of the key and the decoded value of each member if the value at ``pointer`` is an
+        object, the decoded elements if it is an array.
+    """
+    response = _open_file(url, tag=tag, rev=rev, token=token)
+    try:
+        yield from jsonstream.iter_items(response.iter_bytes(chunk_size=chunk_size), pointer)
+    finally:
+        response.close()
@@ -0,0 +1,136 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Queries of the SPARQL and Elasticsearch views of nexus"""
+
+import json as js
+
+from SPARQLWrapper import JSON, POST, POSTDIRECTLY, SPARQLWrapper
+
+from entity_management.nexus_client import (
+    TIMEOUTS,
+    _get_headers,
+    _nexus_wrapper,
+    _to_json,
+    get_http_client,
+)
+from entity_management.state import get_es_url, get_sparql_url
+
+# default index.max_result_window of Elasticsearch, the maximum size of a query
+ES_MAX_RESULT_WINDOW = 10000
+
+
+@_nexus_wrapper
+def sparql_query(query, base=None, org=None, proj=None, token=None):
+    """Execute SPARQL query.
+
+    Args:
+        query (str): SPARQL query.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Json response.
+    """
+    endpoint = SPARQLWrapper(get_sparql_url(base, org, proj))
+    endpoint.addCustomHttpHeader("authorization", f"bearer {token}")
+    endpoint.setMethod(POST)
+    endpoint.setReturnFormat(JSON)
+    endpoint.setRequestMethod(POSTDIRECTLY)
+    endpoint.setQuery(query)
+    result = endpoint.query()
+    return result._convertJSON()
+
+
+@_nexus_wrapper
+def es_query(query, base=None, org=None, proj=None, token=None):
+    """Execute Elasticsearch query.
+
+    Args:
+        query (dict): Elasticsearch dictionary query to serialize to json.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        Json response.
+    """
+    base_url = get_es_url(base, org, proj)
+
+    response = get_http_client().post(
+        url=base_url,
+        headers=_get_headers(token, accept="application/json"),
+        json=query,
+        timeout=TIMEOUTS["query"],
+    )
+
+    response.raise_for_status()
+    return _to_json(response, query)
+
+
+def es_load_by_ids(resource_ids, base=None, org=None, proj=None, token=None):
+    """Load json-ld of many ids with queries to the default Elasticsearch view.
+
+    The json-ld is rebuilt from the original payload indexed with the resource and the nexus
+    metadata of the indexed document. The ids are queried by batches of at most
+    ``ES_MAX_RESULT_WINDOW``, the results are in the order of ``resource_ids``.
+
+    Args:
+        resource_ids (list): Ids of the entities which will be loaded.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        dict: Json-ld of the found resources by id. Ids not indexed are missing.
+    """
+    resource_ids = list(resource_ids)
+    found = {}
+    for start in range(0, len(resource_ids), ES_MAX_RESULT_WINDOW):
+        end = start + ES_MAX_RESULT_WINDOW
+        batch = resource_ids[start:end]
+        query = {"size": len(batch), "query": {"terms": {"@id": batch}}}
+        response = es_query(query, base=base, org=org, proj=proj, token=token)
+        for hit in response["hits"]["hits"]:
+            source = hit["_source"]
+            json_ld = js.loads(source["_original_source"])
+            json_ld.update(
+                {k: v for k, v in source.items() if k.startswith("_") and k != "_original_source"}
+            )
+            json_ld["@id"] = source["@id"]
+            found[source["@id"]] = json_ld
+    return {id_: found[id_] for id_ in resource_ids if id_ in found}
+
+
+def find_file_by_digest(digest, base=None, org=None, proj=None, token=None):
+    """Find a file of the project by digest with the default Elasticsearch view.
+
+    Args:
+        digest (str): Hexadecimal SHA-256 digest of the file.
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Optional OAuth token.
+
+    Returns:
+        dict: Nexus metadata of a file not deprecated with the digest, None if there is none.
+    """
+    query = {
+        "size": 1,
+        "query": {
+            "bool": {
+                "filter": [
+                    {"term": {"_digest._value": digest}},
+                    {"term": {"_deprecated": False}},
+                ]
+            }
+        },
+    }
+    response = es_query(query, base=base, org=org, proj=proj, token=token)
+    hits = response["hits"]["hits"]
+    if not hits:
+        return None
+    return {k: v for k, v in hits[0]["_source"].items() if k != "_original_source"}
@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Retry policy and rate limit of the calls to nexus.
+
+The calls failing with a transient error (connection errors, timeouts, ``429 Too Many Requests``,
+``502``, ``503`` and ``504`` responses) are retried with an exponential backoff with full jitter.
+The delay requested by the ``Retry-After`` header of a response is honoured, the call is not
+retried if it is longer than the maximum backoff.
+
+The calls which are not idempotent, such as creating a resource or a file, or updating a revision
+of a resource, are retried only if the request was never sent to the server, so that a resource
+is never created twice and a lost response of an update doesn't end in a conflict.
+
+All the threads share one token bucket limiting the rate of the calls to nexus, it is disabled
+by default. The policy and the rate limit can be set with the ``NEXUS_RETRIES``,
+``NEXUS_RETRY_BACKOFF``, ``NEXUS_RETRY_MAX_BACKOFF``, ``NEXUS_RATE_LIMIT`` and
+``NEXUS_RATE_LIMIT_BURST`` environment variables or::
+
+    from entity_management import retry
+    retry.configure_retries(max_retries=5, backoff=1)
+    retry.configure_rate_limit(rate=20, burst=40)
+"""
+
+import email.utils
+import random
+import threading
+import time
+import urllib.error
+
+import attr
+import httpx
+
+from entity_management.settings import (
+    RATE_LIMIT,
+    RATE_LIMIT_BURST,
+    RETRIES,
+    RETRY_BACKOFF,
+    RETRY_MAX_BACKOFF,
+)
+
+# errors raised before the request was sent, the server has not seen the request
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+@attr.s(frozen=True)
+class RetryPolicy:
+    """Policy of the retries of the calls to nexus failing with a transient error.
+
+    Args:
+        max_retries (int): Maximum number of retries of a call, 0 disables the retries.
+        backoff (float): Maximum delay in seconds before the first retry, doubled on each retry.
+        max_backoff (float): Upper bound in seconds of the delay between two retries, the calls
+            of which the response requests a longer delay with ``Retry-After`` are not retried.
+        statuses (frozenset): Status codes of the responses to retry.
+    """
+
+    max_retries = attr.ib(default=RETRIES)
+    backoff = attr.ib(default=RETRY_BACKOFF)
+    max_backoff = attr.ib(default=RETRY_MAX_BACKOFF)
+    statuses = attr.ib(default=frozenset({429, 502, 503, 504}), converter=frozenset)
+
+    def is_retryable(self, error, idempotent=True):
+        """Check if the call which raised the error can be retried.
+
+        Args:
+            error (Exception): Error raised by the call.
+            idempotent (bool): False if replaying the call could repeat its effect, such a call is
+                retried only if its request was never sent.
+        """
+        if isinstance(error, _NOT_SENT_ERRORS):
+            return True
+        if not idempotent:
+            return False
+        if isinstance(error, httpx.HTTPStatusError):
+            return error.response.status_code in self.statuses
+        if isinstance(error, urllib.error.HTTPError):
+            return error.code in self.statuses
+        return isinstance(error, (httpx.TransportError, urllib.error.URLError))
+
+    def get_delay(self, error, attempt):
+        """Get the delay in seconds before retrying the call which raised the error.
+
+        Args:
+            error (Exception): Error raised by the call.
+            attempt (int): Number of retries already done.
+
+        Returns:
+            The delay requested by the ``Retry-After`` header of the response if any, otherwise a
+            random delay up to the exponential backoff.
+        """
+        retry_after = _get_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def get_retry_delay(self, error, attempt, idempotent=True):
+        """Get the delay before retrying the call which raised the error, None to give up."""
+        if attempt >= self.max_retries or not self.is_retryable(error, idempotent):
+            return None
+        delay = self.get_delay(error, attempt)
+        if delay > self.max_backoff:
+            return None
+        return delay
+
+
+class TokenBucket:
+    """Token bucket limiting the rate of the calls.
+
+    Each call takes a token, the bucket is refilled at ``rate`` tokens per second up to ``burst``
+    tokens. A call finding the bucket empty reserves the next token and waits for it, so that the
+    waiting calls are served in order.
+
+    Args:
+        rate (float): Number of calls per second.
+        burst (int): Maximum number of calls done at once after an idle period.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take a token and get the delay in seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self):
+        """Take a token, waiting until it is available."""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+
+_RETRY_POLICY = RetryPolicy()
+_RATE_LIMITER = TokenBucket(RATE_LIMIT, RATE_LIMIT_BURST) if RATE_LIMIT > 0 else None
+
+
+def _get_retry_after(error):
+    """Get the delay in seconds requested by the ``Retry-After`` header, None if there is none."""
+    if isinstance(error, httpx.HTTPStatusError):
+        value = error.response.headers.get("retry-after")
+    elif isinstance(error, urllib.error.HTTPError) and error.headers is not None:
+        value = error.headers.get("retry-after")
+    else:
+        return None
+
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_retry_policy():
+    """Get the retry policy of the calls to nexus."""
+    return _RETRY_POLICY
+
+
+def configure_retries(*, max_retries=None, backoff=None, max_backoff=None, statuses=None):
+    """Configure the retry policy of the calls to nexus.
+
+    Args:
+        max_retries (int): Maximum number of retries of a call, 0 disables the retries.
+        backoff (float): Maximum delay in seconds before the first retry, doubled on each retry.
+        max_backoff (float): Upper bound in seconds of the delay between two retries, the calls
+            of which the response requests a longer delay with ``Retry-After`` are not retried.
+        statuses (iterable): Status codes of the responses to retry.
+    """
+    global _RETRY_POLICY  # pylint: disable=global-statement
+    options = {
+        "max_retries": max_retries,
+        "backoff": backoff,
+        "max_backoff": max_backoff,
+        "statuses": statuses,
+    }
+    _RETRY_POLICY = attr.evolve(
+        _RETRY_POLICY, **{k: v for k, v in options.items() if v is not None}
+    )
+
+
+def get_rate_limiter():
+    """Get the token bucket shared by all the calls to nexus, None if the rate is not limited."""
+    return _RATE_LIMITER
+
+
+def configure_rate_limit(*, rate, burst=None):
+    """Configure the rate limit of the calls to nexus.
+
+    Args:
+        rate (float): Number of calls per second, None or 0 to disable the rate limit.
+        burst (int): Maximum number of calls done at once after an idle period, defaults to
+            ``rate``.
+    """
+    global _RATE_LIMITER  # pylint: disable=global-statement
+    if not rate:
+        _RATE_LIMITER = None
+    else:
+        _RATE_LIMITER = TokenBucket(rate, burst if burst is not None else max(1, rate))
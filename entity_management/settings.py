@@ -26,6 +26,76 @@ DEFAULT_TAG = "v0.1.0"
 # already established some provenance regarding currently running agent
 WORKFLOW = os.getenv("NEXUS_WORKFLOW", None)
 
+# settings of the HTTP client shared by all the calls to nexus
+HTTP_TIMEOUT = float(os.getenv("NEXUS_HTTP_TIMEOUT", "10"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("NEXUS_HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("NEXUS_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("NEXUS_HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2 = os.getenv("NEXUS_HTTP2", "").lower() in {"1", "true"}
+
+# maximum number of concurrent requests done by the batch operations
+MAX_CONCURRENCY = int(os.getenv("NEXUS_MAX_CONCURRENCY", "16"))
+
+# downloads of the files, the large files are downloaded by ranges in parallel
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("NEXUS_DOWNLOAD_CHUNK_SIZE", str(2**20)))
+DOWNLOAD_PART_SIZE = int(os.getenv("NEXUS_DOWNLOAD_PART_SIZE", str(2**26)))
+DOWNLOAD_MAX_PARALLEL = int(os.getenv("NEXUS_DOWNLOAD_MAX_PARALLEL", "4"))
+# read the files of the gpfs storages from the local file system, memory mapped if large
+LOCAL_FILES = os.getenv("NEXUS_LOCAL_FILES", "1").lower() in {"1", "true"}
+MMAP_THRESHOLD = int(os.getenv("NEXUS_MMAP_THRESHOLD", str(2**26)))
+# seekable remote files read by range requests, by blocks kept in memory and read ahead
+RANGE_BLOCK_SIZE = int(os.getenv("NEXUS_RANGE_BLOCK_SIZE", str(2**14)))
+RANGE_READ_AHEAD = int(os.getenv("NEXUS_RANGE_READ_AHEAD", str(2**22)))
+RANGE_CACHE_SIZE = int(os.getenv("NEXUS_RANGE_CACHE_SIZE", str(2**25)))
+# maximum number of files downloaded at the same time from one host by the bulk downloads
+DOWNLOAD_MAX_PER_HOST = int(os.getenv("NEXUS_DOWNLOAD_MAX_PER_HOST", str(MAX_CONCURRENCY)))
+
+# retries of the calls to nexus failing with a transient error
+RETRIES = int(os.getenv("NEXUS_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("NEXUS_RETRY_BACKOFF", "0.5"))
+RETRY_MAX_BACKOFF = float(os.getenv("NEXUS_RETRY_MAX_BACKOFF", "30"))
+
+# maximum number of calls per second to nexus shared by all the threads, 0 for no limit
+RATE_LIMIT = float(os.getenv("NEXUS_RATE_LIMIT", "0"))
+RATE_LIMIT_BURST = float(os.getenv("NEXUS_RATE_LIMIT_BURST", str(max(1.0, RATE_LIMIT))))
+
+# persistent cache of the resources pinned to a revision or a tag
+RESOURCE_CACHE = os.getenv("NEXUS_RESOURCE_CACHE", "").lower() in {"1", "true"}
+RESOURCE_CACHE_PATH = os.getenv(
+    "NEXUS_RESOURCE_CACHE_PATH",
+    str(
+        Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "entity-management"
+        / "resources.sqlite"
+    ),
+)
+RESOURCE_CACHE_MAX_SIZE = int(os.getenv("NEXUS_RESOURCE_CACHE_MAX_SIZE", str(2**30)))
+
+# in memory cache of the unpinned resources revalidated with conditional requests
+REVALIDATING_CACHE = os.getenv("NEXUS_REVALIDATING_CACHE", "").lower() in {"1", "true"}
+REVALIDATING_CACHE_MAX_SIZE = int(os.getenv("NEXUS_REVALIDATING_CACHE_MAX_SIZE", str(2**28)))
+
+# content addressed cache of the downloaded files keyed by their digest
+DISTRIBUTION_CACHE = os.getenv("NEXUS_DISTRIBUTION_CACHE", "").lower() in {"1", "true"}
+DISTRIBUTION_CACHE_PATH = os.getenv(
+    "NEXUS_DISTRIBUTION_CACHE_PATH",
+    str(
+        Path(os.getenv("XDG_CACHE_HOME", Path.home() / ".cache"))
+        / "entity-management"
+        / "distributions"
+    ),
+)
+DISTRIBUTION_CACHE_MAX_SIZE = int(os.getenv("NEXUS_DISTRIBUTION_CACHE_MAX_SIZE", str(2**34)))
+
+# in memory cache of the metadata of the files, the latest revisions expire after the ttl in
+# seconds, they are not cached by default because they can be updated by other processes
+FILE_METADATA_CACHE = os.getenv("NEXUS_FILE_METADATA_CACHE", "1").lower() in {"1", "true"}
+FILE_METADATA_CACHE_MAX_ENTRIES = int(os.getenv("NEXUS_FILE_METADATA_CACHE_MAX_ENTRIES", "65536"))
+FILE_METADATA_CACHE_TTL = float(os.getenv("NEXUS_FILE_METADATA_CACHE_TTL", "0"))
+
+# serialize entities with the serializers compiled per class instead of inspecting every value
+COMPILED_SERIALIZER = os.getenv("NEXUS_COMPILED_SERIALIZER", "1").lower() in {"1", "true"}
+
 RDF = Namespace("http://www.w3.org/1999/02/22-rdf-syntax-ns#")
 PROV = Namespace("http://www.w3.org/ns/prov#")
 NSG = Namespace("https://neuroshapes.org/")
@@ -4,10 +4,26 @@
 
 Nexus organization, project and access token are initialized from the corresponding
 environment variables. They can be updated using setter functions from this module.
+
+They can be overridden in a context with a :class:`NexusSession`, so that the threads or the
+asyncio tasks of one process can work concurrently with different projects or tokens::
+
+    async def publish_all(entities_by_proj):
+        async def publish(proj, entities):
+            with NexusSession(proj=proj).activate():
+                await asyncio.gather(*(entity.apublish() for entity in entities))
+
+        await asyncio.gather(*(publish(proj, e) for proj, e in entities_by_proj.items()))
 """
 
+import contextvars
+import logging
 import os
+import threading
+import time
+from contextlib import contextmanager
 
+import attr
 import jwt
 from keycloak import KeycloakOpenID
 
@@ -22,18 +38,153 @@ REALM = os.getenv("KC_REALM", "BBP")
 SECRET = os.getenv("KC_SCR", None)
 CLIENT_ID = "bbp-workflow"
 
+# the access token is refreshed when it expires in less than this number of seconds
+TOKEN_REFRESH_MARGIN = float(os.getenv("NEXUS_TOKEN_REFRESH_MARGIN", "60"))
+
 ACCESS_TOKEN = None
+ACCESS_TOKEN_EXPIRY = None  # expiration timestamp of the access token, None if unknown
 OFFLINE_TOKEN = None
 
+# guards the tokens so that only one thread refreshes the access token at a time
+_TOKEN_LOCK = threading.Lock()
+
+# active session of the context
+_SESSION = contextvars.ContextVar("nexus_session", default=None)
+
+L = logging.getLogger(__name__)
+
 KEYCLOAK = KeycloakOpenID(
     server_url=f"{AUTH_HOST}/auth/", client_id=CLIENT_ID, client_secret_key=SECRET, realm_name=REALM
 )
 
 
+@attr.s(eq=False)
+class NexusSession:
+    """Nexus instance, project and credentials used by the calls made in a context.
+
+    The attributes which are None fall back to the global state of this module. The explicit
+    arguments of the calls still take precedence over the session.
+
+    Args:
+        base (str): Nexus instance base url.
+        org (str): Nexus organization.
+        proj (str): Nexus project.
+        token (str): Access token, or offline token from which the access tokens of the session
+            are refreshed.
+        http_client (httpx.Client): HTTP client used by the synchronous calls.
+        async_http_client (httpx.AsyncClient): HTTP client used by the asynchronous calls, it
+            must be used in the event loop in which it was created.
+        resource_cache (entity_management.cache.ResourceCache): Cache of the pinned resources.
+        revalidating_cache (entity_management.cache.RevalidatingCache): Cache of the unpinned
+            resources.
+        distribution_cache (entity_management.cache.DistributionCache): Cache of the downloaded
+            files.
+        file_metadata_cache (entity_management.cache.FileMetadataCache): Cache of the metadata
+            of the files.
+    """
+
+    base = attr.ib(default=None)
+    org = attr.ib(default=None)
+    proj = attr.ib(default=None)
+    token = attr.ib(default=None, repr=False)
+    http_client = attr.ib(default=None, repr=False)
+    async_http_client = attr.ib(default=None, repr=False)
+    resource_cache = attr.ib(default=None, repr=False)
+    revalidating_cache = attr.ib(default=None, repr=False)
+    distribution_cache = attr.ib(default=None, repr=False)
+    file_metadata_cache = attr.ib(default=None, repr=False)
+    _access_token = attr.ib(default=None, init=False, repr=False)
+    _access_token_expiry = attr.ib(default=None, init=False, repr=False)
+    _offline_token = attr.ib(default=None, init=False, repr=False)
+    _lock = attr.ib(factory=threading.Lock, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        if self.token is not None and _get_token_type(self.token) in ["Offline", "Refresh"]:
+            self._offline_token = self.token
+        else:
+            self._access_token = self.token
+            self._access_token_expiry = _get_expiry(self.token)
+
+    @contextmanager
+    def activate(self):
+        """Make the session active in the current context.
+
+        The threads started by the batch operations of :mod:`entity_management.nexus` and the
+        asyncio tasks created in the context inherit the session.
+        """
+        token = _SESSION.set(self)
+        try:
+            yield self
+        finally:
+            _SESSION.reset(token)
+
+    def has_offline_token(self):
+        """Checks if the session has an offline token."""
+        return self._offline_token is not None
+
+    def get_token(self):
+        """Get the access token of the session, refreshed ahead of its expiry."""
+        with self._lock:
+            expiry = self._access_token_expiry
+            if self._offline_token is not None and (
+                self._access_token is None or _expires_within(expiry, TOKEN_REFRESH_MARGIN)
+            ):
+                try:
+                    self._refresh_access_token()
+                except Exception:  # pylint: disable=broad-except
+                    if self._access_token is None or _expires_within(expiry, 0):
+                        raise
+                    L.warning("Could not refresh the access token, using it until it expires")
+            return self._access_token
+
+    def refresh_token(self, expired_token=None):
+        """Get a new access token from the offline token of the session.
+
+        See :func:`refresh_token`.
+        """
+        with self._lock:
+            if expired_token is None or expired_token == self._access_token:
+                self._refresh_access_token()
+            return self._access_token
+
+    def _refresh_access_token(self):
+        if self._offline_token is not None:
+            self._access_token = KEYCLOAK.refresh_token(self._offline_token)["access_token"]
+            self._access_token_expiry = _get_expiry(self._access_token)
+
+
+def get_session():
+    """Get the session active in the current context, None if there is none."""
+    return _SESSION.get()
+
+
+def _get_token_session():
+    """Get the active session if it holds the token to use."""
+    session = _SESSION.get()
+    if session is not None and session.token is not None:
+        return session
+    return None
+
+
 def get_token():
-    """Get access token."""
-    if ACCESS_TOKEN is None:
-        refresh_token()
+    """Get access token.
+
+    The access token is refreshed from the offline token, if any, when it is missing or expires in
+    less than ``TOKEN_REFRESH_MARGIN`` seconds. Threads needing a refresh at the same time wait for
+    a single refresh.
+    """
+    session = _get_token_session()
+    if session is not None:
+        return session.get_token()
+    if ACCESS_TOKEN is None or _is_expiring():
+        with _TOKEN_LOCK:
+            if ACCESS_TOKEN is None or _is_expiring():
+                try:
+                    _refresh_access_token()
+                except Exception:  # pylint: disable=broad-except
+                    if ACCESS_TOKEN is None or _is_expiring(margin=0):
+                        raise
+                    L.warning("Could not refresh the access token, using it until it expires")
     return ACCESS_TOKEN
 
 
@@ -49,20 +200,78 @@ def get_offline_token():
 
 def has_offline_token():
     """Checks if offline token is available."""
+    session = _get_token_session()
+    if session is not None:
+        return session.has_offline_token()
     return OFFLINE_TOKEN is not None
 
 
-def refresh_token():
-    """Get new access token from the offline token."""
-    global ACCESS_TOKEN  # pylint: disable=global-statement
+def _get_token_type(token):
+    """Get the type of the token, tokens which can't be decoded are considered access tokens."""
+    try:
+        return get_token_info(token)["typ"]
+    except (jwt.DecodeError, KeyError):
+        return "Bearer"
+
+
+def _get_expiry(token):
+    """Get the expiration timestamp of the token, None if unknown."""
+    if token is None:
+        return None
+    try:
+        return get_token_info(token).get("exp")
+    except jwt.DecodeError:
+        return None
+
+
+def _expires_within(expiry, margin):
+    """Check if the expiration timestamp is less than ``margin`` seconds from now."""
+    return expiry is not None and time.time() >= expiry - margin
+
+
+def _is_expiring(margin=None):
+    """Check if the access token expires in less than ``margin`` seconds and can be refreshed."""
+    if OFFLINE_TOKEN is None:
+        return False
+    return _expires_within(ACCESS_TOKEN_EXPIRY, TOKEN_REFRESH_MARGIN if margin is None else margin)
+
+
+def _set_access_token(token):
+    """Set the access token and its expiration timestamp."""
+    global ACCESS_TOKEN, ACCESS_TOKEN_EXPIRY  # pylint: disable=global-statement
+    ACCESS_TOKEN = token
+    ACCESS_TOKEN_EXPIRY = _get_expiry(token)
+
+
+def _refresh_access_token():
+    """Get new access token from the offline token, the lock must be held."""
     if OFFLINE_TOKEN:
-        ACCESS_TOKEN = KEYCLOAK.refresh_token(OFFLINE_TOKEN)["access_token"]
-    return ACCESS_TOKEN
+        _set_access_token(KEYCLOAK.refresh_token(OFFLINE_TOKEN)["access_token"])
+
+
+def refresh_token(expired_token=None):
+    """Get new access token from the offline token.
+
+    Args:
+        expired_token (str): Access token rejected by nexus. If another thread already replaced
+            it, the new access token is returned without refreshing it again, so that the threads
+            getting an Unauthorized response at the same time trigger a single refresh.
+
+    Returns:
+        The access token.
+    """
+    session = _get_token_session()
+    if session is not None:
+        return session.refresh_token(expired_token)
+    with _TOKEN_LOCK:
+        if expired_token is None or expired_token == ACCESS_TOKEN:
+            _refresh_access_token()
+        return ACCESS_TOKEN
 
 
 def set_token(token):
     """Sets the token for interaction with Nexus API."""
-    global ACCESS_TOKEN, OFFLINE_TOKEN  # pylint: disable=global-statement
+    global OFFLINE_TOKEN  # pylint: disable=global-statement
 
     if token is None:
         return
@@ -70,10 +279,11 @@ def set_token(token):
     # pylint: disable=unreachable
     token_info = get_token_info(token)
 
-    if token_info["typ"] == "Bearer":
-        ACCESS_TOKEN = token
-    elif token_info["typ"] in ["Offline", "Refresh"]:
-        OFFLINE_TOKEN = token
+    with _TOKEN_LOCK:
+        if token_info["typ"] == "Bearer":
+            _set_access_token(token)
+        elif token_info["typ"] in ["Offline", "Refresh"]:
+            OFFLINE_TOKEN = token
 
 
 # Initialize token from the environment
@@ -87,11 +297,15 @@ def get_org(org=None):
         org (str): optional Organization.
 
     Returns:
-        ``org`` argument. If it was not provided then returns the value of global ``Organization``
-        variable which is initialized from NEXUS_ORG environment variable.
+        ``org`` argument. If it was not provided then returns the organization of the active
+        session, or the value of global ``Organization`` variable which is initialized from
+        NEXUS_ORG environment variable.
     """
     if org:
         return org
+    session = _SESSION.get()
+    if session is not None and session.org:
+        return session.org
     return ORG
 
 
@@ -108,11 +322,15 @@ def get_proj(proj=None):
         proj (str): optional Project.
 
     Returns:
-        ``proj`` argument. If it was not provided then returns the value of global ``Project``
-        variable which is initialized from NEXUS_PROJ environment variable.
+        ``proj`` argument. If it was not provided then returns the project of the active session,
+        or the value of global ``Project`` variable which is initialized from NEXUS_PROJ
+        environment variable.
     """
     if proj:
         return proj
+    session = _SESSION.get()
+    if session is not None and session.proj:
+        return session.proj
     return PROJ
 
 
@@ -128,8 +346,22 @@ def set_base(base):
     BASE = base
 
 
-def get_base():
-    """Get global ``BASE`` url variable."""
+def get_base(base=None):
+    """Get current base url.
+
+    Args:
+        base (str): optional ``Base`` url of nexus instance to be used.
+
+    Returns:
+        ``base`` argument. If it was not provided then returns the base url of the active session,
+        or the value of global ``BASE`` variable which is initialized from NEXUS_BASE environment
+        variable.
+    """
+    if base:
+        return base
+    session = _SESSION.get()
+    if session is not None and session.base:
+        return session.base
     return BASE
 
 
@@ -140,13 +372,9 @@ def get_base_resources(base=None):
         base (str): optional ``Base`` url of nexus instance to be used.
 
     Returns:
-        Nexus resources endpoint url is either based on ``base`` function argument provided
-        or based on the global ``BASE`` variable value which is initialized from NEXUS_BASE
-        environment variable.
+        Nexus resources endpoint url based on the base url returned by :func:`get_base`.
     """
-    if base:
-        return f"{base}/resources"
-    return f"{BASE}/resources"
+    return f"{get_base(base)}/resources"
 
 
 def get_base_views(base=None):
@@ -156,13 +384,9 @@ def get_base_views(base=None):
         base (str): optional ``Base`` url of nexus instance to be used.
 
     Returns:
-        Nexus views endpoint url is either based on ``base`` function argument provided
-        or based on the global ``BASE`` variable value which is initialized from NEXUS_BASE
-        environment variable.
+        Nexus views endpoint url based on the base url returned by :func:`get_base`.
     """
-    if base:
-        return f"{base}/views"
-    return f"{BASE}/views"
+    return f"{get_base(base)}/views"
 
 
 def get_base_url(base=None, org=None, proj=None, cross_bucket=False, schema_id=None):
@@ -189,12 +413,9 @@ def get_base_files(base=None):
         base (str): optional ``Base`` url of nexus instance to be used.
 
     Returns:
-        Nexus files endpoint url either based on ``base`` argument provided or based on the
-        global ``Base`` variable value which is initialized from NEXUS_BASE environment variable.
+        Nexus files endpoint url based on the base url returned by :func:`get_base`.
     """
-    if base:
-        return f"{base}/files"
-    return f"{BASE}/files"
+    return f"{get_base(base)}/files"
 
 
 def get_base_resolvers(base=None):
@@ -204,16 +425,15 @@ def get_base_resolvers(base=None):
         base (str): optional ``Base`` url of nexus instance to be used.
 
     Returns:
-        Nexus resolvers endpoint url either based on ``base`` argument provided or based on the
-        global ``Base`` variable value which is initialized from NEXUS_BASE environment variable.
+        Nexus resolvers endpoint url based on the base url returned by :func:`get_base`.
     """
-    return f"{base}/resolvers" if base else f"{BASE}/resolvers"
+    return f"{get_base(base)}/resolvers"
 
 
 def get_user_id(base=None, org=None, token=None):
     """Construct user id."""
-    org = org or ORG
-    base = base or BASE
+    org = get_org(org)
+    base = get_base(base)
     token = token or get_token()
     username = get_token_info(token)["preferred_username"]
     return f"{base}/realms/{org}/users/{username}"
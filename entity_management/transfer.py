@@ -0,0 +1,655 @@
+# SPDX-License-Identifier: Apache-2.0
+
+"""Helpers of the file transfers of :mod:`entity_management.nexus`.
+
+The digests of the files are computed while they are transferred, the partial downloads are
+resumed, the progress of the batches of linked files is journaled, the files of the gpfs
+storages are read from the local file system, and the remote files are read by ranges.
+"""
+
+import contextvars
+import hashlib
+import io
+import json as js
+import logging
+import mmap
+import os
+import re
+import stat
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import suppress
+from email.header import decode_header
+from itertools import chain, zip_longest
+
+import httpx
+
+from entity_management.exception import DigestMismatchError
+from entity_management.settings import (
+    DOWNLOAD_CHUNK_SIZE,
+    MMAP_THRESHOLD,
+    RANGE_BLOCK_SIZE,
+    RANGE_CACHE_SIZE,
+    RANGE_READ_AHEAD,
+)
+from entity_management.util import unquote_uri_path
+
+L = logging.getLogger(__name__)
+
+_CONTENT_RANGE = re.compile(r"bytes (?:\d+-\d+|\*)/(\d+)")
+
+
+def get_content_file_name(response):
+    """Get the file name from the content disposition header of the response."""
+    content_disposition = response.headers.get("content-disposition")
+    match = re.findall('filename="(.+)"', content_disposition)[0]
+    encoded_file_name, encoding = decode_header(match)[0]
+    return encoded_file_name.decode(encoding)
+
+
+def get_hasher(digest):
+    """Get the hash object computing the digest of a file, None if it can't be computed."""
+    if not digest or not digest.get("value"):
+        return None
+    algorithm = digest.get("algorithm", "SHA-256").lower().replace("-", "")
+    try:
+        return hashlib.new(algorithm)
+    except ValueError:
+        L.warning("Digest algorithm %s not supported, the download is not verified", algorithm)
+        return None
+
+
+def hash_file(hasher, path, end=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """Update the hash object with the content of the file up to ``end``."""
+    remaining = os.path.getsize(path) if end is None else end
+    with open(path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+
+
+def verify_digest(hasher, digest, path):
+    """Raise if the digest computed by the hash object differs from the expected one."""
+    if hasher is not None and hasher.hexdigest() != digest["value"].lower():
+        os.remove(path)
+        raise DigestMismatchError(
+            f"{digest.get('algorithm', 'SHA-256')} digest {hasher.hexdigest()} of the downloaded "
+            f"file differs from the expected {digest['value']}"
+        )
+
+
+def get_validator(response):
+    """Get the validator of the content of the response which can be sent as ``If-Range``.
+
+    Returns:
+        The strong ETag of the content, else its modification date, None if it has neither.
+    """
+    etag = response.headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("last-modified")
+
+
+def save_validator(part_path, validator):
+    """Save the validator of the content of the partial download, delete it if None."""
+    validator_path = f"{part_path}.validator"
+    if validator is None:
+        with suppress(FileNotFoundError):
+            os.remove(validator_path)
+    else:
+        with open(validator_path, "w", encoding="utf-8") as f:
+            f.write(validator)
+
+
+def get_resume_point(path, file_name, verifiable=False):
+    """Get the size and the validator of the partial download if it can be resumed sequentially.
+
+    The partial download is resumed only if the request of the rest of the file can be made
+    conditional on the validator of the content it was downloaded from, or if the downloaded file
+    is verified by its digest.
+
+    Args:
+        path (str): Directory of the partial download.
+        file_name (str): Name of the file, nothing is resumed if None.
+        verifiable (bool): True if the digest of the downloaded file is verified.
+
+    Returns:
+        tuple: The size of the partial download, 0 if it can't be resumed, and its validator or
+        None.
+    """
+    if file_name is None:
+        return 0, None
+    part_path = os.path.join(path, f"{file_name}.part")
+    if not os.path.exists(part_path) or os.path.exists(f"{part_path}.ranges"):
+        return 0, None
+    try:
+        with open(f"{part_path}.validator", encoding="utf-8") as f:
+            validator = f.read()
+    except FileNotFoundError:
+        validator = None
+    if validator is None and not verifiable:
+        return 0, None
+    return os.path.getsize(part_path), validator
+
+
+def is_parallel_download(response, part_size, max_parallel):
+    """Check if the file of the response can be downloaded by ranges in parallel."""
+    return (
+        max_parallel > 1
+        and response.status_code == 200
+        and response.headers.get("accept-ranges") == "bytes"
+        and response.headers.get("content-encoding", "identity") == "identity"
+        and int(response.headers.get("content-length", 0)) >= 2 * part_size
+    )
+
+
+def download_stream(response, part_path, offset, hasher, chunk_size):
+    """Write the content of the response at ``offset`` of the partial download."""
+    if offset and hasher is not None:
+        hash_file(hasher, part_path, offset, chunk_size)
+    with open(part_path, "ab" if offset else "wb") as f:
+        for chunk in response.iter_bytes(chunk_size=chunk_size):
+            f.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+
+
+class RangesDownload:
+    """Download of the ranges of a file in parallel into a preallocated partial download.
+
+    The progress of each range is saved in a ``.ranges`` file next to the partial download, once
+    the data of the range is on disk, so that an interrupted download is resumed from where each
+    range stopped. It is resumed only if the validator of the file is unchanged, or if the file is
+    verified by its digest when it has no validator.
+
+    Args:
+        open_range (callable): Function sending the request of the range of the file between the
+            two offsets given as arguments, and returning the response not read yet. The request
+            must be conditional on ``validator``.
+        part_path (str): Path of the partial download.
+        size (int): Size of the file in bytes.
+        part_size (int): Size in bytes of the ranges.
+        chunk_size (int): Size in bytes of the chunks written to the file.
+        validator (str): Validator of the content of the file, see :func:`get_validator`.
+        verifiable (bool): True if the digest of the downloaded file is verified.
+    """
+
+    def __init__(
+        self, open_range, part_path, size, part_size, chunk_size, validator=None, verifiable=False
+    ):
+        self.open_range = open_range
+        self.part_path = part_path
+        self.size = size
+        self.chunk_size = chunk_size
+        self.validator = validator
+        self._ranges_path = f"{part_path}.ranges"
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._progress = self._load_progress(verifiable)
+        if self._progress is None:
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+            self._progress = {start: start for start in range(0, size, part_size)}
+            self._save_progress()
+        self._ends = dict(zip(sorted(self._progress), sorted(self._progress)[1:] + [size]))
+
+    def _load_progress(self, verifiable):
+        """Get the position reached by each range of a previous download of the same file."""
+        try:
+            with open(self._ranges_path, encoding="utf-8") as f:
+                state = js.load(f)
+        except (OSError, ValueError):
+            return None
+        if state.get("size") != self.size or os.path.getsize(self.part_path) != self.size:
+            return None
+        if state.get("validator") != self.validator or (self.validator is None and not verifiable):
+            return None
+        return {int(start): position for start, position in state["progress"].items()}
+
+    def _save_progress(self):
+        with self._save_lock:
+            with self._lock:
+                state = {
+                    "size": self.size,
+                    "validator": self.validator,
+                    "progress": dict(self._progress),
+                }
+            tmp_path = f"{self._ranges_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                js.dump(state, f)
+            os.replace(tmp_path, self._ranges_path)
+
+    def run(self, max_parallel, response=None):
+        """Download the remaining ranges.
+
+        Args:
+            max_parallel (int): Maximum number of ranges downloaded at the same time.
+            response (httpx.Response): Response of the whole file not read yet, used to download
+                the first range if it was not started.
+        """
+        starts = [start for start, end in self._ends.items() if self._progress[start] < end]
+        if response is not None and self._progress.get(0) != 0:
+            response.close()
+            response = None
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self._download_range,
+                    start,
+                    response if start == 0 else None,
+                )
+                for start in starts
+            ]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+                self._save_progress()
+        os.remove(self._ranges_path)
+
+    def _download_range(self, start, response=None):
+        position, end = self._progress[start], self._ends[start]
+        if response is None:
+            response = self.open_range(position, end)
+            if response.status_code != 206:
+                response.close()
+                raise httpx.HTTPError(
+                    f"Range request of {self.part_path} not supported or the file changed"
+                )
+        saved = position
+        try:
+            with open(self.part_path, "r+b") as f:
+                try:
+                    f.seek(position)
+                    for chunk in response.iter_bytes(chunk_size=self.chunk_size):
+                        chunk = chunk[: end - position]
+                        f.write(chunk)
+                        position += len(chunk)
+                        if position >= end:
+                            break
+                        if position - saved >= 16 * self.chunk_size:
+                            self._save_position(start, f, position)
+                            saved = position
+                finally:
+                    # the data written before an error is kept too
+                    self._save_position(start, f, position)
+        finally:
+            response.close()
+        if position < end:
+            raise httpx.ReadError(f"Range {start}-{end} of {self.part_path} ended at {position}")
+
+    def _save_position(self, start, f, position):
+        """Save the position reached by the range once the data before it is on disk."""
+        f.flush()
+        os.fsync(f.fileno())
+        with self._lock:
+            self._progress[start] = position
+        self._save_progress()
+
+
+class HashingReader:
+    """Binary file like reader computing the SHA-256 digest of the data while it is read.
+
+    Args:
+        source: Binary file like object, bytes or iterable of chunks of bytes.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, io.TextIOBase):
+            raise TypeError("Files must be uploaded from binary streams, not text streams")
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        self._file = source if hasattr(source, "read") else None
+        self._chunks = iter(source) if self._file is None else None
+        self._buffer = b""
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    def read(self, size=-1):
+        """Read up to ``size`` bytes, all the remaining bytes if ``size`` is negative."""
+        chunk = self._file.read(size) if self._file is not None else self._read_chunks(size)
+        self.hasher.update(chunk)
+        self.size += len(chunk)
+        return chunk
+
+    def _read_chunks(self, size):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            size = len(self._buffer)
+        chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+    def fileno(self):
+        """Get the file descriptor of the file, used to get its size."""
+        if self._file is None:
+            raise io.UnsupportedOperation("fileno")
+        return self._file.fileno()
+
+    def tell(self):
+        """Get the position in the file."""
+        if self._file is None:
+            raise io.UnsupportedOperation("tell")
+        return self._file.tell()
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        """Move to the position in the file, the digest is restarted when it is rewound.
+
+        Raises:
+            ValueError: if the data is an iterable of chunks which was already read, when the
+                request is sent again.
+        """
+        if self._file is None:
+            if self.size:
+                raise ValueError("The chunks of the file can't be uploaded again")
+            return 0
+        position = self._file.seek(offset, whence)
+        if position == 0:
+            self.hasher = hashlib.sha256()
+            self.size = 0
+        return position
+
+
+def verify_upload(reader, metadata):
+    """Raise if the digest of the uploaded file computed by nexus differs from the local one."""
+    digest = metadata.get("_digest") or {}
+    # the digest of the files on remote storages is computed later by nexus
+    if digest.get("_algorithm") == "SHA-256" and digest.get("_value"):
+        if digest["_value"] != reader.hasher.hexdigest():
+            raise DigestMismatchError(
+                f"SHA-256 digest {digest['_value']} of the uploaded file {metadata.get('@id')} "
+                f"differs from the digest {reader.hasher.hexdigest()} of the sent data"
+            )
+
+
+def interleave_by_host(files):
+    """Order the files so that the consecutive files are on different hosts when possible."""
+    by_host = {}
+    for url, digest in files:
+        by_host.setdefault(httpx.URL(url).host, []).append((url, digest))
+    return [f for f in chain.from_iterable(zip_longest(*by_host.values())) if f is not None]
+
+
+class LinkJournal:
+    """Journal of the files linked by :func:`link_files`, one json object per line.
+
+    The id of each file is recorded before it is linked and its metadata once it is linked, so
+    that an interrupted batch is resumed without linking a file twice.
+    """
+
+    def __init__(self, path):
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = js.loads(line)
+                    except ValueError:
+                        # line partially written when the batch was interrupted
+                        continue
+                    self.entries.setdefault((entry["name"], entry["path"]), {}).update(entry)
+        self._file = open(path, "a+", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != "\n":
+                self._file.write("\n")
+
+    def get(self, name, file_path):
+        """Get the recorded entry of the file, empty if there is none."""
+        return self.entries.get((name, file_path), {})
+
+    def record(self, **entry):
+        """Record the id or the metadata of a file."""
+        with self._lock:
+            self._file.write(js.dumps(entry) + "\n")
+            self._file.flush()
+
+    def close(self):
+        """Close the journal file."""
+        self._file.close()
+
+
+class ResponseReader(io.RawIOBase):
+    """Raw binary reader of the content of a streamed response, closed with the reader.
+
+    Args:
+        response (httpx.Response): Response of which the content is not read yet.
+        chunk_size (int): Size in bytes of the chunks read from the response.
+    """
+
+    def __init__(self, response, chunk_size=DOWNLOAD_CHUNK_SIZE):
+        super().__init__()
+        self._response = response
+        self._chunks = response.iter_bytes(chunk_size=chunk_size)
+        self._chunk = memoryview(b"")
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._chunk:
+            self._chunk = memoryview(next(self._chunks, b""))
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def readall(self):
+        return b"".join([bytes(self._chunk), *self._chunks])
+
+    def close(self):
+        if not self.closed:
+            self._response.close()
+        super().close()
+
+
+def _fits(response, size):
+    """Check if the content of the response is not larger than the size."""
+    length = response.headers.get("content-length")
+    return length is not None and int(length) <= size
+
+
+class RangeReader(io.RawIOBase):
+    """Seekable binary reader of a remote file, reading only the ranges of the file accessed.
+
+    The file is requested by blocks kept in memory, the least recently used blocks are dropped
+    beyond ``cache_size``. The reads are read ahead while they are sequential: the size of the
+    requests doubles on each sequential request up to ``read_ahead``, and a seek to another part
+    of the file restarts from one block, so that reading a header downloads a few blocks only.
+
+    Args:
+        open_range (callable): Function sending the request of the range of the file between the
+            two offsets given as arguments, and returning the response not read yet.
+        block_size (int): Size in bytes of the blocks.
+        read_ahead (int): Maximum size in bytes requested at once by the sequential reads.
+        cache_size (int): Maximum size in bytes of the blocks kept in memory.
+    """
+
+    def __init__(
+        self,
+        open_range,
+        block_size=RANGE_BLOCK_SIZE,
+        read_ahead=RANGE_READ_AHEAD,
+        cache_size=RANGE_CACHE_SIZE,
+    ):
+        super().__init__()
+        self._open_range = open_range
+        self.block_size = block_size
+        self._max_request_blocks = max(1, read_ahead // block_size)
+        self._max_blocks = max(self._max_request_blocks, cache_size // block_size)
+        self._blocks = OrderedDict()
+        self._size = None
+        self._position = 0
+        self._request_blocks = 1
+        self._next_block = None
+        self.transferred = 0
+
+    @property
+    def size(self):
+        """Size of the file in bytes, requested with its first block if not known yet."""
+        if self._size is None:
+            self._fetch(0, 1)
+        return self._size
+
+    def _fetch(self, first, count):
+        """Request the ``count`` blocks from the block ``first``."""
+        start = first * self.block_size
+        end = start + count * self.block_size
+        if self._size is not None:
+            end = min(end, self._size)
+        response = self._open_range(start, end)
+        try:
+            content_range = _CONTENT_RANGE.fullmatch(response.headers.get("content-range", ""))
+            if response.status_code == 206 and content_range is not None:
+                data = response.read()[: end - start]
+            elif response.status_code == 416 and content_range is not None:
+                data = b""
+            elif response.status_code == 200 and start == 0 and _fits(response, end):
+                # the server sent the whole file, which is smaller than the range
+                data = response.read()
+                self._size = len(data)
+            else:
+                raise httpx.HTTPError(f"Range request of {response.request.url} not supported")
+        finally:
+            response.close()
+        if content_range is not None:
+            self._size = int(content_range.group(1))
+        self.transferred += len(data)
+
+        view = memoryview(data)
+        for offset in range(0, len(view), self.block_size):
+            block_end = offset + self.block_size
+            self._blocks[first + offset // self.block_size] = view[offset:block_end]
+        while len(self._blocks) > self._max_blocks:
+            self._blocks.popitem(last=False)
+        self._next_block = first + count
+
+    def _get_block(self, index, last):
+        """Get the block ``index`` to read until the block ``last``."""
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+            return block
+        if index == self._next_block:
+            self._request_blocks = min(2 * self._request_blocks, self._max_request_blocks)
+        else:
+            self._request_blocks = 1
+        count = min(max(last - index + 1, self._request_blocks), self._max_request_blocks)
+        # don't request the blocks already kept
+        count = next((i for i in range(1, count) if index + i in self._blocks), count)
+        self._fetch(index, count)
+        return self._blocks.get(index, b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        self._checkClosed()
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        self._checkClosed()
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"Invalid whence ({whence})")
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        self._checkClosed()
+        with memoryview(buffer) as view, view.cast("B") as view:
+            end = min(self._position + len(view), self.size)
+            last = (end - 1) // self.block_size
+            read = 0
+            while self._position < end:
+                index, offset = divmod(self._position, self.block_size)
+                block_end = offset + end - self._position
+                block = self._get_block(index, last)[offset:block_end]
+                if not block:
+                    break
+                view_end = read + len(block)
+                view[read:view_end] = block
+                read = view_end
+                self._position += len(block)
+            return read
+
+    def readall(self):
+        buffer = bytearray(max(0, self.size - self._position))
+        return bytes(buffer[: self.readinto(buffer)])
+
+    def peek(self, size=0):  # pylint: disable=unused-argument
+        """Get the bytes of the current block from the position without moving it."""
+        self._checkClosed()
+        if self._position >= self.size:
+            return b""
+        index, offset = divmod(self._position, self.block_size)
+        return bytes(self._get_block(index, index)[offset:])
+
+    def close(self):
+        self._blocks.clear()
+        super().close()
+
+
+def get_local_path(location, size=None):
+    """Get the path of the file at the location if it can be read from the local file system.
+
+    Args:
+        location (str): Location uri of the file.
+        size (int): Expected size of the file in bytes.
+
+    Returns:
+        str: Path of the file, None if the location is not a ``file://`` uri, or if the file is
+        not readable or has another size.
+    """
+    if not location or not location.startswith("file://"):
+        return None
+    path = unquote_uri_path(location)
+    try:
+        file_stat = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(file_stat.st_mode) or not os.access(path, os.R_OK):
+        return None
+    if size is not None and file_stat.st_size != size:
+        L.warning("Size of %s differs from its size in nexus, it is not read locally", path)
+        return None
+    return path
+
+
+def read_local_file(path, mmap_threshold=MMAP_THRESHOLD):
+    """Read the content of a local file.
+
+    Args:
+        path (str): Path of the file.
+        mmap_threshold (int): Size in bytes from which the file is memory mapped.
+
+    Returns:
+        The content of the file as bytes, or as a read only ``mmap.mmap`` if the file is larger
+        than ``mmap_threshold``. The memory map is bytes like, its pages are read when they are
+        accessed and shared with the other processes mapping the file.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size and size >= mmap_threshold:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return f.read()
@@ -0,0 +1,70 @@
+"""Benchmark the deserialization of json-ld payloads into entities.
+
+Compares the cached per-class deserialization plans of :mod:`entity_management.base` with
+the type dispatch redone for every field of every payload.
+
+Usage: python benchmark_deserialize.py [--payloads N]
+"""
+
+import argparse
+import time
+from unittest.mock import patch
+
+from entity_management import base
+from entity_management.simulation import DetailedCircuit
+
+
+def _payload(i):
+    """Build a DetailedCircuit payload."""
+    return {
+        "@id": f"https://bbp.epfl.ch/data/circuit/{i}",
+        "@type": ["DetailedCircuit", "Entity"],
+        "name": f"circuit {i}",
+        "description": "A detailed circuit",
+        "circuitType": "Sonata",
+        "circuitConfigPath": {
+            "@type": "DataDownload",
+            "url": f"file:///gpfs/circuits/{i}/circuit_config.json",
+            "encodingFormat": "application/json",
+            "contentSize": {"unitCode": "bytes", "value": 1024},
+        },
+        "nodeCollection": {"@id": f"https://bbp.epfl.ch/data/nodes/{i}", "@type": "NodeCollection"},
+        "edgeCollection": {"@id": f"https://bbp.epfl.ch/data/edges/{i}", "@type": "EdgeCollection"},
+        "atlasRelease": {
+            "@id": "https://bbp.epfl.ch/data/atlas/1",
+            "@type": "AtlasRelease",
+            "_rev": 3,
+        },
+        "_rev": 1,
+        "_self": f"https://bbp.epfl.ch/nexus/v1/resources/org/proj/_/{i}",
+        "_deprecated": False,
+    }
+
+
+def _timed(payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        base._deserialize_resource(payload, DetailedCircuit)
+    return time.perf_counter() - start
+
+
+def main(n_payloads):
+    """Run the benchmark."""
+    payloads = [_payload(i) for i in range(n_payloads)]
+
+    with patch.object(base, "_get_deserializer", base._make_deserializer), patch.object(
+        base, "_get_deserialization_plan", base._make_deserialization_plan
+    ):
+        dispatch = _timed(payloads)
+    plans = _timed(payloads)
+
+    print(f"{n_payloads} DetailedCircuit payloads")
+    print(f"  type dispatch per field:    {dispatch:.3f}s")
+    print(f"  cached deserializer plans:  {plans:.3f}s ({dispatch / plans:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--payloads", type=int, default=10000)
+    arguments = parser.parse_args()
+    main(arguments.payloads)
@@ -0,0 +1,140 @@
+"""Benchmark the throughput of the file downloads against a local server.
+
+Compares the former download with 1 KiB chunks with the sequential download with large chunks and
+the parallel download by ranges of :func:`entity_management.nexus.download_file`, with the SHA-256
+digest verified while downloading.
+
+The files are generated on the fly by a server running in another process, only the downloaded
+file is written to disk.
+
+Usage: python benchmark_download.py [--sizes 1M,10M,100M,1G,10G] [--max-parallel N]
+"""
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from entity_management import nexus
+
+BLOCK = os.urandom(2**20)
+UNITS = {"K": 2**10, "M": 2**20, "G": 2**30}
+
+
+def _content(start, end):
+    """Generate the content of the files between two offsets."""
+    while start < end:
+        offset = start % len(BLOCK)
+        chunk = BLOCK[offset : offset + end - start]
+        yield chunk
+        start += len(chunk)
+
+
+def _digest(size):
+    hasher = hashlib.sha256()
+    for chunk in _content(0, size):
+        hasher.update(chunk)
+    return {"algorithm": "SHA-256", "value": hasher.hexdigest()}
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Serve a file of the size given in the path, with range requests."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the file or the requested range of it."""
+        size = int(self.path.split("?")[0].rsplit("/", 1)[-1])
+        start, end = 0, size
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("range", ""))
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)) + 1 if match.group(2) else size, size)
+            self.send_response(206)
+            self.send_header("content-range", f"bytes {start}-{end - 1}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("accept-ranges", "bytes")
+        self.send_header("content-length", str(end - start))
+        self.send_header("content-disposition", 'attachment; filename="=?UTF-8?B?ZmlsZQ==?="')
+        self.end_headers()
+        try:
+            for chunk in _content(start, end):
+                self.wfile.write(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        """Silence the request logging."""
+
+
+def _parse_size(size):
+    if size[-1].upper() in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1].upper()])
+    return int(size)
+
+
+def _timed(func, tmp_dir):
+    start = time.perf_counter()
+    path = func()
+    elapsed = time.perf_counter() - start
+    os.remove(path)
+    assert not os.listdir(tmp_dir)
+    return elapsed
+
+
+def _serve(ports):
+    """Run the server, in another process so that it doesn't compete for the GIL."""
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def main(sizes, max_parallel):
+    """Run the benchmark."""
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(ports,), daemon=True)
+    server.start()
+    nexus.set_http_client(httpx.Client(timeout=60))
+    base_url = f"http://localhost:{ports.get()}/files/org/proj"
+
+    print(f"{'size':>8} {'1 KiB chunks':>14} {'1 MiB chunks':>14} {'parallel':>14}  (MB/s)")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            url = f"{base_url}/{_parse_size(size)}"
+            digest = _digest(_parse_size(size))
+            options = [
+                {"chunk_size": 2**10, "max_parallel": 1},
+                {"chunk_size": 2**20, "max_parallel": 1},
+                {"chunk_size": 2**20, "max_parallel": max_parallel},
+            ]
+            throughputs = [
+                _parse_size(size)
+                / 1e6
+                / _timed(
+                    lambda o=o, url=url, digest=digest: nexus.download_file(
+                        url, tmp_dir, token="token", digest=digest, **o
+                    ),
+                    tmp_dir,
+                )
+                for o in options
+            ]
+            print(f"{size:>8}" + "".join(f"{t:>15.0f}" for t in throughputs))
+
+    server.terminate()
+    nexus.close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1M,10M,100M,1G", help="Comma separated, up to 10G")
+    parser.add_argument("--max-parallel", type=int, default=4)
+    arguments = parser.parse_args()
+    main(arguments.sizes.split(","), arguments.max_parallel)
@@ -0,0 +1,120 @@
+"""Benchmark the shared HTTP client of the nexus access layer against a local mock server.
+
+Compares one client and connection per request (the module level ``httpx.get``, which also
+builds a new SSL context on every call) with the keep-alive connections of the client shared by
+:mod:`entity_management.nexus`.
+
+Usage: python benchmark_http_client.py [--requests N] [--tls]
+"""
+
+import argparse
+import datetime
+import json
+import ssl
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import httpx
+
+from entity_management import nexus
+
+PAYLOAD = json.dumps({"@id": "https://bbp.epfl.ch/data/1", "@type": "Entity", "_rev": 1}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Return the same json-ld payload for any GET request."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Serve the payload."""
+        self.send_response(200)
+        self.send_header("content-type", "application/ld+json")
+        self.send_header("content-length", str(len(PAYLOAD)))
+        self.end_headers()
+        self.wfile.write(PAYLOAD)
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        """Silence the request logging."""
+
+
+def _self_signed_certificate(directory):
+    """Generate a self signed certificate for localhost."""
+    # pylint: disable=import-outside-toplevel
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now)
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    cert_file = Path(directory) / "cert.pem"
+    key_file = Path(directory) / "key.pem"
+    cert_file.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_file.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+    return cert_file, key_file
+
+
+def _timed(func, n_requests):
+    start = time.perf_counter()
+    for _ in range(n_requests):
+        func()
+    return time.perf_counter() - start
+
+
+def main(n_requests, tls):
+    """Run the benchmark."""
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    verify = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if tls:
+            cert_file, key_file = _self_signed_certificate(tmp_dir)
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(cert_file, key_file)
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+            verify = ssl.create_default_context(cafile=str(cert_file))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        scheme = "https" if tls else "http"
+        url = f"{scheme}://localhost:{server.server_address[1]}/resources/org/proj/_/1"
+        nexus.set_http_client(httpx.Client(verify=verify))
+
+        per_request = _timed(lambda: httpx.get(url, verify=verify, timeout=10), n_requests)
+        pooled = _timed(lambda: nexus.load_by_url(url, token="token"), n_requests)
+
+        server.shutdown()
+        nexus.close_http_client()
+
+    print(f"{n_requests} GET requests over {scheme}")
+    print(f"  new connection per request: {per_request:.3f}s")
+    print(f"  shared pooled client:       {pooled:.3f}s ({per_request / pooled:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--tls", action="store_true", help="Serve over TLS with a self signed cert")
+    arguments = parser.parse_args()
+    main(arguments.requests, arguments.tls)
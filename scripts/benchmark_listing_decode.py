@@ -0,0 +1,97 @@
+"""Benchmark the decoding of nexus listing pages.
+
+Compares the former path of :class:`entity_management.base._NexusBySchemaIterator`, which
+parsed every page into an rdflib graph and walked its triples, with reading ``_total`` and
+``_results`` directly from the listing json.
+
+The listing context is inlined so that rdflib does not fetch it from the network.
+
+Usage: python benchmark_listing_decode.py [--sizes 50 500 2000] [--repeat N]
+"""
+
+import argparse
+import json
+import time
+
+from rdflib.graph import BNode, Graph
+
+from entity_management.base import _decode_listing
+from entity_management.morphology import ReconstructedPatchedCell
+from entity_management.settings import NSG, NXV, RDF
+
+CONTEXT = {
+    "@vocab": "https://bluebrain.github.io/nexus/vocabulary/",
+    "_total": {"@id": "https://bluebrain.github.io/nexus/vocabulary/total"},
+    "_results": {"@id": "https://bluebrain.github.io/nexus/vocabulary/results"},
+    "_self": {"@id": "https://bluebrain.github.io/nexus/vocabulary/self", "@type": "@id"},
+    "_rev": {"@id": "https://bluebrain.github.io/nexus/vocabulary/rev"},
+    "_deprecated": {"@id": "https://bluebrain.github.io/nexus/vocabulary/deprecated"},
+}
+
+
+def _listing(size):
+    """Build a listing page of ``size`` results."""
+    return json.dumps(
+        {
+            "@context": CONTEXT,
+            "_total": 100000,
+            "_results": [
+                {
+                    "@id": f"https://bbp.epfl.ch/neurosciencegraph/data/{i}",
+                    "@type": [
+                        "https://neuroshapes.org/ReconstructedPatchedCell",
+                        "http://www.w3.org/ns/prov#Entity",
+                    ],
+                    "_self": f"https://bbp.epfl.ch/nexus/v1/resources/org/proj/_/{i}",
+                    "_rev": 1,
+                    "_deprecated": False,
+                }
+                for i in range(size)
+            ],
+        }
+    ).encode()
+
+
+def _decode_rdflib(data, cls):
+    """Former decoding through an rdflib graph."""
+    graph = Graph().parse(data=data, format="json-ld")
+    total = None
+    for subject, _, obj in graph.triples((None, NXV.total, None)):
+        if isinstance(subject, BNode):
+            total = obj.toPython()
+    ids = [str(s) for s, _, _ in graph.triples((None, RDF.type, NSG[cls.__name__]))]
+    return total, ids
+
+
+def _decode_json(data, cls):
+    """Direct decoding of the listing json."""
+    return _decode_listing(json.loads(data), cls)
+
+
+def _timed(func, data, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(data, ReconstructedPatchedCell)
+    return (time.perf_counter() - start) / repeat, result
+
+
+def main(sizes, repeat):
+    """Run the benchmark."""
+    for size in sizes:
+        data = _listing(size)
+        rdflib_time, (rdflib_total, rdflib_ids) = _timed(_decode_rdflib, data, repeat)
+        json_time, (json_total, json_ids) = _timed(_decode_json, data, repeat)
+        assert rdflib_total == json_total
+        assert sorted(rdflib_ids) == sorted(json_ids)
+
+        print(f"page of {size} results")
+        print(f"  rdflib graph: {rdflib_time * 1000:.2f}ms")
+        print(f"  direct json:  {json_time * 1000:.2f}ms ({rdflib_time / json_time:.0f}x faster)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=5)
+    arguments = parser.parse_args()
+    main(arguments.sizes, arguments.repeat)
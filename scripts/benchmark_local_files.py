@@ -0,0 +1,139 @@
+"""Benchmark the reading of the distributions from the local file system against HTTP.
+
+Compares :meth:`entity_management.core.DataDownload.read` of a file on a gpfs storage mounted
+locally, memory mapped or not, with its download from a local server. The files are NRRD volumes
+like the annotation or the orientation layers of the atlases, all their voxels are read by hashing
+them.
+
+The NRRD files are generated in a temporary directory, which should be on the file system to
+benchmark, and served by a server running in another process.
+
+Usage: python benchmark_local_files.py [--sizes 10M,100M,1G,4G] [--dir DIR]
+"""
+
+import argparse
+import functools
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+from entity_management import nexus, transfer
+from entity_management.core import DataDownload
+
+UNITS = {"K": 2**10, "M": 2**20, "G": 2**30}
+
+
+def _parse_size(size):
+    if size[-1].upper() in UNITS:
+        return int(float(size[:-1]) * UNITS[size[-1].upper()])
+    return int(size)
+
+
+def _write_nrrd(path, size):
+    """Write a NRRD volume of float32 voxels of about ``size`` bytes."""
+    side = max(1, round((size / 4) ** (1 / 3)))
+    header = (
+        "NRRD0004\n"
+        "type: float\n"
+        "dimension: 3\n"
+        f"sizes: {side} {side} {side}\n"
+        "endian: little\n"
+        "encoding: raw\n"
+        "\n"
+    ).encode()
+    block = os.urandom(2**20)
+    with open(path, "wb") as f:
+        f.write(header)
+        remaining = side**3 * 4
+        while remaining:
+            f.write(block[:remaining])
+            remaining -= min(remaining, len(block))
+    return len(header)
+
+
+class Handler(SimpleHTTPRequestHandler):
+    """Serve the files of the current directory."""
+
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def log_message(self, *_):  # pylint: disable=arguments-differ
+        """Silence the request logging."""
+
+
+def _serve(directory, ports):
+    """Run the server, in another process so that it doesn't compete for the GIL."""
+    server = ThreadingHTTPServer(("localhost", 0), functools.partial(Handler, directory=directory))
+    ports.put(server.server_address[1])
+    server.serve_forever()
+
+
+def _drop_page_cache(path):
+    """Evict the file from the page cache, so that it is read from the storage."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def _timed(distribution, path, header_size):
+    _drop_page_cache(path)
+    start = time.perf_counter()
+    data = distribution.read(use_auth="token")
+    with memoryview(data) as view:
+        hashlib.sha1(view[header_size:]).digest()
+    elapsed = time.perf_counter() - start
+    if hasattr(data, "close"):
+        data.close()
+    return elapsed
+
+
+def main(sizes, directory):
+    """Run the benchmark."""
+    with tempfile.TemporaryDirectory(dir=directory) as tmp_dir:
+        ports = multiprocessing.Queue()
+        server = multiprocessing.Process(target=_serve, args=(tmp_dir, ports), daemon=True)
+        server.start()
+        nexus.set_http_client(httpx.Client(timeout=60))
+        base_url = f"http://localhost:{ports.get()}"
+        read_local_file = transfer.read_local_file
+
+        print(f"{'size':>8} {'http':>14} {'local read':>14} {'local mmap':>14}  (MB/s)")
+        for size in sizes:
+            name = f"{size}.nrrd"
+            path = os.path.join(tmp_dir, name)
+            header_size = _write_nrrd(path, _parse_size(size))
+            file_size = os.path.getsize(path)
+            distribution = DataDownload(
+                contentUrl=f"{base_url}/{name}",
+                contentSize={"unitCode": "bytes", "value": file_size},
+            )
+            throughputs = []
+            for location, mmap_threshold in [
+                (f"{base_url}/{name}", None),
+                (f"file://{path}", file_size + 1),
+                (f"file://{path}", 1),
+            ]:
+                nexus.get_file_location = lambda *a, location=location, **b: location
+                transfer.read_local_file = functools.partial(
+                    read_local_file, mmap_threshold=mmap_threshold
+                )
+                throughputs.append(file_size / 1e6 / _timed(distribution, path, header_size))
+            print(f"{size:>8}" + "".join(f"{t:>15.0f}" for t in throughputs))
+            os.remove(path)
+
+        server.terminate()
+        nexus.close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10M,100M,1G", help="Comma separated")
+    parser.add_argument("--dir", default=None, help="Directory of the generated files")
+    arguments = parser.parse_args()
+    main(arguments.sizes.split(","), arguments.dir)
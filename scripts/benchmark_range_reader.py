@@ -0,0 +1,69 @@
+"""Benchmark the reading of the header of large remote files.
+
+Compares the download of the whole file by :func:`entity_management.nexus.download_file` with
+reading only its header through the seekable file of :func:`entity_management.nexus.open_file`,
+which requests the blocks read by range requests. The files are generated on the fly by the
+server of ``benchmark_download.py``.
+
+Usage: python benchmark_range_reader.py [--sizes 10M,100M,1G,4G] [--header-size 4K]
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+import httpx
+from benchmark_download import _parse_size, _serve
+
+from entity_management import nexus
+
+
+def _download_header(url, header_size, tmp_dir):
+    path = nexus.download_file(url, tmp_dir, token="token")
+    with open(path, "rb") as f:
+        f.read(header_size)
+    os.remove(path)
+    return _parse_size(url.rsplit("/", 1)[-1])
+
+
+def _read_header(url, header_size):
+    with nexus.open_file(url, token="token", seekable=True) as f:
+        f.read(header_size)
+        # the last bytes, such as the footer of a file
+        f.seek(-16, os.SEEK_END)
+        f.read()
+        return f.transferred
+
+
+def main(sizes, header_size):
+    """Run the benchmark."""
+    ports = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(ports,), daemon=True)
+    server.start()
+    nexus.set_http_client(httpx.Client(timeout=60))
+    base_url = f"http://localhost:{ports.get()}/files/org/proj"
+
+    print(f"{'size':>8} {'download (s)':>14} {'ranges (s)':>14} {'transferred':>14}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in sizes:
+            url = f"{base_url}/{_parse_size(size)}"
+            start = time.perf_counter()
+            _download_header(url, header_size, tmp_dir)
+            download_time = time.perf_counter() - start
+            start = time.perf_counter()
+            transferred = _read_header(url, header_size)
+            ranges_time = time.perf_counter() - start
+            print(f"{size:>8} {download_time:>14.3f} {ranges_time:>14.3f} {transferred:>14}")
+
+    server.terminate()
+    nexus.close_http_client()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10M,100M,1G", help="Comma separated")
+    parser.add_argument("--header-size", default="4K")
+    arguments = parser.parse_args()
+    main(arguments.sizes.split(","), _parse_size(arguments.header_size))
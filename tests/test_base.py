@@ -1,7 +1,9 @@
 # pylint: disable=missing-docstring,no-member
 import io
+import re
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dateutil.parser import parse
 from unittest.mock import patch
@@ -21,9 +23,13 @@ from entity_management.base import (
     _deserialize_list,
     _deserialize_frozen,
     _deserialize_json_to_datatype,
+    _get_deserialization_plan,
+    _get_deserializer,
     _serialize_obj,
     Unconstrained,
     NotInstantiated,
+    _NexusBySparqlIterator,
+    _decode_listing,
     Frozen,
     BlankNode,
     attributes,
@@ -33,8 +39,11 @@ from entity_management.base import (
     BrainLocation,
 )
 from entity_management.state import get_org, get_proj
-from entity_management.core import ModelRuntimeParameters
+from entity_management.core import Contribution, DataDownload, ModelRuntimeParameters, Person
+from entity_management.electrophysiology import Trace
+from entity_management.identity import identity_map
 from entity_management.morphology import ReconstructedPatchedCell
+import entity_management.base as base
 import entity_management.nexus as nexus
 from entity_management.typing import MaybeList
 
@@ -157,6 +166,36 @@ def test_serialize_obj__include_rev__instantiated_wout_revision(monkeypatch):
     assert res == {JSLD_ID: "foo", JSLD_TYPE: "A", JSLD_LINK_REV: 8}
 
 
+def _make_trace():
+    return Trace(
+        name="trace",
+        wasGeneratedBy=Identifiable._lazy_init("activity-id", "Activity", rev=3),
+        wasDerivedFrom=[Identifiable._lazy_init("cell-id", "PatchedCell", rev=1)],
+        dateCreated=datetime(2024, 5, 6, 7, 8, 9),
+        distribution=[
+            DataDownload(name="a.nwb", contentUrl="url-a", contentSize={"value": 1}),
+            DataDownload(name="b.nwb", url="url-b", digest={"value": "abc"}),
+        ],
+        contribution=[Contribution(agent=Person._lazy_init("person-id", "Person", rev=2))],
+        retrievalDate=datetime(2024, 1, 2),
+        brainLocation=BrainLocation(brainRegion=OntologyTerm(url="UBERON:1", label="SSp")),
+        subject=Subject(species=OntologyTerm(url="NCBITaxon:10090", label="Mus musculus")),
+    )
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+@pytest.mark.parametrize(
+    "include_rev, golden_file",
+    [(False, "trace_json_ld.json"), (True, "trace_json_ld_include_rev.json")],
+)
+def test_as_json_ld__golden(monkeypatch, compiled, include_rev, golden_file):
+    monkeypatch.setattr(base, "COMPILED_SERIALIZER", compiled)
+
+    res = _make_trace().as_json_ld(include_rev=include_rev)
+
+    assert json.dumps(res, indent=4) + "\n" == (TEST_DATA_DIR / golden_file).read_text()
+
+
 @attr.s
 class Dummy:
     a = attr.ib(default=42)
@@ -334,6 +373,16 @@ def test_deserialize_frozen():
     assert res == BlankNode1(a=2, b=3.0)
 
 
+def test_get_deserialization_plan():
+    plan = _get_deserialization_plan(BlankNode1)
+
+    assert _get_deserialization_plan(BlankNode1) is plan
+    assert list(plan) == ["a", "b"]
+    assert plan["a"][0] is int
+    assert plan["a"][1] is _get_deserializer(int)
+    assert _get_deserializer(List[BlankNode1]) is _get_deserializer(List[BlankNode1])
+
+
 def _make_valid_resp(data):
     res = {
         "@context": [
@@ -530,6 +579,32 @@ def test_list_by_schema(httpx_mock, cells_page1_resp, cells_page2_resp):
     )
 
 
+def test_list_by_schema__prefetch(httpx_mock, cells_page1_resp, cells_page2_resp):
+    url = ReconstructedPatchedCell.get_constrained_url()
+    httpx_mock.add_response(text=cells_page1_resp, url=f"{url}?from=0&size=2&deprecated=false")
+    httpx_mock.add_response(text=cells_page2_resp, url=f"{url}?from=2&size=2&deprecated=false")
+
+    cells = ReconstructedPatchedCell.list_by_schema(page_size=2, prefetch=True)
+
+    assert len(list(cells)) == 3
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_decode_listing():
+    listing = {
+        "_total": 10,
+        "_results": [
+            {"@id": "id1", "@type": "ReconstructedPatchedCell"},
+            {"@id": "id2", "@type": ["nsg:ReconstructedPatchedCell", "prov:Entity"]},
+            {"@id": "id3", "@type": "https://neuroshapes.org/ReconstructedPatchedCell"},
+            {"@id": "id4", "@type": "Entity"},
+            {"@id": "id5"},
+        ],
+    }
+
+    assert _decode_listing(listing, ReconstructedPatchedCell) == (10, ["id1", "id2", "id3"])
+
+
 def test_list_by_sparql(monkeypatch):
 
     with monkeypatch.context() as m:
@@ -543,6 +618,49 @@ def test_list_by_sparql(monkeypatch):
         assert param.get_id().endswith("org/proj/_/fdc9b964-5737-4d58-8d18-cb9af0a1ef38")
 
 
+def test_lazy_init():
+    @attributes({"a": AttrOf(int), "b": AttrOf(str, default=None)})
+    class A(Identifiable):
+        pass
+
+    a = A._lazy_init("foo", "A", rev=2, base="base", org="org", proj="proj")
+
+    assert object.__getattribute__(a, "a") is NotInstantiated
+    assert object.__getattribute__(a, "b") is NotInstantiated
+    assert a._id == "foo"
+    assert a._type == "A"
+    assert a._rev == 2
+    assert object.__getattribute__(a, "_tag") is NotInstantiated
+    assert a._lazy_meta_ == ("base", "org", "proj")
+    assert attr.validators.get_run_validators()
+
+
+def test_lazy_init__validation_never_lost_across_threads():
+    @attributes({"a": AttrOf(int)})
+    class A(Identifiable):
+        pass
+
+    def work(_):
+        lost = 0
+        for i in range(200):
+            A._lazy_init(f"id-{i}")
+            try:
+                A(a="not an int")
+                lost += 1
+            except TypeError:
+                pass
+        return lost
+
+    # switch threads as often as possible to interleave the constructions
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            assert sum(executor.map(work, range(64))) == 0
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+
 def test_instantiate__wout_rev(monkeypatch):
 
     def load_by_id(resource_id, *args, **kwargs):
@@ -722,3 +840,203 @@ def test_Identifiable_clone():
     assert b is not a
     assert isinstance(b, A)
     assert b.get_id() is None
+
+
+def test_from_ids(caplog):
+    @attributes({"a": AttrOf(int)})
+    class A(Identifiable):
+        pass
+
+    def _mock_load_by_id(resource_id, *args, **kwargs):
+        if resource_id == "missing-id":
+            return None
+        return _make_valid_resp({"@id": resource_id, "@type": "A", "a": int(resource_id)})
+
+    ids = [str(i) for i in range(10)] + ["missing-id"]
+    with patch("entity_management.nexus.load_by_id", side_effect=_mock_load_by_id):
+        res = A.from_ids(ids, max_concurrency=3)
+
+    assert [a.a for a in res[:-1]] == list(range(10))
+    assert [a.get_id() for a in res[:-1]] == ids[:-1]
+    assert res[-1] is None
+    assert "1 resources not found: ['missing-id']" in caplog.text
+
+    with patch("entity_management.nexus.load_by_id", side_effect=_mock_load_by_id):
+        res = A.from_ids(["missing-id"], on_no_result=lambda resource_id, **kwargs: resource_id)
+
+    assert res == ["missing-id"]
+
+
+def test_identity_map():
+    @attributes({"a": AttrOf(int)})
+    class A(Identifiable):
+        pass
+
+    @attributes({"ref": AttrOf(A)})
+    class B(Identifiable):
+        pass
+
+    def _mock_load_by_id(resource_id, *args, **kwargs):
+        resource_id = resource_id.split("?")[0]
+        if resource_id == "a-id":
+            return _make_valid_resp({"@id": "a-id", "@type": "A", "a": 1})
+        return _make_valid_resp(
+            {"@id": resource_id, "@type": "B", "ref": {"@id": "a-id", "@type": "A", "_rev": 2}}
+        )
+
+    with patch("entity_management.nexus.load_by_id", side_effect=_mock_load_by_id) as patched:
+        with identity_map() as entities:
+            b1, b2 = B.from_ids(["b1-id", "b2-id"])
+
+            assert b1.ref is b2.ref
+            assert b1.ref.a == b2.ref.a == 1
+            assert patched.call_count == 3
+
+            # the stub was filled when it was loaded, not replaced
+            assert A.from_id("a-id?rev=2") is b1.ref
+            assert B.from_id("b1-id") is b1
+            assert patched.call_count == 3
+
+            # nested contexts share the same map
+            with identity_map() as nested:
+                assert nested is entities
+
+            assert set(entities) == {
+                ("a-id", "2", None),
+                ("b1-id", None, None),
+                ("b2-id", None, None),
+            }
+
+        b1, b2 = B.from_ids(["b1-id", "b2-id"])
+        assert b1.ref is not b2.ref
+        assert b1.ref.a == b2.ref.a == 1
+        assert patched.call_count == 7
+
+
+def test_identity_map__revisions():
+    @attributes({"a": AttrOf(int)})
+    class A(Identifiable):
+        pass
+
+    with identity_map():
+        assert A._lazy_init("a-id", rev=1) is A._lazy_init("a-id?rev=1")
+        assert A._lazy_init("a-id", rev=1) is not A._lazy_init("a-id", rev=2)
+        assert A._lazy_init("a-id", tag="v1") is not A._lazy_init("a-id")
+
+
+def _mock_sparql_pages(ids, queries):
+    def sparql_query(query, **kwargs):
+        queries.append(query)
+        match = re.search(r"LIMIT (\d+)\nOFFSET (\d+)$", query)
+        page_size, page_from = int(match.group(1)), int(match.group(2))
+        page = ids[page_from : page_from + page_size]
+        return {"results": {"bindings": [{"entity": {"value": i}} for i in page]}}
+
+    return sparql_query
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_list_by_sparql__paginated(monkeypatch, prefetch):
+    ids = [f"id-{i:02}" for i in range(10)]
+    queries = []
+    monkeypatch.setattr(nexus, "sparql_query", _mock_sparql_pages(ids, queries))
+
+    params = ModelRuntimeParameters.list_by_model("model-id", page_size=4, prefetch=prefetch)
+
+    first = next(params)
+    assert first.get_id() == "id-00"
+    if prefetch:
+        params._next_page.result()
+    assert len(queries) == (2 if prefetch else 1)
+
+    assert [first.get_id()] + [p.get_id() for p in params] == ids
+    assert len(queries) == 3
+    assert all("ORDER BY ?entity\nLIMIT 4\nOFFSET" in q for q in queries)
+    assert [q[-1] for q in queries] == ["0", "4", "8"]
+
+
+def test_list_by_sparql__eager(monkeypatch):
+    @attributes({"a": AttrOf(int)})
+    class A(Identifiable):
+        pass
+
+    ids = [f"id-{i:02}" for i in range(6)]
+    queries = []
+    es_queries = []
+
+    def es_load_by_ids(resource_ids, **kwargs):
+        es_queries.append(resource_ids)
+        # last id is not indexed
+        return {
+            id_: _make_valid_resp({"@id": id_, "a": int(id_[-2:])}) for id_ in resource_ids[:-1]
+        }
+
+    monkeypatch.setattr(nexus, "sparql_query", _mock_sparql_pages(ids, queries))
+    monkeypatch.setattr(nexus, "es_load_by_ids", es_load_by_ids)
+
+    res = list(_NexusBySparqlIterator(A, "SELECT ?entity", page_size=4, eager=True))
+
+    assert es_queries == [ids[:4], ids[4:]]
+    assert [r.get_id() for r in res] == ids
+
+    with patch(
+        "entity_management.nexus.load_by_id",
+        return_value=_make_valid_resp({"@id": "id-03", "a": 3}),
+    ) as mock_load_by_id:
+        assert res[0].a == 0
+        assert mock_load_by_id.call_count == 0
+        assert res[3].a == 3
+        assert mock_load_by_id.call_count == 1
+
+
+def test_list_by_sparql__eager_resolve_context(monkeypatch):
+    @attributes({"a": AttrOf(int)})
+    class A(Identifiable):
+        pass
+
+    ids = ["id-00", "id-01"]
+
+    def es_load_by_ids(resource_ids, **kwargs):
+        return {
+            id_: _make_valid_resp({"@context": "ctx", "@id": id_, "a": 1}) for id_ in resource_ids
+        }
+
+    monkeypatch.setattr(nexus, "sparql_query", _mock_sparql_pages(ids, []))
+    monkeypatch.setattr(nexus, "es_load_by_ids", es_load_by_ids)
+
+    with patch("entity_management.base.get_resolved_context") as mock_get_resolved_context:
+        list(_NexusBySparqlIterator(A, "SELECT ?entity", page_size=4, eager=True))
+        assert mock_get_resolved_context.call_count == 0
+
+        res = list(
+            _NexusBySparqlIterator(
+                A, "SELECT ?entity", page_size=4, eager=True, resolve_context=True
+            )
+        )
+        assert mock_get_resolved_context.call_count == len(ids)
+        assert [r.a for r in res] == [1, 1]
+
+
+def test_list_by_sparql__full_last_page(monkeypatch):
+    ids = [f"id-{i:02}" for i in range(8)]
+    queries = []
+    monkeypatch.setattr(nexus, "sparql_query", _mock_sparql_pages(ids, queries))
+
+    params = ModelRuntimeParameters.list_by_model("model-id", page_size=4, prefetch=True)
+
+    assert [p.get_id() for p in params] == ids
+    assert [q[-1] for q in queries] == ["0", "4", "8"]
+
+
+def test_list_by_sparql__query_with_limit(monkeypatch):
+    queries = []
+
+    def sparql_query(query, **kwargs):
+        queries.append(query)
+        return {"results": {"bindings": [{"entity": {"value": "id"}}]}}
+
+    monkeypatch.setattr(nexus, "sparql_query", sparql_query)
+
+    query = "SELECT ?entity WHERE { ?entity a nsg:Foo } LIMIT 1"
+    assert [e.get_id() for e in _NexusBySparqlIterator(Identifiable, query, page_size=1)] == ["id"]
+    assert queries == [query]
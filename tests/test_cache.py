@@ -0,0 +1,593 @@
+# pylint: disable=missing-docstring
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import jwt
+import pytest
+
+import entity_management.nexus as nexus
+from entity_management import cache, nexus_async, nexus_files
+from entity_management.state import NexusSession
+from entity_management.util import quote
+
+RESOURCE_ID = "https://bbp.epfl.ch/data/1"
+RESOURCE_URL = f"https://foo/resources/bar/zee/_/{quote(RESOURCE_ID)}"
+
+
+@pytest.fixture
+def resource_cache(tmp_path):
+    cache.configure_resource_cache(enabled=True, path=tmp_path / "cache.sqlite", max_size=1000)
+    yield cache.get_resource_cache()
+    cache.configure_resource_cache(enabled=False)
+
+
+@pytest.mark.parametrize(
+    "url, params, expected",
+    [
+        ("https://foo/a", None, None),
+        ("https://foo/a", {"tag": None, "rev": None}, None),
+        ("https://foo/a", {"rev": 5}, "https://foo/a?rev=5"),
+        ("https://foo/a", {"rev": ["5"]}, "https://foo/a?rev=5"),
+        ("https://foo/a?tag=v1", None, "https://foo/a?tag=v1"),
+        ("https://foo/a", {"tag": "v1", "rev": None, "b": 2}, "https://foo/a?b=2&tag=v1"),
+        ("https://foo/a?b=2", {"tag": "v1"}, "https://foo/a?b=2&tag=v1"),
+    ],
+)
+def test_get_pinned_key(url, params, expected):
+    assert cache.get_pinned_key(url, params) == expected
+
+
+def test_resource_cache(resource_cache):
+    assert resource_cache.get("a") is None
+
+    resource_cache.put("a", b"a" * 400)
+    resource_cache.put("b", b"b" * 400)
+    assert resource_cache.get("a") == b"a" * 400
+    assert resource_cache.size() == 800
+
+    # b is the least recently used
+    resource_cache.put("c", b"c" * 400)
+    assert resource_cache.get("b") is None
+    assert resource_cache.get("a") == b"a" * 400
+    assert resource_cache.get("c") == b"c" * 400
+    assert resource_cache.size() == 800
+
+    # larger than the cache
+    resource_cache.put("d", b"d" * 1001)
+    assert resource_cache.get("d") is None
+
+    resource_cache.clear()
+    assert resource_cache.size() == 0
+
+
+def _token(subject, **claims):
+    return jwt.encode(
+        {"iss": "https://auth", "sub": subject, **claims}, "k" * 32, algorithm="HS256"
+    )
+
+
+def test_resource_cache__identity(resource_cache):
+    resource_cache.put("a", b"a", _token("user"))
+
+    # the same user with a refreshed token
+    assert resource_cache.get("a", _token("user", exp=2**31)) == b"a"
+    assert resource_cache.get("a", _token("other")) is None
+    assert resource_cache.get("a") is None
+    assert resource_cache.get("a", "not-a-jwt") is None
+
+
+def test_load_by_id__pinned_async(httpx_mock, resource_cache):
+    httpx_mock.add_response(method="GET", url=f"{RESOURCE_URL}?rev=3", json={"@id": RESOURCE_ID})
+
+    async def _load():
+        return [
+            await nexus_async.load_by_url(RESOURCE_URL, {"rev": 3}, token="t") for _ in range(2)
+        ]
+
+    assert asyncio.run(_load()) == [{"@id": RESOURCE_ID}] * 2
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_resource_cache__disabled(resource_cache):
+    cache.configure_resource_cache(enabled=False)
+    assert cache.get_resource_cache() is None
+
+
+def _put_entries(path, worker):
+    resource_cache = cache.ResourceCache(path, max_size=10**6)
+    for i in range(50):
+        resource_cache.put(f"{worker}-{i}", b"x" * 10)
+
+
+def test_resource_cache__concurrent_processes(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    processes = [
+        multiprocessing.Process(target=_put_entries, args=(path, worker)) for worker in range(4)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    assert cache.ResourceCache(path, max_size=10**6).size() == 4 * 50 * 10
+
+
+def test_load_by_id__pinned(httpx_mock, resource_cache):
+    httpx_mock.add_response(method="GET", url=f"{RESOURCE_URL}?rev=3", json={"@id": RESOURCE_ID})
+
+    for _ in range(3):
+        res = nexus.load_by_id(f"{RESOURCE_ID}?rev=3", base="https://foo", org="bar", proj="zee")
+        assert res == {"@id": RESOURCE_ID}
+
+    res = nexus.load_by_url(RESOURCE_URL, params={"rev": 3}, stream=True)
+    assert res == b'{"@id":"https://bbp.epfl.ch/data/1"}'
+
+    assert len(httpx_mock.get_requests()) == 1
+
+
+def test_load_by_id__not_pinned(httpx_mock, resource_cache):
+    httpx_mock.add_response(method="GET", url=RESOURCE_URL, json={"@id": RESOURCE_ID})
+    httpx_mock.add_response(method="GET", url=RESOURCE_URL, json={"@id": RESOURCE_ID})
+
+    for _ in range(2):
+        res = nexus.load_by_id(RESOURCE_ID, base="https://foo", org="bar", proj="zee")
+        assert res == {"@id": RESOURCE_ID}
+
+    assert len(httpx_mock.get_requests()) == 2
+    assert resource_cache.size() == 0
+
+
+@pytest.fixture
+def revalidating_cache():
+    cache.configure_revalidating_cache(enabled=True, max_size=1000)
+    yield cache.get_revalidating_cache()
+    cache.configure_revalidating_cache(enabled=False)
+
+
+def _response(status_code, content=b"", headers=None):
+    return httpx.Response(
+        status_code,
+        content=content,
+        headers=headers,
+        request=httpx.Request("GET", "https://foo/a"),
+    )
+
+
+def test_revalidating_cache(revalidating_cache):
+    assert revalidating_cache.get_validation_headers("a") == {}
+
+    response = _response(200, b"a" * 400, {"etag": '"1"', "last-modified": "yesterday"})
+    assert revalidating_cache.get_content("a", response) == b"a" * 400
+    assert revalidating_cache.get_validation_headers("a") == {
+        "if-none-match": '"1"',
+        "if-modified-since": "yesterday",
+    }
+
+    assert revalidating_cache.get_content("a", _response(304)) == b"a" * 400
+    # evicted since the request was sent
+    assert revalidating_cache.get_content("e", _response(304)) is None
+
+    response = _response(200, b"b" * 400, {"etag": '"2"'})
+    assert revalidating_cache.get_content("a", response) == b"b" * 400
+    assert revalidating_cache.get_validation_headers("a") == {"if-none-match": '"2"'}
+
+    # not cached without validators
+    assert revalidating_cache.get_content("b", _response(200, b"b")) == b"b"
+    assert revalidating_cache.get_validation_headers("b") == {}
+
+    # a is the least recently used
+    revalidating_cache.get_content("c", _response(200, b"c" * 400, {"etag": '"1"'}))
+    revalidating_cache.get_content("d", _response(200, b"d" * 400, {"etag": '"1"'}))
+    assert revalidating_cache.get_validation_headers("a") == {}
+    assert revalidating_cache.size() == 800
+
+    assert revalidating_cache.stats == {"hit": 1, "revalidate": 1, "miss": 4}
+
+    with pytest.raises(httpx.HTTPStatusError):
+        revalidating_cache.get_content("c", _response(500))
+
+    revalidating_cache.clear()
+    assert revalidating_cache.size() == 0
+    assert revalidating_cache.stats == {"hit": 0, "revalidate": 0, "miss": 0}
+
+
+def test_load_by_url__revalidated(httpx_mock, revalidating_cache):
+    httpx_mock.add_response(
+        method="GET", url=RESOURCE_URL, json={"_rev": 1}, headers={"etag": '"1"'}
+    )
+    httpx_mock.add_response(
+        method="GET", url=RESOURCE_URL, status_code=304, match_headers={"if-none-match": '"1"'}
+    )
+    httpx_mock.add_response(
+        method="GET",
+        url=RESOURCE_URL,
+        json={"_rev": 2},
+        headers={"etag": '"2"'},
+        match_headers={"if-none-match": '"1"'},
+    )
+
+    assert nexus.load_by_url(RESOURCE_URL) == {"_rev": 1}
+    assert nexus.load_by_url(RESOURCE_URL) == {"_rev": 1}
+    assert nexus.load_by_url(RESOURCE_URL) == {"_rev": 2}
+
+    assert revalidating_cache.stats == {"hit": 1, "revalidate": 1, "miss": 1}
+
+
+def test_load_by_url__revalidated_evicted(httpx_mock, revalidating_cache):
+    httpx_mock.add_response(
+        method="GET", url=RESOURCE_URL, json={"_rev": 1}, headers={"etag": '"1"'}
+    )
+
+    def evicted(request):
+        assert request.headers["if-none-match"] == '"1"'
+        revalidating_cache.clear()
+        return httpx.Response(304)
+
+    httpx_mock.add_callback(evicted, method="GET", url=RESOURCE_URL)
+    httpx_mock.add_response(method="GET", url=RESOURCE_URL, json={"_rev": 1})
+
+    assert nexus.load_by_url(RESOURCE_URL) == {"_rev": 1}
+    assert nexus.load_by_url(RESOURCE_URL) == {"_rev": 1}
+    assert "if-none-match" not in httpx_mock.get_requests()[-1].headers
+
+
+def _digest(content):
+    return {"algorithm": "SHA-256", "value": hashlib.sha256(content).hexdigest()}
+
+
+def _downloader(content, name="f.bin", calls=None):
+    def download(directory):
+        if calls is not None:
+            calls.append(directory)
+        path = os.path.join(directory, name)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    return download
+
+
+@pytest.fixture
+def distribution_cache(tmp_path):
+    cache.configure_distribution_cache(enabled=True, path=tmp_path / "cache", max_size=1000)
+    yield cache.get_distribution_cache()
+    cache.configure_distribution_cache(enabled=False)
+
+
+@pytest.mark.parametrize(
+    "digest, expected",
+    [
+        (None, None),
+        ({"algorithm": "SHA-256", "value": "ABC123"}, "sha256/abc123"),
+        ({"value": "abc123"}, "sha256/abc123"),
+        ({"algorithm": "MD5", "value": "abc123"}, "md5/abc123"),
+        ({"algorithm": "SHA-256", "value": "../../etc"}, None),
+        ({"algorithm": "unknown", "value": "abc123"}, None),
+        ({"algorithm": "SHAKE-128", "value": "abc123"}, None),
+    ],
+)
+def test_distribution_cache__get_key(digest, expected):
+    assert cache.DistributionCache.get_key(digest) == expected
+
+
+def test_distribution_cache__materialize(tmp_path, distribution_cache):
+    content = b"a" * 100
+    calls = []
+    for i in range(3):
+        path = tmp_path / f"out{i}"
+        path.mkdir()
+        res = distribution_cache.materialize(
+            _digest(content), str(path), _downloader(content, calls=calls)
+        )
+        assert res == str(path / "f.bin")
+        assert (path / "f.bin").read_bytes() == content
+
+    assert len(calls) == 1
+    assert distribution_cache.size() == 100
+
+    res = distribution_cache.materialize(
+        _digest(content), str(tmp_path), _downloader(content, calls=calls), file_name="g.bin"
+    )
+    assert res == str(tmp_path / "g.bin")
+    assert (tmp_path / "g.bin").read_bytes() == content
+    # an existing file is replaced
+    distribution_cache.materialize(_digest(content), str(tmp_path), None, file_name="g.bin")
+
+    with distribution_cache.open(_digest(content), None) as f:
+        assert f.read() == content
+    assert len(calls) == 1
+
+    distribution_cache.clear()
+    assert distribution_cache.size() == 0
+
+
+def test_distribution_cache__materialize_shares_storage(tmp_path, monkeypatch, distribution_cache):
+    monkeypatch.setattr(cache, "_reflink", lambda source, target: False)
+    content = b"a" * 100
+    distribution_cache.materialize(_digest(content), str(tmp_path), _downloader(content))
+
+    (cached,) = (tmp_path / "cache" / "files").glob("*/*/f.bin")
+    assert cached.stat().st_mode & 0o777 == 0o444
+    assert (tmp_path / "f.bin").stat().st_ino == cached.stat().st_ino
+
+    # on another file system
+    def link(source, target):
+        raise OSError(18, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    distribution_cache.materialize(_digest(content), str(tmp_path), None, file_name="g.bin")
+    assert (tmp_path / "g.bin").read_bytes() == content
+    assert (tmp_path / "g.bin").stat().st_ino != cached.stat().st_ino
+
+
+def test_distribution_cache__failed_download(tmp_path, distribution_cache):
+    def download(directory):
+        with open(os.path.join(directory, "f.bin.part"), "wb") as f:
+            f.write(b"partial")
+        raise OSError("interrupted")
+
+    content = b"a" * 100
+    with pytest.raises(OSError, match="interrupted"):
+        distribution_cache.materialize(_digest(content), str(tmp_path), download)
+    assert distribution_cache.size() == 0
+
+    # the next download cleans up the leftovers
+    distribution_cache.materialize(_digest(content), str(tmp_path), _downloader(content))
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert [p.name for p in (tmp_path / "cache" / "files").glob("*/*/*")] == ["f.bin"]
+
+
+def test_distribution_cache__evict(tmp_path, distribution_cache):
+    contents = [bytes([i]) * 400 for i in range(4)]
+    for content in contents[:2]:
+        distribution_cache.materialize(_digest(content), str(tmp_path), _downloader(content))
+        time.sleep(0.01)
+    # the first file is the most recently used
+    distribution_cache.materialize(_digest(contents[0]), str(tmp_path), None)
+    time.sleep(0.01)
+
+    distribution_cache.materialize(_digest(contents[2]), str(tmp_path), _downloader(contents[2]))
+    assert distribution_cache.size() == 800
+    with distribution_cache.open(_digest(contents[0]), None) as f:
+        assert f.read() == contents[0]
+    with pytest.raises(TypeError):
+        # not cached anymore, the download is called
+        distribution_cache.open(_digest(contents[1]), None)
+
+    # a file being used by another process is not evicted
+    key = cache.DistributionCache.get_key(_digest(contents[2]))
+    with distribution_cache._lock(key):  # pylint: disable=protected-access
+        distribution_cache.materialize(
+            _digest(contents[3]), str(tmp_path), _downloader(contents[3])
+        )
+    distribution_cache.materialize(_digest(contents[2]), str(tmp_path), None)
+    assert distribution_cache.size() == 800
+
+
+def _materialize_shared(cache_path, path, content, downloads_path):
+    def download(directory):
+        with open(downloads_path, "a", encoding="utf-8") as f:
+            f.write(f"{os.getpid()}\n")
+        time.sleep(0.2)
+        return _downloader(content)(directory)
+
+    distribution_cache = cache.DistributionCache(cache_path, max_size=10**6)
+    os.makedirs(path)
+    distribution_cache.materialize(_digest(content), path, download)
+
+
+def test_distribution_cache__concurrent_processes(tmp_path):
+    content = b"a" * 1000
+    downloads_path = tmp_path / "downloads.txt"
+    processes = [
+        multiprocessing.Process(
+            target=_materialize_shared,
+            args=(tmp_path / "cache", str(tmp_path / str(i)), content, downloads_path),
+        )
+        for i in range(8)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    # one process downloaded the file, the others waited for it
+    assert len(downloads_path.read_text(encoding="utf-8").splitlines()) == 1
+    for i in range(8):
+        assert (tmp_path / str(i) / "f.bin").read_bytes() == content
+
+
+def test_download_file__distribution_cache(tmp_path, httpx_mock, distribution_cache):
+    content = json.dumps({"a": 1}).encode()
+    httpx_mock.add_response(
+        method="GET",
+        url="https://foo/files/bar/zee/1?tag=&rev=",
+        content=content,
+        headers={"content-disposition": 'attachment; filename="=?UTF-8?B?Zi5qc29u?="'},
+    )
+
+    for i in range(2):
+        path = tmp_path / str(i)
+        path.mkdir()
+        res = nexus.download_file(
+            "https://foo/files/bar/zee/1", str(path), digest=_digest(content), token="t"
+        )
+        assert res == str(path / "f.json")
+        assert (path / "f.json").read_bytes() == content
+
+    res = nexus.file_as_dict("https://foo/files/bar/zee/1", digest=_digest(content), token="t")
+    assert res == {"a": 1}
+    assert len(httpx_mock.get_requests()) == 1
+
+
+@pytest.fixture
+def file_metadata_cache(monkeypatch):
+    file_metadata_cache = cache.FileMetadataCache(max_entries=3, ttl=60)
+    monkeypatch.setattr(cache, "_FILE_METADATA_CACHE", file_metadata_cache)
+    return file_metadata_cache
+
+
+def test_file_metadata_cache(monkeypatch, file_metadata_cache):
+    loads = []
+
+    def load(metadata):
+        loads.append(metadata)
+        return {"_rev": metadata}
+
+    assert file_metadata_cache.get("https://foo/a", lambda: load(1)) == {"_rev": 1}
+    metadata = file_metadata_cache.get("https://foo/a", lambda: load(2))
+    assert metadata == {"_rev": 1}
+    # the cached metadata is copied
+    metadata["_rev"] = 3
+    assert file_metadata_cache.get("https://foo/a", lambda: load(2)) == {"_rev": 1}
+
+    file_metadata_cache.get("https://foo/a?rev=1", lambda: load(1))
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    # the latest revision expired, not the pinned one
+    assert file_metadata_cache.get("https://foo/a", lambda: load(2)) == {"_rev": 2}
+    assert file_metadata_cache.get("https://foo/a?rev=1", lambda: load(2)) == {"_rev": 1}
+    assert loads == [1, 1, 2]
+
+    # the latest revision is the least recently used
+    file_metadata_cache.get("https://foo/b?tag=v1", lambda: load(1))
+    file_metadata_cache.get("https://foo/c?tag=v1", lambda: load(1))
+    assert file_metadata_cache.size() == 3
+    assert file_metadata_cache.get("https://foo/a", lambda: load(3)) == {"_rev": 3}
+    assert file_metadata_cache.stats == {"hit": 3, "miss": 6}
+
+    with pytest.raises(ValueError):
+        file_metadata_cache.get("https://foo/d", lambda: int("d"))
+
+    file_metadata_cache.clear()
+    assert file_metadata_cache.size() == 0
+    assert file_metadata_cache.stats == {"hit": 0, "miss": 0}
+
+
+def test_file_metadata_cache__latest_not_cached():
+    file_metadata_cache = cache.FileMetadataCache(max_entries=3, ttl=0)
+
+    assert file_metadata_cache.get("https://foo/a", lambda: {"_rev": 1}) == {"_rev": 1}
+    assert file_metadata_cache.get("https://foo/a", lambda: {"_rev": 2}) == {"_rev": 2}
+    assert file_metadata_cache.get("https://foo/a?rev=1", lambda: {"_rev": 1}) == {"_rev": 1}
+    assert file_metadata_cache.get("https://foo/a?rev=1", lambda: {"_rev": 2}) == {"_rev": 1}
+    assert file_metadata_cache.size() == 1
+
+
+def test_file_metadata_cache__token(file_metadata_cache):
+    assert file_metadata_cache.get("https://foo/a", lambda: {"_rev": 1}, token="t1") == {"_rev": 1}
+    # another identity doesn't get the cached metadata
+    assert file_metadata_cache.get("https://foo/a", lambda: {"_rev": 2}, token="t2") == {"_rev": 2}
+    assert file_metadata_cache.get("https://foo/a", lambda: {"_rev": 3}, token="t1") == {"_rev": 1}
+
+
+def test_file_metadata_cache__invalidate(file_metadata_cache):
+    file_metadata_cache.get("https://foo/a", lambda: {"_rev": 1}, token="t1")
+    file_metadata_cache.get("https://foo/a", lambda: {"_rev": 1}, token="t2")
+    file_metadata_cache.get("https://foo/a?rev=1", lambda: {"_rev": 1}, token="t1")
+
+    file_metadata_cache.invalidate("https://foo/a")
+
+    assert file_metadata_cache.size() == 1
+    assert file_metadata_cache.get("https://foo/a", lambda: {"_rev": 2}, token="t2") == {"_rev": 2}
+    assert file_metadata_cache.get("https://foo/a?rev=1", lambda: {"_rev": 2}, token="t1") == {
+        "_rev": 1
+    }
+
+
+def test_file_metadata_cache__concurrent(file_metadata_cache):
+    started = threading.Event()
+    release = threading.Event()
+    loads = []
+
+    def load():
+        loads.append(1)
+        started.set()
+        release.wait(timeout=5)
+        return {"_rev": 1}
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [
+            executor.submit(file_metadata_cache.get, "https://foo/a", load) for _ in range(8)
+        ]
+        started.wait(timeout=5)
+        time.sleep(0.1)
+        release.set()
+        assert [future.result() for future in futures] == [{"_rev": 1}] * 8
+    assert loads == [1]
+
+
+def test_get_file_metadata(httpx_mock, file_metadata_cache):
+    url = "https://foo/files/bar/zee/1"
+    metadata = {"_rev": 2, "_location": "file:///gpfs/a%20b.json", "_filename": "a b.json"}
+    httpx_mock.add_response(method="GET", url=f"{url}?tag=&rev=", json=metadata)
+    httpx_mock.add_response(method="GET", url=f"{url}?tag=&rev=1", json={**metadata, "_rev": 1})
+
+    assert nexus.get_file_rev(url, token="t") == 2
+    assert nexus.get_file_location(url, token="t") == "file:///gpfs/a%20b.json"
+    assert nexus.get_unquoted_uri_path(url, token="t") == "/gpfs/a b.json"
+    assert nexus.get_file_name(url, token="t") == "a b.json"
+    assert nexus.get_file_rev(url, rev=1, token="t") == 1
+    assert nexus.get_file_metadata(url, rev=1, token="t") == {**metadata, "_rev": 1}
+    assert len(httpx_mock.get_requests()) == 2
+
+    httpx_mock.add_response(method="GET", url=f"{url}?tag=&rev=", json=metadata)
+    with NexusSession(file_metadata_cache=cache.FileMetadataCache(10, 60)).activate():
+        assert nexus.get_file_rev(url, token="t") == 2
+    assert len(httpx_mock.get_requests()) == 3
+
+
+def test_get_file_metadata__updated_file(httpx_mock, file_metadata_cache):
+    url = "https://foo/files/bar/zee/1"
+    httpx_mock.add_response(method="GET", url=f"{url}?tag=&rev=", json={"_rev": 1})
+    httpx_mock.add_response(method="PUT", url=f"{url}?rev=1&storage=", json={"_rev": 2})
+    httpx_mock.add_response(method="GET", url=f"{url}?tag=&rev=", json={"_rev": 2})
+
+    rev = nexus.get_file_rev(url, token="t")
+    nexus.upload_file(
+        "a.json", b"{}", "application/json", "1", rev=rev, base="https://foo", org="bar", proj="zee"
+    )
+
+    assert nexus.get_file_rev(url, token="t") == 2
+
+
+def test_get_file_metadata__disabled(httpx_mock, monkeypatch):
+    monkeypatch.setitem(cache._FILE_METADATA_CACHE_OPTIONS, "enabled", False)
+    monkeypatch.setattr(cache, "_FILE_METADATA_CACHE", None)
+    url = "https://foo/files/bar/zee/1"
+    for _ in range(2):
+        httpx_mock.add_response(
+            method="GET", url=f"{url}?tag=&rev=", json={"_rev": 2, "_filename": "a.json"}
+        )
+
+    assert nexus.get_file_rev(url, token="t") == 2
+    assert nexus.get_file_name(url, token="t") == "a.json"
+    assert len(httpx_mock.get_requests()) == 2
+
+
+def test_get_files_metadata(monkeypatch, file_metadata_cache):
+    urls = [f"https://foo/files/bar/zee/{i % 50}" for i in range(100)]
+    requests = []
+
+    def handler(request):
+        url = str(request.url.copy_with(query=None))
+        requests.append(url)
+        return httpx.Response(200, json={"@id": url, "_rev": 1})
+
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    monkeypatch.setattr(nexus_files, "get_http_client", lambda: client)
+    file_metadata_cache.max_entries = 100
+
+    res = nexus.get_files_metadata(urls, max_concurrency=8, token="t")
+
+    assert res == [{"@id": url, "_rev": 1} for url in urls]
+    assert sorted(requests) == sorted(set(urls))
@@ -1,13 +1,19 @@
 # pylint: disable=missing-docstring,no-member
+import functools
+import hashlib
 import json
+import mmap
 import tempfile
+from io import BytesIO
 
+import httpx
 import pytest
+from util import TEST_DATA_DIR
 
+import entity_management.core as core
 import entity_management.nexus as nexus
-from entity_management.core import DataDownload, WorkflowExecution, Entity, Activity, Person
-
-from util import TEST_DATA_DIR
+from entity_management import nexus_files, transfer
+from entity_management.core import Activity, DataDownload, Entity, Person, WorkflowExecution
 
 
 @pytest.fixture(name="workflow_resp", scope="session")
@@ -170,7 +176,7 @@ def fixture_entity_data_download_resp():
 
 def test_data_download_get_location(monkeypatch, entity_data_download_resp, file_link_resp):
     monkeypatch.setattr(nexus, "load_by_url", lambda *a, **b: entity_data_download_resp)
-    monkeypatch.setattr(nexus, "_get_file_metadata", lambda *a, **b: file_link_resp)
+    monkeypatch.setattr(nexus_files, "_get_file_metadata", lambda *a, **b: file_link_resp)
 
     entity = Entity.from_id("id")
     assert (
@@ -181,7 +187,7 @@ def test_data_download_get_location(monkeypatch, entity_data_download_resp, file
 
 def test_data_download_get_location_path(monkeypatch, entity_data_download_resp, file_link_resp):
     monkeypatch.setattr(nexus, "load_by_url", lambda *a, **b: entity_data_download_resp)
-    monkeypatch.setattr(nexus, "_get_file_metadata", lambda *a, **b: file_link_resp)
+    monkeypatch.setattr(nexus_files, "_get_file_metadata", lambda *a, **b: file_link_resp)
 
     entity = Entity.from_id("id")
     assert entity.distribution.get_location_path() == "/bucket/relative/path/to/file.zip"
@@ -207,3 +213,221 @@ def test_data_download_get_url_as_path__raises(monkeypatch, entity_data_download
 
     with pytest.raises(AssertionError, match=r"URL 'https://non-file-uri' is not a file URI."):
         entity.distribution.get_url_as_path()
+
+
+def _local_file(monkeypatch, tmp_path, content):
+    path = tmp_path / "file.json"
+    path.write_bytes(content)
+    monkeypatch.setattr(nexus, "get_file_location", lambda *a, **b: path.as_uri())
+    monkeypatch.setattr(nexus, "open_file", lambda *a, **b: pytest.fail("downloaded"))
+    monkeypatch.setattr(nexus, "file_as_dict", lambda *a, **b: pytest.fail("downloaded"))
+    return path
+
+
+def test_get_local_path(tmp_path, caplog):
+    path = tmp_path / "file"
+    path.write_bytes(b"data")
+
+    assert transfer.get_local_path(path.as_uri()) == str(path)
+    assert transfer.get_local_path(path.as_uri(), 4) == str(path)
+    assert transfer.get_local_path(path.as_uri(), 5) is None
+    assert "differs from its size in nexus" in caplog.text
+    assert transfer.get_local_path((tmp_path / "missing").as_uri()) is None
+    assert transfer.get_local_path(tmp_path.as_uri()) is None
+    assert transfer.get_local_path("https://foo/file") is None
+    assert transfer.get_local_path(None) is None
+
+
+def test_read_local_file(tmp_path):
+    path = tmp_path / "file"
+    path.write_bytes(b"data")
+
+    assert transfer.read_local_file(path) == b"data"
+    with transfer.read_local_file(path, mmap_threshold=4) as content:
+        assert isinstance(content, mmap.mmap)
+        assert content[:] == b"data"
+
+    path.write_bytes(b"")
+    assert transfer.read_local_file(path, mmap_threshold=0) == b""
+
+
+def test_data_download_read__local(monkeypatch, tmp_path):
+    content = b'{"a": [1, 2]}'
+    _local_file(monkeypatch, tmp_path, content)
+    distribution = DataDownload(
+        contentUrl="https://foo/file",
+        contentSize={"unitCode": "bytes", "value": len(content)},
+        encodingFormat="application/json",
+    )
+
+    with distribution.open() as f:
+        assert f.read() == content
+    assert distribution.read() == content
+    assert distribution.as_dict() == {"a": [1, 2]}
+
+    # memory map all the files
+    monkeypatch.setattr(
+        transfer, "read_local_file", functools.partial(transfer.read_local_file, mmap_threshold=1)
+    )
+    with distribution.read() as data:
+        assert isinstance(data, mmap.mmap)
+        assert data[:] == content
+    assert distribution.as_dict() == {"a": [1, 2]}
+
+
+def test_data_download_read__http_fallback(monkeypatch, tmp_path):
+    content = b'{"a": [1, 2]}'
+    _local_file(monkeypatch, tmp_path, content)
+    monkeypatch.setattr(nexus, "open_file", lambda *a, **b: BytesIO(content))
+    monkeypatch.setattr(nexus, "file_as_dict", lambda *a, **b: {"a": [1, 2]})
+
+    # not the size of the file in nexus
+    distribution = DataDownload(
+        contentUrl="https://foo/file",
+        contentSize={"unitCode": "bytes", "value": 1},
+        encodingFormat="application/json",
+    )
+    with distribution.open() as f:
+        assert f.read() == content
+    assert distribution.read() == content
+    assert distribution.as_dict() == {"a": [1, 2]}
+    with pytest.raises(ValueError, match="Unsupported mode"):
+        distribution.open("r")
+
+    # not on a gpfs storage
+    monkeypatch.setattr(nexus, "get_file_location", lambda *a, **b: "https://s3/file")
+    distribution = DataDownload(contentUrl="https://foo/file", encodingFormat="application/json")
+    assert distribution.read() == content
+    assert distribution.as_dict() == {"a": [1, 2]}
+
+    # disabled
+    monkeypatch.setattr(core, "LOCAL_FILES", False)
+    monkeypatch.setattr(nexus, "get_file_location", lambda *a, **b: pytest.fail("located"))
+    assert distribution.read() == content
+
+
+def test_data_download_read__location_not_found(monkeypatch, tmp_path):
+    content = b'{"a": [1, 2]}'
+    path = _local_file(monkeypatch, tmp_path, content)
+    monkeypatch.setattr(nexus, "open_file", lambda *a, **b: BytesIO(content))
+    monkeypatch.setattr(nexus, "file_as_dict", lambda *a, **b: {"a": [1, 2]})
+
+    def get_file_location(*_, **__):
+        request = httpx.Request("GET", "https://foo/file")
+        raise httpx.HTTPStatusError(
+            "Forbidden", request=request, response=httpx.Response(403, request=request)
+        )
+
+    monkeypatch.setattr(nexus, "get_file_location", get_file_location)
+    distribution = DataDownload(contentUrl="https://foo/file", encodingFormat="application/json")
+    assert distribution.read() == content
+    assert distribution.as_dict() == {"a": [1, 2]}
+
+    # the location of the distribution is read locally without being requested
+    monkeypatch.setattr(nexus, "open_file", lambda *a, **b: pytest.fail("downloaded"))
+    monkeypatch.setattr(nexus, "file_as_dict", lambda *a, **b: pytest.fail("downloaded"))
+    distribution = DataDownload(
+        contentUrl="https://foo/file",
+        encodingFormat="application/json",
+        atLocation={"location": path.as_uri()},
+    )
+    assert distribution.read() == content
+    assert distribution.as_dict() == {"a": [1, 2]}
+
+
+def test_data_download_download_all(monkeypatch, tmp_path):
+    calls = []
+
+    def download_files(files, path, **kwargs):
+        calls.append((files, path, kwargs))
+        return {url: f"{path}/{url}" for url, _ in files}
+
+    monkeypatch.setattr(nexus, "download_files", download_files)
+    digest = {"algorithm": "SHA-256", "value": "abc"}
+    items = [
+        DataDownload(contentUrl="a", digest=digest),
+        Entity(
+            name="e", distribution=[DataDownload(contentUrl="b"), DataDownload(url="file:///c")]
+        ),
+        Entity(name="f", distribution=DataDownload(contentUrl="d")),
+        Entity(name="g"),
+    ]
+
+    res = DataDownload.download_all(items, str(tmp_path), max_concurrency=4, use_auth="t")
+
+    assert res == {url: f"{tmp_path}/{url}" for url in "abd"}
+    ((files, path, kwargs),) = calls
+    assert files == [("a", digest), ("b", None), ("d", None)]
+    assert path == str(tmp_path)
+    assert kwargs["max_concurrency"] == 4
+    assert kwargs["token"] == "t"
+
+
+def test_data_download_from_files(monkeypatch, tmp_path, file_resp):
+    calls = []
+
+    def upload_files(files, content_type, **kwargs):
+        calls.append((files, content_type, kwargs))
+        return [{**file_resp, "_filename": name} for name, *_ in files]
+
+    monkeypatch.setattr(nexus, "upload_files", upload_files)
+    buffer = BytesIO(b"data")
+
+    res = DataDownload.from_files(
+        [tmp_path / "a.txt", str(tmp_path / "b.txt"), ("c.txt", buffer, "text/plain")],
+        skip_existing=True,
+        use_auth="t",
+    )
+
+    assert [r.name for r in res] == ["a.txt", "b.txt", "c.txt"]
+    assert res[0].get_id() == file_resp["@id"]
+    assert res[0].contentUrl == file_resp["_self"]
+    ((files, content_type, kwargs),) = calls
+    assert files[0] == ("a.txt", tmp_path / "a.txt")
+    assert files[1] == ("b.txt", str(tmp_path / "b.txt"))
+    assert files[2] == ("c.txt", buffer, "text/plain")
+    assert content_type == "application/octet-stream"
+    assert kwargs["skip_existing"]
+    assert kwargs["token"] == "t"
+
+
+def test_data_download_from_json_str(httpx_mock, file_resp):
+    json_str = '{"a": "\u00e9"}'
+    digest = hashlib.sha256(json_str.encode()).hexdigest()
+    httpx_mock.add_response(
+        method="POST",
+        url="https://foo/files/bar/zee?storage=",
+        json={**file_resp, "_digest": {"_algorithm": "SHA-256", "_value": digest}},
+    )
+
+    res = DataDownload.from_json_str(
+        json_str, name="a.json", base="https://foo", org="bar", proj="zee", use_auth="t"
+    )
+
+    assert res.digest["value"] == digest
+    assert json_str.encode() in httpx_mock.get_requests()[0].read()
+
+
+def test_data_download_link_files(monkeypatch, tmp_path, file_resp):
+    calls = []
+
+    def link_files(files, content_type, **kwargs):
+        calls.append((files, content_type, kwargs))
+        return [{**file_resp, "_filename": name} for name, *_ in files]
+
+    monkeypatch.setattr(nexus, "link_files", link_files)
+
+    res = DataDownload.link_files(
+        [tmp_path / "a.h5", "/gpfs/b.h5", ("c", "/gpfs/c.json", "application/json")],
+        journal=str(tmp_path / "journal.jsonl"),
+    )
+
+    assert [r.name for r in res] == ["a.h5", "b.h5", "c"]
+    ((files, content_type, kwargs),) = calls
+    assert files == [
+        ("a.h5", str(tmp_path / "a.h5")),
+        ("b.h5", "/gpfs/b.h5"),
+        ("c", "/gpfs/c.json", "application/json"),
+    ]
+    assert content_type is None
+    assert kwargs["journal"] == str(tmp_path / "journal.jsonl")
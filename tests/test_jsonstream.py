@@ -0,0 +1,82 @@
+# pylint: disable=missing-docstring
+import json
+
+import pytest
+
+from entity_management import jsonstream
+
+DOC = {
+    "a": [1, 2.5, 'x\\"y}]', {"b": None}, []],
+    "hasPart": {"L1": {"e": [True, False]}, 'L2 "q': "s", "empty": {}},
+    "n": -12e3,
+    "a/b": {"~": 1},
+}
+
+
+def _chunks(data, size):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 64, 10000])
+def test_iter_items(size):
+    chunks = _chunks(json.dumps(DOC, indent=2).encode(), size)
+
+    assert dict(jsonstream.iter_items(chunks)) == DOC
+    assert list(jsonstream.iter_items(chunks, "/a")) == DOC["a"]
+    assert list(jsonstream.iter_items(chunks, "/a/4")) == []
+    assert dict(jsonstream.iter_items(chunks, "/hasPart")) == DOC["hasPart"]
+    assert dict(jsonstream.iter_items(chunks, "/hasPart/empty")) == {}
+
+
+@pytest.mark.parametrize("size", [1, 3, 10000])
+def test_load(size):
+    chunks = _chunks(json.dumps(DOC).encode(), size)
+
+    assert jsonstream.load(chunks) == DOC
+    assert jsonstream.load(chunks, "/a/3/b") is None
+    assert jsonstream.load(chunks, "/a~1b/~0") == 1
+    assert jsonstream.load(chunks, "/n") == -12e3
+    assert jsonstream.load([b"42"]) == 42
+
+
+def test_iter_items__lazy():
+    def chunks():
+        yield b'[{"a": 1},'
+        yield b' {"a": 2}'
+        raise AssertionError("read too far")
+
+    items = jsonstream.iter_items(chunks())
+    assert next(items) == {"a": 1}
+
+
+def test_iter_items__skipped_values_not_kept():
+    reader = jsonstream._Reader(_chunks(json.dumps({"a": ["x" * 100] * 1000, "b": 1}).encode(), 64))
+    for key in reader.iter_members():
+        if key == "a":
+            reader.read_value(keep=False)
+            assert len(reader._buffer) < 200
+        else:
+            assert reader.read_value() == b"1"
+
+
+@pytest.mark.parametrize(
+    "data, pointer, error",
+    [
+        (b'{"a": 1}', "/b", KeyError),
+        (b"[1, 2]", "/2", KeyError),
+        (b'{"a": 1}', "a", ValueError),
+        (b'{"a": 1}', "/a", ValueError),
+        (b'{"a": [1, 2}', "/a", ValueError),
+        (b'{"a": "x', "", ValueError),
+        (b'{"a": 1', "", ValueError),
+    ],
+)
+def test_iter_items__errors(data, pointer, error):
+    with pytest.raises(error):
+        list(jsonstream.iter_items(_chunks(data, 3), pointer))
+
+
+def test_loads():
+    assert jsonstream.loads(b'{"a": [1, "b"]}') == {"a": [1, "b"]}
+    # not supported by orjson
+    assert jsonstream.loads(b"[1, Infinity]") == [1, float("inf")]
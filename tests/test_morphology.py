@@ -1,4 +1,5 @@
 # pylint: disable=missing-docstring,no-member
+import hashlib
 import json
 
 from pytest_httpx import IteratorStream
@@ -54,7 +55,8 @@ CELL_RESPONSE = {
         "contentUrl": FILE_URL,
         "digest": {
             "algorithm": "SHA-256",
-            "value": "1123f4816beea40352612374a1ac5b8bf4fa515a2f98af9793c6f83d2c8080d6",
+            # digest of the file served by test_reconstructed_patched_cell
+            "value": hashlib.sha256(json.dumps(FILE_RESPONSE).encode("utf-8")).hexdigest(),
         },
         "encodingFormat": "application/octet-stream",
         "name": "morphology_file_name.asc",
@@ -1,14 +1,38 @@
 # pylint: disable=missing-docstring,no-member,import-outside-toplevel
+import base64
+import functools
+import hashlib
+import io
 import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import create_autospec, patch
+from urllib.parse import unquote
 
 import httpx
 import pytest
 from pytest_httpx import IteratorStream
-from unittest.mock import create_autospec, patch
 
 import entity_management.nexus as nexus
-from entity_management.state import set_token, get_token, has_offline_token, refresh_token
+from entity_management import (
+    nexus_batch,
+    nexus_client,
+    nexus_files,
+    nexus_query,
+    retry,
+    transfer,
+)
+from entity_management.exception import DigestMismatchError
 from entity_management.settings import NSG
+from entity_management.state import (
+    NexusSession,
+    get_token,
+    has_offline_token,
+    refresh_token,
+    set_token,
+)
 from entity_management.util import quote
 
 FILE_NAME = "myfile"
@@ -49,8 +73,8 @@ def test_nexus_wrapper_with_http_error_401_and_offline_token(monkeypatch, httpx_
     mock_has_offline_token = create_autospec(has_offline_token, return_value=True)
     mock_refresh_token = create_autospec(refresh_token, return_value="12345")
 
-    monkeypatch.setattr(nexus, "has_offline_token", mock_has_offline_token)
-    monkeypatch.setattr(nexus, "refresh_token", mock_refresh_token)
+    monkeypatch.setattr(nexus_client, "has_offline_token", mock_has_offline_token)
+    monkeypatch.setattr(nexus_client, "refresh_token", mock_refresh_token)
 
     httpx_mock.add_response(status_code=401)
     httpx_mock.add_response(status_code=200)
@@ -81,8 +105,8 @@ def test_nexus_wrapper_with_http_error_401_nested(monkeypatch, httpx_mock, caplo
     mock_has_offline_token = create_autospec(has_offline_token, return_value=True)
     mock_refresh_token = create_autospec(refresh_token, return_value="12345")
 
-    monkeypatch.setattr(nexus, "has_offline_token", mock_has_offline_token)
-    monkeypatch.setattr(nexus, "refresh_token", mock_refresh_token)
+    monkeypatch.setattr(nexus_client, "has_offline_token", mock_has_offline_token)
+    monkeypatch.setattr(nexus_client, "refresh_token", mock_refresh_token)
 
     httpx_mock.add_response(status_code=401)
     httpx_mock.add_response(status_code=401)
@@ -115,8 +139,8 @@ def test_nexus_wrapper_with_http_error_404(monkeypatch, httpx_mock, caplog):
     mock_has_offline_token = create_autospec(has_offline_token, return_value=True)
     mock_refresh_token = create_autospec(refresh_token, return_value="12345")
 
-    monkeypatch.setattr(nexus, "has_offline_token", mock_has_offline_token)
-    monkeypatch.setattr(nexus, "refresh_token", mock_refresh_token)
+    monkeypatch.setattr(nexus_client, "has_offline_token", mock_has_offline_token)
+    monkeypatch.setattr(nexus_client, "refresh_token", mock_refresh_token)
 
     httpx_mock.add_response(status_code=404)
 
@@ -179,6 +203,580 @@ def test_download_file_with_name(tmp_path, httpx_mock):
     assert expected_path.read_bytes() == stream
 
 
+class RangeFiles:
+    """Mock transport handler serving files with range requests, failing on demand."""
+
+    def __init__(self, content, fail_at=None):
+        self.content = content
+        self.fail_at = fail_at  # offset of the content at which the first request fails
+        self.etag = '"1"'
+        self.ranges = []
+
+    def __call__(self, request):
+        headers = {
+            "accept-ranges": "bytes",
+            "content-disposition": 'attachment; filename="=?UTF-8?B?Zi5iaW4=?="',
+            "etag": self.etag,
+        }
+        start, end = 0, len(self.content)
+        status_code = 200
+        if "range" in request.headers and request.headers.get("if-range", self.etag) == self.etag:
+            first, last = request.headers["range"][len("bytes=") :].split("-")
+            start, end = int(first), min(int(last) + 1 if last else end, end)
+            if start >= len(self.content):
+                return httpx.Response(416, headers={"content-range": f"bytes */{end}"})
+            status_code = 206
+            headers["content-range"] = f"bytes {start}-{end - 1}/{len(self.content)}"
+        self.ranges.append((start, end))
+        headers["content-length"] = str(end - start)
+
+        def stream():
+            for i in range(start, end, 100):
+                if self.fail_at is not None and i <= self.fail_at < i + 100:
+                    self.fail_at = None
+                    raise httpx.ReadError("connection reset")
+                yield self.content[i : min(i + 100, end)]
+
+        return httpx.Response(status_code, headers=headers, content=stream())
+
+
+def _use_client(monkeypatch, client):
+    # the files are accessed by nexus_files and nexus_batch, the queries are sent by nexus_query
+    for module in (nexus_batch, nexus_files, nexus_query):
+        monkeypatch.setattr(module, "get_http_client", lambda: client)
+
+
+@pytest.fixture
+def range_files(monkeypatch):
+    content = bytes(range(256)) * 40
+
+    def serve(fail_at=None):
+        handler = RangeFiles(content, fail_at)
+        client = httpx.Client(transport=httpx.MockTransport(handler))
+        _use_client(monkeypatch, client)
+        return handler
+
+    monkeypatch.setattr(retry, "_RETRY_POLICY", retry.RetryPolicy(max_retries=3, backoff=0))
+    return content, serve
+
+
+def _sha256(content):
+    return {"algorithm": "SHA-256", "value": hashlib.sha256(content).hexdigest()}
+
+
+def test_download_file__digest(tmp_path, range_files):
+    content, serve = range_files
+    serve()
+
+    file_path = nexus.download_file(FILE_URL, str(tmp_path), digest=_sha256(content), token="t")
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert file_path == str(tmp_path / "f.bin")
+
+    with pytest.raises(DigestMismatchError):
+        nexus.download_file(FILE_URL, str(tmp_path), "g.bin", digest=_sha256(b"x"), token="t")
+    assert not list(tmp_path.glob("g.bin*"))
+
+
+@pytest.mark.parametrize("file_name", [None, "f.bin"])
+def test_download_file__resume(tmp_path, range_files, file_name):
+    content, serve = range_files
+    (tmp_path / "f.bin.part").write_bytes(content[:1234])
+    handler = serve()
+
+    nexus.download_file(
+        FILE_URL, str(tmp_path), file_name, digest=_sha256(content), max_parallel=1, token="t"
+    )
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert not (tmp_path / "f.bin.part").exists()
+    assert handler.ranges[-1] == (1234, len(content))
+
+
+def test_download_file__resume_without_validator(tmp_path, range_files):
+    content, serve = range_files
+    (tmp_path / "f.bin.part").write_bytes(b"x" * 1234)
+    handler = serve()
+
+    # the partial download can't be verified, it is downloaded again
+    nexus.download_file(FILE_URL, str(tmp_path), "f.bin", max_parallel=1, token="t")
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert handler.ranges == [(0, len(content))]
+
+
+def test_download_file__resume_changed_file(tmp_path, range_files):
+    content, serve = range_files
+    (tmp_path / "f.bin.part").write_bytes(b"x" * 1234)
+    (tmp_path / "f.bin.part.validator").write_text('"0"')
+    handler = serve()
+
+    nexus.download_file(FILE_URL, str(tmp_path), "f.bin", max_parallel=1, token="t")
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert not list(tmp_path.glob("f.bin.*"))
+    assert handler.ranges == [(0, len(content))]
+
+
+def test_download_file__resume_after_error(tmp_path, range_files):
+    content, serve = range_files
+    handler = serve(fail_at=5000)
+
+    nexus.download_file(FILE_URL, str(tmp_path), "f.bin", chunk_size=100, max_parallel=1)
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert handler.ranges == [(0, len(content)), (5000, len(content))]
+
+
+def test_download_file__parallel(tmp_path, range_files):
+    content, serve = range_files
+    handler = serve()
+
+    nexus.download_file(
+        FILE_URL, str(tmp_path), digest=_sha256(content), part_size=1000, max_parallel=4, token="t"
+    )
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert not list(tmp_path.glob("f.bin.*"))
+    # the first range is read from the response of the whole file
+    assert sorted(handler.ranges) == [(0, len(content))] + [
+        (start, min(start + 1000, len(content))) for start in range(1000, len(content), 1000)
+    ]
+
+
+def test_download_file__parallel_resume_after_error(tmp_path, range_files):
+    content, serve = range_files
+    handler = serve(fail_at=3500)
+
+    nexus.download_file(
+        FILE_URL,
+        str(tmp_path),
+        "f.bin",
+        digest=_sha256(content),
+        part_size=1000,
+        chunk_size=100,
+        max_parallel=4,
+    )
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    assert not list(tmp_path.glob("f.bin.*"))
+    # only the failed range is resumed
+    assert (3500, 4000) in handler.ranges
+    assert handler.ranges.count((3000, 4000)) == 1
+
+
+def test_download_file__parallel_resume_changed_file(tmp_path, range_files):
+    content, serve = range_files
+    handler = serve(fail_at=3500)
+    handler.etag = '"0"'
+
+    with pytest.raises(httpx.ReadError):
+        with patch.object(retry, "_RETRY_POLICY", retry.RetryPolicy(max_retries=0)):
+            nexus.download_file(
+                FILE_URL, str(tmp_path), "f.bin", part_size=1000, chunk_size=100, max_parallel=4
+            )
+    handler.etag = '"1"'
+    handler.ranges.clear()
+
+    nexus.download_file(
+        FILE_URL, str(tmp_path), "f.bin", part_size=1000, chunk_size=100, max_parallel=4
+    )
+
+    assert (tmp_path / "f.bin").read_bytes() == content
+    # all the ranges are downloaded again
+    assert sorted(handler.ranges) == [(0, len(content))] + [
+        (start, min(start + 1000, len(content))) for start in range(1000, len(content), 1000)
+    ]
+
+
+class ConcurrentFiles:
+    """Mock transport handler serving files named after their url, counting the requests."""
+
+    def __init__(self):
+        self.requests = []
+        self.max_active = {}
+        self._active = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        host = request.url.host
+        with self._lock:
+            self.requests.append(str(request.url.copy_with(query=None)))
+            self._active[host] = self._active.get(host, 0) + 1
+            self.max_active[host] = max(self.max_active.get(host, 0), self._active[host])
+        time.sleep(0.02)
+        with self._lock:
+            self._active[host] -= 1
+        name = request.url.path.rsplit("/", 1)[-1]
+        encoded_name = base64.b64encode(name.encode()).decode()
+        return httpx.Response(
+            200,
+            headers={"content-disposition": f'attachment; filename="=?UTF-8?B?{encoded_name}?="'},
+            content=name.encode(),
+        )
+
+
+def test_download_files(tmp_path, monkeypatch):
+    handler = ConcurrentFiles()
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    _use_client(monkeypatch, client)
+    files = [(f"https://{host}/files/{host}-{i}", None) for host in "ab" for i in range(10)]
+    # the same file twice, and the same content at another url
+    files += [(files[0][0], None), ("https://a/files/a-copy", _sha256(b"a-0"))]
+    files[0] = (files[0][0], _sha256(b"a-0"))
+    progress = []
+
+    res = nexus.download_files(
+        files,
+        str(tmp_path),
+        max_concurrency=8,
+        max_per_host=3,
+        progress=lambda done, total: progress.append((done, total)),
+        token="t",
+    )
+
+    assert len(res) == 21
+    for url, path in res.items():
+        if url != "https://a/files/a-copy":
+            assert path == str(tmp_path / url.rsplit("/", 1)[-1])
+    assert res["https://a/files/a-copy"] == str(tmp_path / "a-0")
+    assert sorted(handler.requests) == sorted(url for url, _ in files[:20])
+    assert handler.max_active == {"a": 3, "b": 3}
+    assert progress == [(i, 20) for i in range(1, 21)]
+    assert sorted(p.name for p in tmp_path.iterdir()) == sorted(
+        f"{h}-{i}" for h in "ab" for i in range(10)
+    )
+
+
+def test_download_files__same_name(tmp_path, monkeypatch):
+    client = httpx.Client(transport=httpx.MockTransport(ConcurrentFiles()))
+    _use_client(monkeypatch, client)
+    files = [("https://a/files/x/f", None), ("https://b/files/y/f", None)]
+
+    with pytest.raises(ValueError, match="same name f"):
+        nexus.download_files(files, str(tmp_path), token="t")
+
+
+class UploadedFiles:
+    """Mock transport handler of the uploads and of the search of the files by digest."""
+
+    def __init__(self, existing=()):
+        self.uploads = {}
+        self.existing = set(existing)
+        self.corrupt = False
+        self.unauthorized = 0
+        self._lock = threading.Lock()
+
+    def _metadata(self, name, content):
+        digest = hashlib.sha256(content).hexdigest()
+        return {
+            "@id": f"https://bbp.epfl.ch/data/{name}",
+            "_self": f"https://foo/files/bar/zee/{name}",
+            "_filename": name,
+            "_bytes": len(content),
+            "_mediaType": "text/plain",
+            "_digest": {"_algorithm": "SHA-256", "_value": "0" * 64 if self.corrupt else digest},
+        }
+
+    def __call__(self, request):
+        if request.url.path.endswith("/_search"):
+            digest = json.loads(request.content)["query"]["bool"]["filter"][0]["term"]
+            digest = digest["_digest._value"]
+            hits = [
+                {"_source": {**self._metadata(name, b"existing"), "_original_source": "{}"}}
+                for name in self.existing
+                if hashlib.sha256(b"existing").hexdigest() == digest
+            ]
+            return httpx.Response(200, json={"hits": {"hits": hits[:1]}})
+        body = request.read()
+        if self.unauthorized:
+            self.unauthorized -= 1
+            return httpx.Response(401)
+        name = re.search(rb'filename="([^"]+)"', body).group(1).decode()
+        content = body.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n--", 1)[0]
+        with self._lock:
+            self.uploads[name] = content
+        return httpx.Response(201, json=self._metadata(name, content))
+
+
+@pytest.fixture
+def uploaded_files(monkeypatch):
+    handler = UploadedFiles(existing=["existing.txt"])
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    _use_client(monkeypatch, client)
+    return handler
+
+
+def test_upload_file__stream(uploaded_files):
+    chunks = [b"a" * 100_000, b"b" * 10, b"c" * 70_000]
+
+    res = nexus.upload_file(
+        "f.txt", iter(chunks), "text/plain", base="https://foo", org="bar", proj="zee", token="t"
+    )
+
+    assert uploaded_files.uploads["f.txt"] == b"".join(chunks)
+    assert res["_bytes"] == 170_010
+
+    uploaded_files.corrupt = True
+    with pytest.raises(DigestMismatchError):
+        nexus.upload_file(
+            "g.txt", b"data", "text/plain", base="https://foo", org="bar", proj="zee", token="t"
+        )
+
+    with pytest.raises(TypeError):
+        nexus.upload_file("h.txt", io.StringIO("data"), "text/plain", token="t")
+
+
+def test_upload_file__token_refreshed(monkeypatch, uploaded_files):
+    monkeypatch.setattr(nexus_client, "has_offline_token", lambda: True)
+    monkeypatch.setattr(nexus_client, "refresh_token", lambda token: "refreshed")
+    chunks = [b"a" * 100_000, b"b" * 10]
+
+    # the chunks can't be sent again
+    uploaded_files.unauthorized = 1
+    with pytest.raises(ValueError, match="uploaded again"):
+        nexus.upload_file("f.txt", (c for c in chunks), "text/plain", base="https://foo")
+    assert uploaded_files.uploads == {}
+
+    # a file is sent again from its start
+    uploaded_files.unauthorized = 1
+    res = nexus.upload_file("g.txt", io.BytesIO(b"".join(chunks)), "text/plain", base="https://foo")
+    assert uploaded_files.uploads["g.txt"] == b"".join(chunks)
+    assert res["_bytes"] == 100_010
+
+
+def test_upload_files(tmp_path, uploaded_files):
+    (tmp_path / "f.txt").write_bytes(b"f" * 1000)
+    (tmp_path / "existing.txt").write_bytes(b"existing")
+    files = [
+        ("f.txt", str(tmp_path / "f.txt")),
+        ("g.txt", io.BytesIO(b"g" * 1000), "text/csv"),
+        ("h.txt", (bytes([i]) * 100 for i in range(10))),
+        ("existing.txt", tmp_path / "existing.txt"),
+        ("existing-copy.txt", io.BytesIO(b"existing")),
+    ]
+
+    res = nexus.upload_files(
+        files, skip_existing=True, base="https://foo", org="bar", proj="zee", token="t"
+    )
+
+    assert [r["_filename"] for r in res] == [
+        "f.txt",
+        "g.txt",
+        "h.txt",
+        "existing.txt",
+        "existing.txt",
+    ]
+    assert sorted(uploaded_files.uploads) == ["f.txt", "g.txt", "h.txt"]
+    assert uploaded_files.uploads["h.txt"] == b"".join(bytes([i]) * 100 for i in range(10))
+    assert "_original_source" not in res[3]
+
+    res = nexus.upload_files(files[3:4], base="https://foo", org="bar", proj="zee", token="t")
+    assert uploaded_files.uploads["existing.txt"] == b"existing"
+
+
+class LinkedFiles:
+    """Mock transport handler of the linked files, failing on demand by path."""
+
+    def __init__(self, faults=None):
+        self.faults = dict(faults or {})  # path -> list of faults of the next requests
+        self.files = {}
+        self.links = []
+        self._lock = threading.Lock()
+
+    def __call__(self, request):
+        file_id = unquote(request.url.path.rsplit("/", 1)[-1])
+        if request.method == "GET":
+            if file_id not in self.files:
+                return httpx.Response(404)
+            return httpx.Response(200, json=self.files[file_id])
+        payload = json.loads(request.content)
+        with self._lock:
+            faults = self.faults.get(payload["path"], [])
+            fault = faults.pop(0) if faults else None
+            if fault != 503 and file_id in self.files:
+                return httpx.Response(409)
+            if fault not in (503, 400):
+                self.links.append(payload["path"])
+                self.files[file_id] = {
+                    "@id": f"https://bbp.epfl.ch/data/{file_id}",
+                    "_self": f"https://foo/files/bar/zee/{file_id}",
+                    "_filename": payload["filename"],
+                    "_bytes": 10,
+                    "_mediaType": payload["mediaType"],
+                    "_location": f"file://{payload['path']}",
+                    "_digest": {"_algorithm": "SHA-256", "_value": ""},
+                }
+        if fault == "lost":
+            raise httpx.ReadError("connection reset")
+        if fault is not None:
+            return httpx.Response(fault)
+        return httpx.Response(201, json=self.files[file_id])
+
+
+def _link_client(monkeypatch, handler):
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    _use_client(monkeypatch, client)
+    monkeypatch.setattr(retry, "_RETRY_POLICY", retry.RetryPolicy(max_retries=3, backoff=0))
+
+
+def test_link_files(monkeypatch):
+    handler = LinkedFiles({"/gpfs/1": [503, 503], "/gpfs/2": ["lost"]})
+    _link_client(monkeypatch, handler)
+    files = [(str(i), f"/gpfs/{i}") for i in range(20)] + [("csv", "/gpfs/csv", "text/csv")]
+
+    res = nexus.link_files(
+        files, "text/plain", base="https://foo", org="bar", proj="zee", token="t"
+    )
+
+    assert [r["_filename"] for r in res] == [name for name, *_ in files]
+    assert res[-1]["_mediaType"] == "text/csv"
+    assert res[0]["_mediaType"] == "text/plain"
+    # every file is linked once, the lost response was recovered from the conflict
+    assert sorted(handler.links) == sorted(path for _, path, *_ in files)
+
+
+def test_link_files__conflict(monkeypatch):
+    handler = LinkedFiles()
+    _link_client(monkeypatch, handler)
+    link = functools.partial(
+        nexus_batch._link_file_with_id, base="https://foo", org="bar", proj="zee", token="t"
+    )
+    link("a", "/gpfs/a", "text/plain", "id")
+
+    # the file of the id is the linked file
+    assert link("a", "/gpfs/a", "text/plain", "id")["_filename"] == "a"
+    # another file has the id
+    with pytest.raises(httpx.HTTPStatusError, match="409"):
+        link("b", "/gpfs/b", "text/plain", "id")
+    with pytest.raises(httpx.HTTPStatusError, match="409"):
+        link("a", "/gpfs/other/a", "text/plain", "id")
+    assert handler.links == ["/gpfs/a"]
+
+
+def test_link_files__resume_from_journal(tmp_path, monkeypatch):
+    handler = LinkedFiles({"/gpfs/3": [400], "/gpfs/5": ["lost", 503, 503, 503]})
+    _link_client(monkeypatch, handler)
+    journal = tmp_path / "journal.jsonl"
+    files = [(str(i), f"/gpfs/{i}") for i in range(10)]
+
+    with pytest.raises(httpx.HTTPError):
+        nexus.link_files(
+            files, base="https://foo", org="bar", proj="zee", token="t", journal=str(journal)
+        )
+    # interrupted while writing
+    with open(journal, "a", encoding="utf-8") as f:
+        f.write('{"name": "9", "pa')
+
+    res = nexus.link_files(
+        files, base="https://foo", org="bar", proj="zee", token="t", journal=str(journal)
+    )
+
+    assert [r["_filename"] for r in res] == [name for name, _ in files]
+    assert sorted(handler.links) == sorted(path for _, path in files)
+    assert len(handler.files) == 10
+    res_again = nexus.link_files(
+        files, base="https://foo", org="bar", proj="zee", token="t", journal=str(journal)
+    )
+    assert res_again == res
+    assert len(handler.links) == 10
+
+
+def test_open_file__seekable(range_files):
+    content, serve = range_files
+    handler = serve()
+
+    def open_range(start, end):
+        return nexus_files._open_file(FILE_URL, start, end, token="t")
+
+    with transfer.RangeReader(open_range, block_size=1000, read_ahead=4000) as f:
+        assert f.seekable()
+        assert f.read(10) == content[:10]
+        assert f.size == len(content)
+        assert handler.ranges == [(0, 1000)]
+
+        # sequential reads are read ahead
+        assert f.read(1990) == content[10:2000]
+        assert f.read(4000) == content[2000:6000]
+        assert handler.ranges == [(0, 1000), (1000, 3000), (3000, 7000)]
+
+        # random accesses request a block, the blocks read are kept
+        assert f.seek(-100, io.SEEK_END) == len(content) - 100
+        assert f.read() == content[-100:]
+        assert f.read() == b""
+        f.seek(500)
+        assert f.read(100) == content[500:600]
+        assert f.tell() == 600
+        assert f.readline() == content[600 : content.index(b"\n", 600) + 1]
+        assert f.seek(len(content) + 10) == len(content) + 10
+        assert f.read(10) == b""
+        assert handler.ranges[3:] == [(10000, 10240)]
+        assert f.transferred == len(content[:7000]) + 240
+
+    assert f.closed
+    with pytest.raises(ValueError):
+        f.read()
+
+    with nexus.open_file(FILE_URL, token="t", seekable=True) as f:
+        assert isinstance(f, transfer.RangeReader)
+        assert f.read() == content
+
+
+def test_open_file__seekable_without_ranges(monkeypatch):
+    small, large = b"small", bytes(2**17)
+    urls = {"https://foo/small": small, "https://foo/large": large}
+    client = httpx.Client(
+        transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, content=urls[str(request.url).split("?")[0]])
+        )
+    )
+    _use_client(monkeypatch, client)
+
+    with nexus.open_file("https://foo/small", token="t", seekable=True) as f:
+        f.seek(2)
+        assert f.read() == small[2:]
+    with nexus.open_file("https://foo/large", token="t", seekable=True) as f:
+        with pytest.raises(httpx.HTTPError, match="not supported"):
+            f.read(10)
+
+
+def test_iter_file_items(httpx_mock):
+    stream = json.dumps(FILE_RESPONSE).encode("utf-8")
+    httpx_mock.add_response(
+        stream=IteratorStream([stream[:100], stream[100:]]),
+        method="GET",
+        url=f"{FILE_URL}?tag=&rev=",
+    )
+    httpx_mock.add_response(method="GET", url=f"{FILE_URL}?tag=&rev=", json=FILE_RESPONSE)
+    httpx_mock.add_response(method="GET", url=f"{FILE_URL}?tag=&rev=", status_code=404)
+
+    assert dict(nexus.iter_file_items(FILE_URL, token="token")) == json.loads(stream)
+    assert dict(nexus.iter_file_items(FILE_URL, "/_digest", token="token")) == (
+        FILE_RESPONSE["_digest"]
+    )
+    with pytest.raises(httpx.HTTPStatusError):
+        next(nexus.iter_file_items(FILE_URL, token="token"))
+
+
+def test_open_file(httpx_mock):
+    content = bytes(range(256)) * 100
+    httpx_mock.add_response(
+        stream=IteratorStream([content[:1000], content[1000:]]),
+        method="GET",
+        url=f"{FILE_URL}?tag=&rev=",
+    )
+    httpx_mock.add_response(method="GET", url=f"{FILE_URL}?tag=&rev=", content=content)
+
+    with nexus.open_file(FILE_URL, token="token") as f:
+        assert f.read(10) == content[:10]
+        assert f.read(2000) == content[10:2010]
+        assert f.read() == content[2010:]
+        assert f.read() == b""
+    assert f.closed
+
+    with nexus.open_file(FILE_URL, token="token") as f:
+        assert f.read() == content
+
+
 def test_token():
     token = (
         "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJzdWIiOiIxMjM0NTY3ODkwIiwibmFtZSI6IkpvaG4gRG9l"
@@ -303,3 +901,246 @@ def test_es_query(httpx_mock):
     res = nexus.es_query(query, base="https://foo", org="bar", proj="zee")
 
     assert res == json_response
+
+
+def test_es_load_by_ids(httpx_mock):
+    source = {
+        "@id": "https://bbp.epfl.ch/data/1",
+        "@type": ["Entity"],
+        "_original_source": json.dumps(
+            {"@context": "https://bbp.neuroshapes.org", "@id": "1", "@type": "Entity", "a": 1}
+        ),
+        "_rev": 2,
+        "_self": "https://foo/resources/bar/zee/_/1",
+    }
+    httpx_mock.add_response(
+        method="POST",
+        url="https://foo/views/bar/zee/documents/_search",
+        json={"hits": {"hits": [{"_id": source["@id"], "_source": source}]}},
+    )
+
+    res = nexus.es_load_by_ids(
+        ["https://bbp.epfl.ch/data/1", "https://bbp.epfl.ch/data/2"],
+        base="https://foo",
+        org="bar",
+        proj="zee",
+        token="token",
+    )
+
+    assert res == {
+        "https://bbp.epfl.ch/data/1": {
+            "@context": "https://bbp.neuroshapes.org",
+            "@id": "https://bbp.epfl.ch/data/1",
+            "@type": "Entity",
+            "a": 1,
+            "_rev": 2,
+            "_self": "https://foo/resources/bar/zee/_/1",
+        }
+    }
+    assert json.loads(httpx_mock.get_request().content) == {
+        "size": 2,
+        "query": {"terms": {"@id": ["https://bbp.epfl.ch/data/1", "https://bbp.epfl.ch/data/2"]}},
+    }
+
+
+def test_es_load_by_ids__batches(httpx_mock, monkeypatch):
+    monkeypatch.setattr(nexus_query, "ES_MAX_RESULT_WINDOW", 2)
+    ids = [f"https://bbp.epfl.ch/data/{i}" for i in range(5)]
+
+    def search(request):
+        batch = json.loads(request.content)["query"]["terms"]["@id"]
+        # the hits are not in the order of the ids
+        hits = [
+            {"_source": {"@id": id_, "_original_source": json.dumps({"@id": id_}), "_rev": 1}}
+            for id_ in reversed(batch)
+            if id_ != ids[2]
+        ]
+        return httpx.Response(200, json={"hits": {"hits": hits}})
+
+    httpx_mock.add_callback(
+        search, url="https://foo/views/bar/zee/documents/_search", is_reusable=True
+    )
+
+    res = nexus.es_load_by_ids(ids, base="https://foo", org="bar", proj="zee", token="token")
+
+    assert list(res) == [ids[0], ids[1], ids[3], ids[4]]
+    assert res[ids[4]] == {"@id": ids[4], "_rev": 1}
+    requests = [json.loads(r.content) for r in httpx_mock.get_requests()]
+    assert [r["size"] for r in requests] == [2, 2, 1]
+    assert [r["query"]["terms"]["@id"] for r in requests] == [ids[:2], ids[2:4], ids[4:]]
+
+
+def test_get_http_client():
+    client = nexus.get_http_client()
+    assert isinstance(client, httpx.Client)
+    assert nexus.get_http_client() is client
+
+
+def test_get_http_client__forked_process(monkeypatch):
+    client = nexus.get_http_client()
+    monkeypatch.setattr(nexus_client.os, "getpid", lambda: -1)
+    assert nexus.get_http_client() is not client
+
+
+def test_configure_http_client(monkeypatch):
+    monkeypatch.setattr(
+        nexus_client, "_HTTP_CLIENT_OPTIONS", dict(nexus_client._HTTP_CLIENT_OPTIONS)
+    )
+    monkeypatch.setattr(nexus_client, "TIMEOUTS", dict(nexus_client.TIMEOUTS))
+    client = nexus.get_http_client()
+
+    nexus.configure_http_client(max_connections=3, timeouts={"download": 60})
+
+    assert client.is_closed
+    assert nexus.get_http_client() is not client
+    assert nexus_client._HTTP_CLIENT_OPTIONS["max_connections"] == 3
+    assert nexus_client.TIMEOUTS["download"] == 60
+
+    with pytest.raises(AssertionError, match="Unknown operations"):
+        nexus.configure_http_client(timeouts={"foo": 1})
+
+    nexus.close_http_client()
+
+
+def test_shared_http_client_is_used():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"@id": "foo"})
+
+    nexus.set_http_client(httpx.Client(transport=httpx.MockTransport(handler)))
+    try:
+        assert nexus.load_by_url("https://foo/bar", token="token") == {"@id": "foo"}
+        assert nexus.es_query({}, base="https://foo", org="bar", proj="zee", token="token")
+    finally:
+        nexus.set_http_client(None)
+
+    assert [str(r.url) for r in requests] == [
+        "https://foo/bar",
+        "https://foo/views/bar/zee/documents/_search",
+    ]
+    assert all(r.headers["authorization"] == "Bearer token" for r in requests)
+
+
+def test_load_by_ids(httpx_mock):
+    ids = [f"https://bbp.epfl.ch/data/{i}" for i in range(10)]
+    for id_ in ids[:-1]:
+        httpx_mock.add_response(
+            method="GET", url=f"https://foo/resources/bar/zee/_/{quote(id_)}", json={"@id": id_}
+        )
+    httpx_mock.add_response(
+        method="GET",
+        url=f"https://foo/resources/bar/zee/_/{quote(ids[-1])}",
+        status_code=404,
+        json={},
+    )
+
+    res = nexus.load_by_ids(ids, base="https://foo", org="bar", proj="zee", token="token")
+
+    assert res == [{"@id": id_} for id_ in ids[:-1]] + [None]
+
+
+def test_load_by_ids__session():
+    ids = [f"https://bbp.epfl.ch/data/{i}" for i in range(10)]
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"url": str(request.url)})
+
+    session = NexusSession(
+        base="https://foo",
+        org="bar",
+        proj="zee",
+        token="session-token",
+        http_client=httpx.Client(transport=httpx.MockTransport(handler)),
+    )
+    with session.activate():
+        res = nexus.load_by_ids(ids)
+
+    assert res == [{"url": f"https://foo/resources/bar/zee/_/{quote(id_)}"} for id_ in ids]
+    assert {r.headers["authorization"] for r in requests} == {"Bearer session-token"}
+
+
+def test_load_by_ids__concurrent(monkeypatch):
+    max_concurrency = 4
+    barrier = threading.Barrier(max_concurrency, timeout=5)
+
+    def load_by_id(resource_id, **kwargs):
+        # fails with BrokenBarrierError unless max_concurrency requests run at the same time
+        barrier.wait()
+        return {"@id": resource_id}
+
+    monkeypatch.setattr(nexus, "load_by_id", load_by_id)
+
+    ids = [str(i) for i in range(4 * max_concurrency)]
+    res = nexus.load_by_ids(ids, max_concurrency=max_concurrency)
+
+    assert res == [{"@id": id_} for id_ in ids]
+
+
+def test_load_by_url__concurrent_identical_requests(monkeypatch):
+    n_threads = 16
+    started = threading.Event()
+    release = threading.Event()
+    requests = []
+
+    class Client:
+        def get(self, url, headers, params, timeout):
+            requests.append(headers.get("authorization"))
+            started.set()
+            release.wait(timeout=5)
+            return httpx.Response(
+                200, json={"@id": url}, request=httpx.Request("GET", url, params=params)
+            )
+
+    monkeypatch.setattr(nexus, "get_http_client", Client)
+
+    def load(token):
+        return nexus.load_by_url("https://foo/a", params={"rev": 1}, token=token)
+
+    with ThreadPoolExecutor(max_workers=n_threads + 1) as executor:
+        futures = [executor.submit(load, "token") for _ in range(n_threads)]
+        started.wait(timeout=5)
+        # another token doesn't share the request
+        other = executor.submit(load, "other-token")
+        # let the other threads wait for the running request
+        time.sleep(0.2)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert other.result() == {"@id": "https://foo/a"}
+    assert results == [{"@id": "https://foo/a"}] * n_threads
+    # every caller gets its own json
+    assert len({id(result) for result in results}) == n_threads
+    assert sorted(requests) == ["Bearer other-token", "Bearer token"]
+    assert nexus._LOADS._calls == {}
+
+
+def test_load_by_url__concurrent_identical_requests_error(monkeypatch):
+    n_threads = 8
+    release = threading.Event()
+    requests = []
+
+    class Client:
+        def get(self, url, headers, params, timeout):
+            requests.append(url)
+            release.wait(timeout=5)
+            raise httpx.ConnectError("connection reset")
+
+    monkeypatch.setattr(nexus, "get_http_client", Client)
+    monkeypatch.setattr(retry, "_RETRY_POLICY", retry.RetryPolicy(max_retries=0))
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = [
+            executor.submit(nexus.load_by_url, "https://foo/a", token="token")
+            for _ in range(n_threads)
+        ]
+        time.sleep(0.2)
+        release.set()
+        for future in futures:
+            with pytest.raises(httpx.ConnectError):
+                future.result()
+
+    assert requests == ["https://foo/a"]
@@ -0,0 +1,276 @@
+# pylint: disable=missing-docstring
+import asyncio
+import hashlib
+import json
+
+import httpx
+import pytest
+from unittest.mock import create_autospec
+
+import entity_management.nexus_async as nexus_async
+from entity_management.cache import RevalidatingCache
+from entity_management.exception import DigestMismatchError
+from entity_management.base import Identifiable, attributes, AttrOf
+from entity_management.state import NexusSession, has_offline_token, refresh_token
+from entity_management.util import quote
+
+BASE = "https://foo"
+RESOURCE_ID = "https://bbp.epfl.ch/data/1"
+RESOURCE_URL = f"{BASE}/resources/bar/zee/_/{quote(RESOURCE_ID)}"
+
+
+def test_load_by_id(httpx_mock):
+    httpx_mock.add_response(method="GET", url=f"{RESOURCE_URL}?rev=2", json={"@id": RESOURCE_ID})
+
+    res = asyncio.run(
+        nexus_async.load_by_id(
+            f"{RESOURCE_ID}?rev=2", base=BASE, org="bar", proj="zee", token="token"
+        )
+    )
+
+    assert res == {"@id": RESOURCE_ID}
+    assert httpx_mock.get_request().headers["authorization"] == "Bearer token"
+
+
+def test_load_by_id__not_found(httpx_mock):
+    httpx_mock.add_response(method="GET", url=RESOURCE_URL, status_code=404, json={})
+
+    res = asyncio.run(
+        nexus_async.load_by_id(RESOURCE_ID, base=BASE, org="bar", proj="zee", token="token")
+    )
+
+    assert res is None
+
+
+def test_load_by_url__revalidated_evicted(httpx_mock):
+    revalidating_cache = RevalidatingCache(max_size=1000)
+    httpx_mock.add_response(method="GET", url=RESOURCE_URL, json={"_rev": 1}, headers={"etag": "1"})
+
+    def evicted(request):
+        revalidating_cache.clear()
+        return httpx.Response(304)
+
+    httpx_mock.add_callback(evicted, method="GET", url=RESOURCE_URL)
+    httpx_mock.add_response(method="GET", url=RESOURCE_URL, json={"_rev": 1})
+
+    async def _load_twice():
+        with NexusSession(revalidating_cache=revalidating_cache).activate():
+            return [await nexus_async.load_by_url(RESOURCE_URL, token="t") for _ in range(2)]
+
+    assert asyncio.run(_load_twice()) == [{"_rev": 1}] * 2
+    requests = httpx_mock.get_requests()
+    assert requests[1].headers["if-none-match"] == "1"
+    assert "if-none-match" not in requests[2].headers
+
+
+def test_get_http_client__session():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, json={"@id": RESOURCE_ID})
+
+    async def _load():
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with NexusSession(async_http_client=client).activate():
+            assert nexus_async.get_http_client() is client
+            return await nexus_async.load_by_url(RESOURCE_URL, token="t")
+
+    assert asyncio.run(_load()) == {"@id": RESOURCE_ID}
+    assert len(requests) == 1
+
+
+def test_load_by_id__concurrent(httpx_mock):
+    ids = [f"{RESOURCE_ID}{i}" for i in range(20)]
+    for id_ in ids:
+        url = f"{BASE}/resources/bar/zee/_/{quote(id_)}"
+        httpx_mock.add_response(method="GET", url=url, json={"@id": id_})
+
+    async def _load_all():
+        return await asyncio.gather(
+            *(
+                nexus_async.load_by_id(id_, base=BASE, org="bar", proj="zee", token="token")
+                for id_ in ids
+            )
+        )
+
+    assert [r["@id"] for r in asyncio.run(_load_all())] == ids
+
+
+def test_load_by_id__sessions(httpx_mock):
+    projs = [f"proj{i}" for i in range(5)]
+    for proj in projs:
+        httpx_mock.add_response(
+            method="GET",
+            url=f"{BASE}/resources/bar/{proj}/_/{quote(RESOURCE_ID)}",
+            match_headers={"authorization": f"Bearer {proj}-token"},
+            json={"proj": proj},
+        )
+
+    async def _load(proj):
+        with NexusSession(base=BASE, org="bar", proj=proj, token=f"{proj}-token").activate():
+            return await nexus_async.load_by_id(RESOURCE_ID)
+
+    async def _load_all():
+        return await asyncio.gather(*(_load(proj) for proj in projs))
+
+    assert asyncio.run(_load_all()) == [{"proj": proj} for proj in projs]
+
+
+def test_nexus_wrapper_with_http_error_401_and_offline_token(monkeypatch, httpx_mock):
+    mock_has_offline_token = create_autospec(has_offline_token, return_value=True)
+    mock_refresh_token = create_autospec(refresh_token, return_value="12345")
+
+    monkeypatch.setattr(nexus_async, "get_token", lambda: "expired")
+    monkeypatch.setattr("entity_management.nexus_client.has_offline_token", mock_has_offline_token)
+    monkeypatch.setattr(nexus_async, "refresh_token", mock_refresh_token)
+
+    httpx_mock.add_response(status_code=401)
+    httpx_mock.add_response(status_code=200, json={"@id": RESOURCE_ID})
+
+    res = asyncio.run(nexus_async.load_by_url(RESOURCE_URL))
+
+    assert res == {"@id": RESOURCE_ID}
+    assert mock_refresh_token.call_count == 1
+    assert [r.headers["authorization"] for r in httpx_mock.get_requests()] == [
+        "Bearer expired",
+        "Bearer 12345",
+    ]
+
+
+def test_nexus_wrapper_with_explicit_token(monkeypatch, httpx_mock):
+    mock_refresh_token = create_autospec(refresh_token, return_value="12345")
+    monkeypatch.setattr(nexus_async, "refresh_token", mock_refresh_token)
+
+    httpx_mock.add_response(status_code=401)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(nexus_async.load_by_url(RESOURCE_URL, token="token"))
+
+    assert mock_refresh_token.call_count == 0
+
+
+def test_sparql_query(httpx_mock):
+    response = {"results": {"bindings": [{"entity": {"value": RESOURCE_ID}}]}}
+    httpx_mock.add_response(method="POST", url=f"{BASE}/views/bar/zee/graph/sparql", json=response)
+
+    res = asyncio.run(
+        nexus_async.sparql_query("SELECT ?entity", base=BASE, org="bar", proj="zee", token="t")
+    )
+
+    assert res == response
+    request = httpx_mock.get_request()
+    assert request.content == b"SELECT ?entity"
+    assert request.headers["content-type"] == "application/sparql-query"
+
+
+def test_download_file(tmp_path, httpx_mock):
+    httpx_mock.add_response(
+        method="GET",
+        url=f"{BASE}/files/bar/zee/1?tag=&rev=",
+        content=b"data",
+        headers={"Content-Disposition": 'attachment; filename="=?UTF-8?B?bXlmaWxlLmpwZw==?="'},
+    )
+
+    res = asyncio.run(
+        nexus_async.download_file(f"{BASE}/files/bar/zee/1", str(tmp_path), token="token")
+    )
+
+    assert res == str(tmp_path / "myfile.jpg")
+    assert (tmp_path / "myfile.jpg").read_bytes() == b"data"
+    assert not (tmp_path / "myfile.jpg.part").exists()
+
+
+def test_download_file__digest(tmp_path, httpx_mock):
+    httpx_mock.add_response(method="GET", url=f"{BASE}/files/bar/zee/1?tag=&rev=", content=b"data")
+    url = f"{BASE}/files/bar/zee/1"
+    value = hashlib.sha256(b"data").hexdigest()
+
+    res = asyncio.run(
+        nexus_async.download_file(
+            url, str(tmp_path), "a", digest={"algorithm": "SHA-256", "value": value}, token="t"
+        )
+    )
+    assert (tmp_path / "a").read_bytes() == b"data"
+
+    httpx_mock.add_response(method="GET", url=f"{BASE}/files/bar/zee/1?tag=&rev=", content=b"dat")
+    with pytest.raises(DigestMismatchError):
+        asyncio.run(
+            nexus_async.download_file(
+                url, str(tmp_path), "b", digest={"algorithm": "SHA-256", "value": value}, token="t"
+            )
+        )
+    assert not (tmp_path / "b").exists()
+    assert not (tmp_path / "b.part").exists()
+    assert res == str(tmp_path / "a")
+
+
+def test_file_as_dict(httpx_mock):
+    httpx_mock.add_response(method="GET", url=f"{BASE}/files/bar/zee/1?tag=&rev=3", json=[1, 2])
+
+    res = asyncio.run(nexus_async.file_as_dict(f"{BASE}/files/bar/zee/1", rev=3, token="token"))
+
+    assert res == [1, 2]
+
+
+@attributes({"a": AttrOf(int)})
+class AsyncDummy(Identifiable):
+    """A dummy class"""
+
+
+def test_afrom_id__apublish(monkeypatch):
+    payload = {
+        "@context": "https://bbp.neuroshapes.org",
+        "@id": RESOURCE_ID,
+        "@type": "AsyncDummy",
+        "a": 1,
+        "_self": RESOURCE_URL,
+        "_rev": 1,
+        "_project": "my-project",
+        "_constrainedBy": "https://bluebrain.github.io/nexus/schemas/unconstrained.json",
+        "_createdAt": "2024-01-22T10:07:16.052123Z",
+        "_createdBy": "https://bbp.epfl.ch/nexus/v1/realms/bbp/users/foo",
+        "_deprecated": False,
+        "_updatedAt": "2024-01-22T10:07:16.052123Z",
+        "_updatedBy": "https://bbp.epfl.ch/nexus/v1/realms/bbp/users/foo",
+    }
+    updated = []
+
+    async def load_by_id(resource_id, **kwargs):
+        assert resource_id == RESOURCE_ID
+        return json.loads(json.dumps(payload))
+
+    async def update(id_url, rev, json_ld, **kwargs):
+        updated.append((id_url, rev, json_ld))
+        return {**payload, "_rev": 2}
+
+    monkeypatch.setattr(nexus_async, "load_by_id", load_by_id)
+    monkeypatch.setattr(nexus_async, "update", update)
+
+    async def _run():
+        dummy = await AsyncDummy.afrom_id(RESOURCE_ID)
+        return await dummy.evolve(a=2).apublish()
+
+    res = asyncio.run(_run())
+
+    assert res.a == 2
+    assert res.get_rev() == 2
+    assert updated == [
+        (
+            RESOURCE_URL,
+            1,
+            {"a": 2, "@context": "https://bbp.neuroshapes.org", "@type": "AsyncDummy"},
+        )
+    ]
+
+
+def test_afrom_id__on_no_result(monkeypatch):
+    async def load_by_id(resource_id, **kwargs):
+        return None
+
+    async def on_no_result(resource_id, **kwargs):
+        return resource_id
+
+    monkeypatch.setattr(nexus_async, "load_by_id", load_by_id)
+
+    assert asyncio.run(AsyncDummy.afrom_id(RESOURCE_ID, on_no_result=on_no_result)) == RESOURCE_ID
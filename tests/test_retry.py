@@ -0,0 +1,241 @@
+# pylint: disable=missing-docstring
+import asyncio
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+import entity_management.nexus as nexus
+import entity_management.nexus_async as nexus_async
+from entity_management import retry
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(retry, "_RETRY_POLICY", retry.RetryPolicy(max_retries=3, backoff=0))
+
+
+class FaultInjectingTransport(httpx.BaseTransport):
+    """Fail the first ``failures`` requests of each url with the next fault of ``faults``."""
+
+    def __init__(self, failures, faults):
+        self.failures = failures
+        self.faults = itertools.cycle(faults)
+        self.requests = []
+        self._attempts = {}
+        self._lock = threading.Lock()
+
+    def handle_request(self, request):
+        url = str(request.url)
+        with self._lock:
+            self.requests.append(request)
+            attempt = self._attempts[url] = self._attempts.get(url, 0) + 1
+            fault = next(self.faults) if attempt <= self.failures else None
+        if isinstance(fault, Exception):
+            raise fault
+        if fault is not None:
+            return fault
+        return httpx.Response(200, json={"@id": url})
+
+
+def _client(monkeypatch, transport):
+    client = httpx.Client(transport=transport)
+    monkeypatch.setattr(nexus, "get_http_client", lambda: client)
+
+
+def test_retry_policy__is_retryable():
+    policy = retry.RetryPolicy()
+    request = httpx.Request("GET", "https://foo/a")
+
+    def status_error(status_code):
+        response = httpx.Response(status_code, request=request)
+        return httpx.HTTPStatusError("error", request=request, response=response)
+
+    assert policy.is_retryable(status_error(503))
+    assert policy.is_retryable(status_error(429))
+    assert not policy.is_retryable(status_error(404))
+    assert not policy.is_retryable(status_error(500))
+    assert policy.is_retryable(httpx.ReadError("reset", request=request))
+    assert policy.is_retryable(httpx.ConnectError("refused", request=request))
+    assert not policy.is_retryable(ValueError())
+
+    # the request may have been processed by the server
+    assert not policy.is_retryable(status_error(503), idempotent=False)
+    assert not policy.is_retryable(httpx.ReadTimeout("timeout", request=request), idempotent=False)
+    # the request was never sent
+    assert policy.is_retryable(httpx.ConnectError("refused", request=request), idempotent=False)
+
+
+def test_retry_policy__get_delay():
+    policy = retry.RetryPolicy(max_retries=3, backoff=1, max_backoff=3)
+    request = httpx.Request("GET", "https://foo/a")
+    error = httpx.ReadError("reset", request=request)
+
+    for attempt, max_delay in enumerate([1, 2, 3]):
+        assert 0 <= policy.get_retry_delay(error, attempt) <= max_delay
+    assert policy.get_retry_delay(error, 3) is None
+
+    response = httpx.Response(503, headers={"retry-after": "7"}, request=request)
+    error = httpx.HTTPStatusError("error", request=request, response=response)
+    assert policy.get_delay(error, 0) == 7
+    # the server requests a delay longer than the maximum backoff
+    assert policy.get_retry_delay(error, 0) is None
+
+    response = httpx.Response(503, headers={"retry-after": "2"}, request=request)
+    error = httpx.HTTPStatusError("error", request=request, response=response)
+    assert policy.get_retry_delay(error, 0) == 2
+
+    response = httpx.Response(
+        503, headers={"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"}, request=request
+    )
+    error = httpx.HTTPStatusError("error", request=request, response=response)
+    assert policy.get_delay(error, 0) == 0
+
+
+def test_configure_retries(monkeypatch):
+    monkeypatch.setattr(retry, "_RETRY_POLICY", retry.RetryPolicy())
+    retry.configure_retries(max_retries=5, statuses=[503])
+    assert retry.get_retry_policy().max_retries == 5
+    assert retry.get_retry_policy().statuses == {503}
+    assert retry.get_retry_policy().backoff == retry.RetryPolicy().backoff
+
+
+def test_token_bucket():
+    bucket = retry.TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    # the next tokens are reserved in order
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_configure_rate_limit(monkeypatch):
+    monkeypatch.setattr(retry, "_RATE_LIMITER", None)
+    retry.configure_rate_limit(rate=5)
+    assert retry.get_rate_limiter().rate == 5
+    assert retry.get_rate_limiter().burst == 5
+    retry.configure_rate_limit(rate=None)
+    assert retry.get_rate_limiter() is None
+
+
+def test_load_by_url__transient_faults_under_load(monkeypatch, fast_retries):
+    transport = FaultInjectingTransport(
+        failures=2,
+        faults=[
+            httpx.Response(503),
+            httpx.Response(429, headers={"retry-after": "0"}),
+            httpx.ConnectError("refused"),
+            httpx.ReadError("reset"),
+            httpx.Response(502),
+        ],
+    )
+    _client(monkeypatch, transport)
+    urls = [f"https://foo/{i}" for i in range(50)]
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(lambda url: nexus.load_by_url(url, token="t"), urls))
+
+    assert results == [{"@id": url} for url in urls]
+    assert len(transport.requests) == 3 * len(urls)
+
+
+def test_load_by_url__gives_up(monkeypatch, fast_retries, caplog):
+    transport = FaultInjectingTransport(failures=10, faults=[httpx.Response(503)])
+    _client(monkeypatch, transport)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        nexus.load_by_url("https://foo/a", token="t")
+
+    assert len(transport.requests) == 4
+    assert "Nexus error!" in caplog.text
+
+
+def test_load_by_url__not_retried(monkeypatch, fast_retries):
+    transport = FaultInjectingTransport(failures=10, faults=[httpx.Response(400)])
+    _client(monkeypatch, transport)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        nexus.load_by_url("https://foo/a", token="t")
+
+    assert len(transport.requests) == 1
+
+
+@pytest.mark.parametrize(
+    "fault, n_requests",
+    [
+        (httpx.ReadError("reset"), 1),
+        (httpx.Response(503), 1),
+        (httpx.ConnectError("refused"), 2),
+    ],
+)
+def test_create__not_replayed(monkeypatch, fast_retries, fault, n_requests):
+    transport = FaultInjectingTransport(failures=1, faults=[fault])
+    _client(monkeypatch, transport)
+
+    if n_requests == 1:
+        with pytest.raises(httpx.HTTPError):
+            nexus.create("https://foo/resources", {"name": "a"}, token="t")
+    else:
+        assert nexus.create("https://foo/resources", {"name": "a"}, token="t")
+
+    assert [r.method for r in transport.requests] == ["POST"] * n_requests
+
+
+@pytest.mark.parametrize(
+    "call, method",
+    [
+        (lambda: nexus.update("https://foo/a", 1, {"name": "a"}, token="t"), "PUT"),
+        (lambda: nexus.deprecate("https://foo/a", 1, token="t"), "DELETE"),
+    ],
+)
+def test_update__not_replayed(monkeypatch, fast_retries, call, method):
+    transport = FaultInjectingTransport(failures=1, faults=[httpx.ReadError("reset")])
+    _client(monkeypatch, transport)
+
+    with pytest.raises(httpx.ReadError):
+        call()
+
+    assert [r.method for r in transport.requests] == [method]
+
+
+def test_load_by_url__rate_limited(monkeypatch):
+    transport = FaultInjectingTransport(failures=0, faults=[None])
+    _client(monkeypatch, transport)
+    monkeypatch.setattr(retry, "_RATE_LIMITER", retry.TokenBucket(rate=50, burst=1))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: nexus.load_by_url(f"https://foo/{i}", token="t"), range(11)))
+
+    assert time.monotonic() - start >= 0.19
+    assert len(transport.requests) == 11
+
+
+def test_async_load_by_url__transient_faults(monkeypatch, fast_retries):
+    class AsyncTransport(httpx.AsyncBaseTransport):
+        def __init__(self):
+            self.transport = FaultInjectingTransport(
+                failures=2, faults=[httpx.Response(503), httpx.ReadError("reset")]
+            )
+
+        async def handle_async_request(self, request):
+            return self.transport.handle_request(request)
+
+    transport = AsyncTransport()
+
+    async def load_all():
+        nexus_async.set_http_client(httpx.AsyncClient(transport=transport))
+        try:
+            return await asyncio.gather(
+                *(nexus_async.load_by_url(f"https://foo/{i}", token="t") for i in range(10))
+            )
+        finally:
+            await nexus_async.close_http_client()
+
+    results = asyncio.run(load_all())
+
+    assert results == [{"@id": f"https://foo/{i}"} for i in range(10)]
+    assert len(transport.transport.requests) == 30
@@ -1,4 +1,11 @@
-from unittest.mock import patch
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import Mock, patch
+
+import jwt
+import pytest
+
 from entity_management import state as test_module
 
 
@@ -64,3 +71,162 @@ def test_get_es_url():
             with patch("entity_management.state.ORG", "my-org"):
                 res = test_module.get_es_url()
                 assert res == "my-base/views/my-org/my-proj/documents/_search"
+
+
+def _access_token(expires_in, name="foo"):
+    payload = {"typ": "Bearer", "name": name, "exp": int(time.time() + expires_in)}
+    return jwt.encode(payload, "s" * 32, algorithm="HS256")
+
+
+def test_get_token__refreshed_before_expiry(monkeypatch):
+    refreshed = _access_token(3600, name="bar")
+    keycloak = Mock()
+    keycloak.refresh_token.return_value = {"access_token": refreshed}
+    monkeypatch.setattr(test_module, "KEYCLOAK", keycloak)
+    monkeypatch.setattr(test_module, "OFFLINE_TOKEN", "offline")
+    monkeypatch.setattr(test_module, "TOKEN_REFRESH_MARGIN", 60)
+
+    valid = _access_token(3600)
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN", valid)
+    monkeypatch.setattr(
+        test_module, "ACCESS_TOKEN_EXPIRY", test_module.get_token_info(valid)["exp"]
+    )
+    assert test_module.get_token() == valid
+
+    expiring = _access_token(30)
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN", expiring)
+    monkeypatch.setattr(
+        test_module, "ACCESS_TOKEN_EXPIRY", test_module.get_token_info(expiring)["exp"]
+    )
+    assert test_module.get_token() == refreshed
+    assert test_module.ACCESS_TOKEN_EXPIRY == test_module.get_token_info(refreshed)["exp"]
+    assert keycloak.refresh_token.call_count == 1
+
+
+def test_get_token__refresh_failure_before_expiry(monkeypatch):
+    keycloak = Mock()
+    keycloak.refresh_token.side_effect = ConnectionError()
+    monkeypatch.setattr(test_module, "KEYCLOAK", keycloak)
+    monkeypatch.setattr(test_module, "OFFLINE_TOKEN", "offline")
+
+    expiring = _access_token(30)
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN", expiring)
+    monkeypatch.setattr(
+        test_module, "ACCESS_TOKEN_EXPIRY", test_module.get_token_info(expiring)["exp"]
+    )
+    assert test_module.get_token() == expiring
+
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN_EXPIRY", time.time() - 1)
+    with pytest.raises(ConnectionError):
+        test_module.get_token()
+
+
+def _slow_keycloak(token):
+    def refresh(_):
+        time.sleep(0.1)
+        return {"access_token": token}
+
+    keycloak = Mock()
+    keycloak.refresh_token.side_effect = refresh
+    return keycloak
+
+
+def test_get_token__single_refresh_from_many_threads(monkeypatch):
+    refreshed = _access_token(3600, name="bar")
+    keycloak = _slow_keycloak(refreshed)
+    monkeypatch.setattr(test_module, "KEYCLOAK", keycloak)
+    monkeypatch.setattr(test_module, "OFFLINE_TOKEN", "offline")
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN", None)
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN_EXPIRY", None)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        tokens = list(executor.map(lambda _: test_module.get_token(), range(64)))
+
+    assert tokens == [refreshed] * 64
+    assert keycloak.refresh_token.call_count == 1
+
+
+def test_refresh_token__single_refresh_of_expired_token(monkeypatch):
+    expired = _access_token(-10)
+    refreshed = _access_token(3600, name="bar")
+    keycloak = _slow_keycloak(refreshed)
+    monkeypatch.setattr(test_module, "KEYCLOAK", keycloak)
+    monkeypatch.setattr(test_module, "OFFLINE_TOKEN", "offline")
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN", expired)
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN_EXPIRY", None)
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        tokens = list(executor.map(lambda _: test_module.refresh_token(expired), range(64)))
+
+    assert tokens == [refreshed] * 64
+    assert keycloak.refresh_token.call_count == 1
+
+    # an explicit refresh always calls keycloak
+    test_module.refresh_token()
+    assert keycloak.refresh_token.call_count == 2
+
+
+def test_session():
+    session = test_module.NexusSession(base="session-base", org="session-org")
+    assert test_module.get_session() is None
+
+    with patch("entity_management.state.BASE", "my-base"):
+        with patch("entity_management.state.ORG", "my-org"):
+            with patch("entity_management.state.PROJ", "my-proj"):
+                with session.activate():
+                    assert test_module.get_session() is session
+                    assert (
+                        test_module.get_base_url() == "session-base/resources/session-org/my-proj/_"
+                    )
+                    assert test_module.get_org("org") == "org"
+
+                    with test_module.NexusSession(proj="proj").activate():
+                        assert test_module.get_base_url() == "my-base/resources/my-org/proj/_"
+
+                    assert test_module.get_proj() == "my-proj"
+
+                assert test_module.get_session() is None
+                assert test_module.get_base_url() == "my-base/resources/my-org/my-proj/_"
+
+
+def test_session__token(monkeypatch):
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN", "global-token")
+    monkeypatch.setattr(test_module, "ACCESS_TOKEN_EXPIRY", None)
+    monkeypatch.setattr(test_module, "OFFLINE_TOKEN", None)
+
+    with test_module.NexusSession(token="session-token").activate():
+        assert test_module.get_token() == "session-token"
+        assert not test_module.has_offline_token()
+
+    with test_module.NexusSession(org="org").activate():
+        assert test_module.get_token() == "global-token"
+
+    refreshed = _access_token(3600, name="bar")
+    keycloak = Mock()
+    keycloak.refresh_token.return_value = {"access_token": refreshed}
+    monkeypatch.setattr(test_module, "KEYCLOAK", keycloak)
+    offline = jwt.encode({"typ": "Offline"}, "s" * 32, algorithm="HS256")
+
+    with test_module.NexusSession(token=offline).activate():
+        assert test_module.has_offline_token()
+        assert test_module.get_token() == refreshed
+        assert test_module.get_token() == refreshed
+        assert test_module.refresh_token("stale-token") == refreshed
+        keycloak.refresh_token.assert_called_once_with(offline)
+
+    assert test_module.get_token() == "global-token"
+
+
+def test_session__threads():
+    sessions = [test_module.NexusSession(proj=f"proj{i}") for i in range(8)]
+    barrier = threading.Barrier(len(sessions))
+
+    def get_proj(session):
+        with session.activate():
+            barrier.wait()
+            return test_module.get_proj()
+
+    with ThreadPoolExecutor(max_workers=len(sessions)) as executor:
+        projs = list(executor.map(get_proj, sessions))
+
+    assert projs == [f"proj{i}" for i in range(8)]